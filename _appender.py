@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Buffered appends to the streamed datasets of a save file, for measurements that run for days.
+
+The file is kept open in single-writer multiple-reader (SWMR) mode, so that another process can
+follow the measurement while it is written:
+>>> with h5py.File(path, "r", libver="latest", swmr=True) as h5f:
+...     ds = h5f["t1_arr"]
+...     ds.refresh()  # call again to see the rows flushed since
+The file must be created with `Base._stream_open(..., swmr=True)`, and no attribute or dataset
+can be added to it until the appender is closed.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import h5py
+import numpy as np
+
+
+class Appender:
+    """Append rows to the growable datasets of an open file, in batches.
+
+    Rows are buffered in memory and written when `chunk_rows` of them are pending, so that each
+    dataset is resized once per chunk instead of once per row. To bound the data lost if the
+    program dies, pending rows are also written and synced to disk at least every
+    `fsync_interval` seconds.
+
+    Args:
+        path: path of the save file
+        chunk_rows: number of rows written at once, best the number of rows per chunk of the
+            datasets
+        fsync_interval: maximum time in seconds between syncs to disk. If `None`, only write when
+            `chunk_rows` rows are pending and on `flush`, and leave syncing to the operating
+            system.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        chunk_rows: int = 64,
+        fsync_interval: Optional[float] = 60.0,
+    ) -> None:
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.fsync_interval = fsync_interval
+        self._h5f = h5py.File(path, "a", libver="latest")
+        self._h5f.swmr_mode = True
+        self._pending: Dict[str, List[np.ndarray]] = {}
+        self._last_sync = time.monotonic()
+
+    def append(self, rows: Dict[str, Any]) -> None:
+        """Add one or more rows to each dataset in `rows`, as `Base._stream_append`"""
+        for name, data in rows.items():
+            ds = self._h5f[name]
+            data = np.reshape(np.asarray(data, dtype=ds.dtype), (-1, *ds.shape[1:]))
+            self._pending.setdefault(name, []).append(data)
+        nr_pending = max(
+            (sum(len(data) for data in pending) for pending in self._pending.values()), default=0
+        )
+        if nr_pending >= self.chunk_rows:
+            self.flush(sync=False)
+        if (
+            self.fsync_interval is not None
+            and time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.flush()
+
+    def flush(self, sync: bool = True) -> None:
+        """Write the pending rows, and make them visible to readers.
+
+        Args:
+            sync: also wait for the file to be written to disk
+        """
+        for name, pending in self._pending.items():
+            if len(pending) == 0:
+                continue
+            data = np.concatenate(pending)
+            ds = self._h5f[name]
+            ds.resize(ds.shape[0] + data.shape[0], axis=0)
+            ds[-data.shape[0] :] = data
+            ds.flush()
+            pending.clear()
+        if sync:
+            self._h5f.flush()
+            os.fsync(self._h5f.id.get_vfd_handle())
+            self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """Write the pending rows and close the file"""
+        if not self._h5f:
+            return  # already closed
+        self.flush()
+        self._h5f.close()
+
+    def __enter__(self) -> "Appender":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
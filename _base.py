@@ -1,14 +1,25 @@
 # -*- coding: utf-8 -*-
+import ast
+import hashlib
+import inspect
 import os
 import time
-from typing import Optional
+from typing import Any, Dict, Iterable, Optional, Tuple, Type, TypeVar
 
 import h5py
 import numpy as np
 
 from presto.hardware import AdcMode, DacMode
 from presto.pulsed import Pulsed
-from presto.utils import get_sourcecode
+
+import _calibration
+import _index
+
+SHARED_SOURCE_CODE_FILE = "source_code.h5"
+LITERAL_ATTRIBUTES = ("jpa_params", "clear")
+"""Attributes saved as their `str` representation, parsed back with `ast.literal_eval`"""
+
+_T = TypeVar("_T", bound="Base")
 
 
 class Base:
@@ -25,8 +36,178 @@ class Base:
         "dac_mode": DacMode.Mixed,
     }
     """Parameters to configure the data converters (ADC and DAC)"""
+    SHARED_SOURCE_CODE: bool = False
+    """Store the source code once per data directory, in `source_code.h5`, and link to it from
+    each save file instead of embedding a copy. Use `load_source_code` to read it back."""
+    UPDATE_INDEX: bool = True
+    """Add each save file to the metadata index of its data directory, see `_index.query`"""
 
     def _save(self, script_path: str, save_filename: Optional[str] = None) -> str:
+        save_path = self._save_path(script_path, save_filename)
+        with h5py.File(save_path, "w") as h5f:
+            self._save_source_code(h5f, script_path)
+            # optional arguments left to None are restored as such by load
+            self._save_attributes(h5f, skip_none=True)
+        print(f"Data saved to: {save_path}")
+        self._update_index(save_path)
+        return save_path
+
+    def _update_index(self, save_path: str) -> None:
+        if not self.UPDATE_INDEX:
+            return
+        try:
+            _index.update(save_path, type(self).__name__)
+        except Exception as err:
+            print(f"WARN: unable to update index: {err}")
+
+    @classmethod
+    def load(cls: Type[_T], load_filename: str, lazy: bool = False) -> _T:
+        """Load a measurement from a file created by `save`.
+
+        The constructor arguments are read from the attributes and datasets with the same name,
+        and take their default value if missing (e.g. in files from older versions). All other
+        attributes and datasets are restored if the class defines them.
+
+        Args:
+            load_filename: path of the save file
+            lazy: if `True`, datasets that are not constructor arguments (e.g. `store_arr`) are
+                read only when first accessed. Contiguous datasets are then memory-mapped instead
+                of loaded in memory.
+        """
+        load_filename = os.path.realpath(load_filename)
+        lazy_datasets: Dict[str, str] = {}
+        with h5py.File(load_filename, "r") as h5f:
+            kwargs = {}
+            for name, param in inspect.signature(cls.__init__).parameters.items():
+                if name == "self" or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                    continue
+                if name in h5f.attrs:
+                    kwargs[name] = _load_attribute(name, h5f.attrs[name])
+                elif name in h5f:
+                    kwargs[name] = h5f[name][()]
+                elif param.default is param.empty:
+                    raise KeyError(f"{name} not found in {load_filename}")
+            self = cls(**kwargs)
+
+            for name, value in h5f.attrs.items():
+                if name not in kwargs and name in self.__dict__:
+                    self.__dict__[name] = _load_attribute(name, value)
+            for name in h5f:
+                if name in kwargs or name not in self.__dict__:
+                    continue
+                if lazy:
+                    del self.__dict__[name]
+                    lazy_datasets[name] = load_filename
+                else:
+                    self.__dict__[name] = h5f[name][()]
+        self._lazy_datasets = lazy_datasets
+        return self
+
+    def __getattr__(self, name: str) -> Any:
+        # only called when normal lookup fails, e.g. for datasets not yet read after a lazy load
+        lazy_datasets = self.__dict__.get("_lazy_datasets", {})
+        if name not in lazy_datasets:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        value = _read_dataset(lazy_datasets.pop(name), name)
+        self.__dict__[name] = value
+        return value
+
+    def _stream_open(
+        self,
+        script_path: str,
+        datasets: Dict[str, Tuple[Tuple[int, ...], Any]],
+        save_filename: Optional[str] = None,
+        compression: Optional[str] = None,
+        chunk_rows: int = 1,
+        swmr: bool = False,
+    ) -> str:
+        """Create the save file at the start of a measurement, so that data can be written while
+        measuring with `_stream_write` and `_stream_append`, and finalized with `_stream_close`.
+
+        Args:
+            script_path: path of the script of the measurement, as for `_save`
+            datasets: name of the streamed datasets, with their initial shape and dtype. The
+                datasets are chunked `chunk_rows` rows (first axis) at a time, and can be resized
+                along the first axis.
+            save_filename: as for `_save`
+            compression: compression filter for the streamed datasets, e.g. `"gzip"`
+            chunk_rows: number of rows per chunk, e.g. the number of rows written at once. If 1
+                (the default), 1D datasets are chunked automatically.
+            swmr: create the file with the latest file format, needed to append while other
+                processes read the file, see `_appender.Appender`
+
+        Returns:
+            the full path of the save file
+        """
+        save_path = self._save_path(script_path, save_filename)
+        with h5py.File(save_path, "w", libver="latest" if swmr else None) as h5f:
+            self._save_source_code(h5f, script_path)
+            self._save_attributes(h5f, skip=datasets.keys(), skip_none=True)
+            for name, (shape, dtype) in datasets.items():
+                h5f.create_dataset(
+                    name,
+                    shape=shape,
+                    dtype=dtype,
+                    chunks=(chunk_rows, *shape[1:]) if len(shape) > 1 or chunk_rows > 1 else True,
+                    maxshape=(None, *shape[1:]),
+                    compression=compression,
+                )
+        self._stream_path = save_path
+        self._stream_datasets = list(datasets.keys())
+        print(f"Data streamed to: {save_path}")
+        self._update_index(save_path)
+        return save_path
+
+    def _stream_write(self, name: str, index, data) -> None:
+        """Write `data` to `index` of streamed dataset `name` and flush to disk"""
+        with h5py.File(self._stream_path, "a") as h5f:
+            ds = h5f[name]
+            ds[index] = np.asarray(data, dtype=ds.dtype)
+
+    def _stream_append(self, rows: Dict[str, Any]) -> None:
+        """Grow the streamed datasets in `rows` along their first axis and write the new rows at
+        the end, opening the file only once"""
+        with h5py.File(self._stream_path, "a") as h5f:
+            for name, data in rows.items():
+                ds = h5f[name]
+                data = np.reshape(np.asarray(data, dtype=ds.dtype), (-1, *ds.shape[1:]))
+                ds.resize(ds.shape[0] + data.shape[0], axis=0)
+                ds[-data.shape[0] :] = data
+
+    def _stream_map(self, name: str, shape: Tuple[int, ...], dtype: Any) -> np.memmap:
+        """Preallocate the contiguous dataset `name` in the save file opened by `_stream_open`,
+        and map it in memory for writing.
+
+        Data assigned to slices of the returned array goes straight to the file, without going
+        through HDF5: e.g. `arr[start:stop] = chunk` converts `chunk` to `dtype` while writing.
+        The dataset is not resizable, and `load(..., lazy=True)` maps it again for reading. Call
+        `flush` on the array, or drop it, before `_stream_close`.
+        """
+        dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+        # allocate now to have an offset to map, and don't spend time writing fill values
+        dcpl.set_alloc_time(h5py.h5d.ALLOC_TIME_EARLY)
+        dcpl.set_fill_time(h5py.h5d.FILL_TIME_NEVER)
+        with h5py.File(self._stream_path, "a") as h5f:
+            dsid = h5py.h5d.create(
+                h5f.id,
+                name.encode("utf-8"),
+                h5py.h5t.py_create(np.dtype(dtype)),
+                h5py.h5s.create_simple(shape),
+                dcpl=dcpl,
+            )
+            offset = dsid.get_offset()
+        self._stream_datasets.append(name)
+        return np.memmap(self._stream_path, dtype=dtype, mode="r+", offset=offset, shape=shape)
+
+    def _stream_close(self) -> str:
+        """Update attributes and non-streamed datasets to their final value"""
+        with h5py.File(self._stream_path, "a") as h5f:
+            self._save_attributes(h5f, skip=self._stream_datasets, skip_none=True, overwrite=True)
+        print(f"Data saved to: {self._stream_path}")
+        self._update_index(self._stream_path)
+        return self._stream_path
+
+    def _save_path(self, script_path: str, save_filename: Optional[str] = None) -> str:
         script_path = os.path.realpath(script_path)  # full path of current script
 
         if save_filename is None:
@@ -38,31 +219,62 @@ class Base:
         else:
             save_path = os.path.realpath(save_filename)
 
-        source_code = get_sourcecode(
-            script_path
-        )  # save also the sourcecode of the script for future reference
-        with h5py.File(save_path, "w") as h5f:
-            dt = h5py.string_dtype(encoding="utf-8")
-            ds = h5f.create_dataset("source_code", (len(source_code),), dt)
-            for ii, line in enumerate(source_code):
-                ds[ii] = line
-
-            for attribute in self.__dict__:
-                try:
-                    if attribute.startswith("_"):
-                        # don't save private attributes
-                        continue
-                    if attribute in ["jpa_params", "clear"]:
-                        h5f.attrs[attribute] = str(self.__dict__[attribute])
-                    elif np.isscalar(self.__dict__[attribute]):
-                        h5f.attrs[attribute] = self.__dict__[attribute]
-                    else:
-                        h5f.create_dataset(attribute, data=self.__dict__[attribute])
-                except Exception as err:
-                    print(f"WARN: unable to save {attribute}: {err}")
-        print(f"Data saved to: {save_path}")
         return save_path
 
+    def _save_source_code(self, h5f: h5py.File, script_path: str) -> None:
+        # save also the sourcecode of the script for future reference, as a single string
+        with open(os.path.realpath(script_path), "r", encoding="utf-8") as f:
+            source_code = f.read()
+        sha256 = hashlib.sha256(source_code.encode("utf-8")).hexdigest()
+        h5f.attrs["source_code_sha256"] = sha256
+        if self.SHARED_SOURCE_CODE:
+            # one copy per data directory, linked from each save file
+            shared_path = os.path.join(os.path.dirname(h5f.filename), SHARED_SOURCE_CODE_FILE)
+            try:
+                with h5py.File(shared_path, "a") as shared:
+                    if sha256 not in shared:
+                        shared.create_dataset(
+                            sha256, data=source_code, dtype=h5py.string_dtype(encoding="utf-8")
+                        )
+                h5f["source_code"] = h5py.ExternalLink(SHARED_SOURCE_CODE_FILE, sha256)
+                return
+            except Exception as err:
+                print(f"WARN: unable to share source code, embedding it instead: {err}")
+        h5f.create_dataset(
+            "source_code", data=source_code, dtype=h5py.string_dtype(encoding="utf-8")
+        )
+
+    def _save_attributes(
+        self,
+        h5f: h5py.File,
+        skip: Iterable[str] = (),
+        skip_none: bool = False,
+        overwrite: bool = False,
+    ) -> None:
+        for name in list(self.__dict__.get("_lazy_datasets", ())):
+            getattr(self, name)  # read datasets not yet accessed after a lazy load
+        skip = set(skip)
+        for attribute in self.__dict__:
+            try:
+                if attribute.startswith("_"):
+                    # don't save private attributes
+                    continue
+                if attribute in skip:
+                    continue
+                if attribute in LITERAL_ATTRIBUTES:
+                    h5f.attrs[attribute] = str(self.__dict__[attribute])
+                elif np.isscalar(self.__dict__[attribute]):
+                    h5f.attrs[attribute] = self.__dict__[attribute]
+                elif skip_none and self.__dict__[attribute] is None:
+                    # e.g. not available yet when streaming, saved later by _stream_close
+                    continue
+                else:
+                    if overwrite and attribute in h5f:
+                        del h5f[attribute]
+                    h5f.create_dataset(attribute, data=self.__dict__[attribute])
+            except Exception as err:
+                print(f"WARN: unable to save {attribute}: {err}")
+
     def _jpa_setup(self, pls: Pulsed):
         self.jpa_params: Optional[dict]
         if self.jpa_params is not None:
@@ -101,19 +313,93 @@ class Base:
             return T
 
 
-def project(resp_arr, reference_templates):
-    ref_g, ref_e = reference_templates
+def _load_attribute(name: str, value: Any) -> Any:
+    if name in LITERAL_ATTRIBUTES:
+        return ast.literal_eval(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _read_dataset(load_filename: str, name: str) -> Any:
+    """Memory-map dataset `name` if stored contiguously, otherwise read it in memory"""
+    with h5py.File(load_filename, "r") as h5f:
+        ds = h5f[name]
+        offset = ds.id.get_offset()
+        if (
+            ds.chunks is not None
+            or offset is None
+            or ds.ndim == 0
+            or not ds.dtype.isnative
+            or ds.dtype.kind not in "biufc"
+        ):
+            return ds[()]
+        shape, dtype = ds.shape, ds.dtype
+    return np.memmap(load_filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def load_source_code(load_filename: str) -> str:
+    """Load the source code of the script that created a save file.
+
+    Handles both the current layout (a single string, possibly linked to the shared
+    `source_code.h5` of the data directory) and the old layout (one string per line).
+    """
+    with h5py.File(load_filename, "r") as h5f:
+        try:
+            ds = h5f["source_code"]
+        except KeyError:
+            sha256 = h5f.attrs.get("source_code_sha256")
+            raise KeyError(
+                f"source code not found in {load_filename}: was it saved with a shared "
+                f"{SHARED_SOURCE_CODE_FILE} (hash {sha256}) that is missing?"
+            ) from None
+        if ds.shape == ():
+            return ds.asstr()[()]
+        lines = ds.asstr()[()]
+    return "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+
+
+def project(
+    resp_arr,
+    reference_templates,
+    single_precision: bool = False,
+    chunk_size: Optional[int] = None,
+):
+    """Project single traces on the reference templates for |g> and |e>.
+
+    Args:
+        resp_arr: traces to project, shape `(nr_traces, nr_samples)`. Can be anything that
+            supports slicing along the first axis, e.g. an `h5py.Dataset` or a `np.memmap`.
+        reference_templates: tuple `(ref_g, ref_e)`, each of length `nr_samples`, or the key of
+            a calibration in the default data directory, see `_calibration`.
+        single_precision: compute in `complex64` instead of `complex128`.
+        chunk_size: number of traces to process at once. If `None`, process all at once.
+
+    Returns:
+        the projected data, normalized so that |g> is 0.0 and |e> is 1.0
+    """
+    if isinstance(reference_templates, str):
+        reference_templates = _calibration.get_store().templates(reference_templates)
+    ref_g, ref_e = np.asarray(reference_templates[0]), np.asarray(reference_templates[1])
+    dtype = np.complex64 if single_precision else np.complex128
     conj_g = ref_g.conj()
     conj_e = ref_e.conj()
     norm_g = np.sum(ref_g * conj_g).real
     norm_e = np.sum(ref_e * conj_e).real
     overlap = np.sum(ref_g * conj_e).real
-    proj_g = np.zeros(resp_arr.shape[0])
-    proj_e = np.zeros(resp_arr.shape[0])
-    for i in range(resp_arr.shape[0]):
-        proj_g[i] = np.sum(conj_g * resp_arr[i, :]).real
-        proj_e[i] = np.sum(conj_e * resp_arr[i, :]).real
-    res = proj_e - proj_g
+
+    # project on the difference, the two matrix-vector products are linear
+    conj_diff = (conj_e - conj_g).astype(dtype)
+
+    nr_traces = resp_arr.shape[0]
+    if chunk_size is None:
+        chunk_size = max(nr_traces, 1)
+    res = np.zeros(nr_traces)
+    for start in range(0, nr_traces, chunk_size):
+        stop = min(start + chunk_size, nr_traces)
+        chunk = np.asarray(resp_arr[start:stop], dtype=dtype)
+        res[start:stop] = (chunk @ conj_diff).real
+
     res_g = overlap - norm_g
     res_e = norm_e - overlap
     res_min = res_g
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Calibrations shared between measurements, e.g. the template-matching references from `ReadoutRef`.
+
+The store is an HDF5 file `calibration.h5` in the data directory, with one group per key. Each
+entry records its provenance: the save file it was computed from and its modification time, the
+parameters of the analysis, and when it was stored.
+
+Example: calibrate from the last `ReadoutRef`, then use the calibration by key
+>>> pipeline = ReadoutPipeline("q1")
+>>> pipeline.calibrate()  # analyzes the last ReadoutRef only if not done already
+>>> reset = pipeline.readout_reset(readout_freq=..., ...)  # templates, threshold and delay set
+>>> t1.analyze_batch("q1")  # or project(resp_arr, "q1")
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import h5py
+import numpy as np
+
+import _index
+
+CALIBRATION_FILENAME = "calibration.h5"
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+"""Where `Base` saves by default, next to the scripts"""
+
+
+class CalibrationStore:
+    """Calibrations of a data directory, by key.
+
+    Entries are cached in memory, and read again only if the file changed.
+    """
+
+    def __init__(self, data_dir: str = DEFAULT_DATA_DIR) -> None:
+        self.data_dir = os.path.realpath(data_dir)
+        self.path = os.path.join(self.data_dir, CALIBRATION_FILENAME)
+        self._cache: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self._cache_mtime: Optional[float] = None
+
+    def put(
+        self,
+        key: str,
+        values: Dict[str, Any],
+        source: Optional[str] = None,
+        params: Optional[dict] = None,
+    ) -> None:
+        """Store `values` under `key`, replacing any previous entry.
+
+        Args:
+            key: name of the calibration, e.g. the qubit
+            values: scalars and arrays
+            source: path of the save file the values were computed from
+            params: parameters of the analysis that computed the values
+        """
+        provenance = {
+            "source": "" if source is None else os.path.realpath(source),
+            "source_mtime": np.nan if source is None else os.stat(source).st_mtime,
+            "params": repr(params or {}),
+            "time": time.time(),
+        }
+        os.makedirs(self.data_dir, exist_ok=True)
+        with h5py.File(self.path, "a") as h5f:
+            if key in h5f:
+                del h5f[key]
+            group = h5f.create_group(key)
+            for name, value in values.items():
+                group.create_dataset(name, data=value)
+            group.attrs.update(provenance)
+        self._cache = {}
+        self._cache_mtime = None
+
+    def get(self, key: str) -> Dict[str, Any]:
+        """The values stored under `key`"""
+        return self._read(key)[0]
+
+    def provenance(self, key: str) -> Dict[str, Any]:
+        """Where and when the values under `key` come from, see `put`"""
+        return self._read(key)[1]
+
+    def templates(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """The reference templates `(ref_g, ref_e)` under `key`, e.g. for `project`"""
+        values = self.get(key)
+        return values["ref_g"], values["ref_e"]
+
+    def is_current(self, key: str, source: str, params: Optional[dict] = None) -> bool:
+        """Whether `key` was computed from `source`, unchanged since, with the same `params`"""
+        if key not in self:
+            return False
+        provenance = self.provenance(key)
+        return (
+            provenance["source"] == os.path.realpath(source)
+            and provenance["source_mtime"] == os.stat(source).st_mtime
+            and provenance["params"] == repr(params or {})
+        )
+
+    def keys(self) -> List[str]:
+        if not os.path.exists(self.path):
+            return []
+        with h5py.File(self.path, "r") as h5f:
+            return list(h5f)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def _read(self, key: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        mtime = os.stat(self.path).st_mtime if os.path.exists(self.path) else None
+        if mtime != self._cache_mtime:
+            self._cache = {}
+            self._cache_mtime = mtime
+        if key not in self._cache:
+            if mtime is None:
+                raise KeyError(f"no calibrations in {self.data_dir}")
+            with h5py.File(self.path, "r") as h5f:
+                if key not in h5f:
+                    raise KeyError(f"calibration {key} not found in {self.path}")
+                group = h5f[key]
+                values = {name: _value(ds[()]) for name, ds in group.items()}
+                provenance = {name: _value(value) for name, value in group.attrs.items()}
+            self._cache[key] = (values, provenance)
+        return self._cache[key]
+
+
+class ReadoutPipeline:
+    """From a `ReadoutRef` to the template-matching calibration of the measurements that use it.
+
+    `calibrate` analyzes a `ReadoutRef` and stores the templates `ref_g` and `ref_e`, the
+    comparator `threshold`, `readout_match_delay` and `match_len` under `key`. A save file that
+    was already analyzed with the same parameters is not analyzed again.
+
+    Args:
+        key: name of the calibration, e.g. the qubit
+        store: where to keep the calibration, or the data directory of one
+        analyze_kwargs: arguments to `ReadoutRef.analyze`, e.g. `rotate` or `match_len`
+    """
+
+    def __init__(
+        self,
+        key: str,
+        store: Union[None, str, CalibrationStore] = None,
+        analyze_kwargs: Optional[dict] = None,
+    ) -> None:
+        if store is None:
+            store = get_store()
+        elif isinstance(store, str):
+            store = get_store(store)
+        self.key = key
+        self.store = store
+        self.analyze_kwargs = analyze_kwargs or {}
+
+    def run(
+        self,
+        ref,
+        presto_address: str,
+        presto_port: Optional[int] = None,
+        ext_ref_clk: bool = False,
+    ) -> Dict[str, Any]:
+        """Run the `ReadoutRef` measurement `ref`, and calibrate from it"""
+        save_path = ref.run(presto_address, presto_port, ext_ref_clk)
+        return self.calibrate(save_path, ref)
+
+    def calibrate(
+        self,
+        source: Optional[str] = None,
+        ref=None,
+        force: bool = False,
+    ) -> Dict[str, Any]:
+        """Calibrate from a `ReadoutRef` save file.
+
+        Args:
+            source: path of the save file. If `None`, the last `ReadoutRef` in the data directory
+                of the store, see `_index.query`.
+            ref: the `ReadoutRef` already in memory for `source`, to save loading it
+            force: analyze even if `source` was already analyzed with the same parameters
+
+        Returns:
+            the stored values
+        """
+        if source is None:
+            found = _index.query(self.store.data_dir, experiment="ReadoutRef", limit=1)
+            if len(found) == 0:
+                raise LookupError(f"no ReadoutRef in {self.store.data_dir}")
+            source = found[0]
+        if not force and self.store.is_current(self.key, source, self.analyze_kwargs):
+            return self.store.get(self.key)
+
+        from readout_ref import ReadoutRef
+        from readout_reset import _threshold
+
+        if ref is None:
+            ref = ReadoutRef.load(source, lazy=True)
+        ret = ref.analyze(**{**self.analyze_kwargs, "plot": False})
+        values = {
+            "ref_g": ret["ref_g"],
+            "ref_e": ret["ref_e"],
+            "threshold": _threshold(ret["ref_g"], ret["ref_e"]),
+            "readout_match_delay": ret["readout_match_delay"],
+            "match_len": ret["match_len"],
+        }
+        self.store.put(self.key, values, source=source, params=self.analyze_kwargs)
+        return self.store.get(self.key)
+
+    def readout_reset(self, **kwargs):
+        """A `ReadoutReset` with this calibration, see `ReadoutReset.from_calibration`"""
+        from readout_reset import ReadoutReset
+
+        return ReadoutReset.from_calibration(self.key, self.store, **kwargs)
+
+
+_STORES: Dict[str, CalibrationStore] = {}
+
+
+def get_store(data_dir: str = DEFAULT_DATA_DIR) -> CalibrationStore:
+    """The store of `data_dir`, shared so that its cache is reused"""
+    data_dir = os.path.realpath(data_dir)
+    if data_dir not in _STORES:
+        _STORES[data_dir] = CalibrationStore(data_dir)
+    return _STORES[data_dir]
+
+
+def _value(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
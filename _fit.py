@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+Batched least-squares fitting of many independent curves with the same model.
+
+All curves are fitted at once by a Levenberg-Marquardt solver vectorized across curves, instead of
+one call to `scipy.optimize.curve_fit` per curve. The model functions take the parameters as
+arrays of shape `(nr_curves, 1)`, so the usual numpy expressions such as `t1._decay` work as is.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+_EPS = np.finfo(np.float64).eps
+
+
+def decay(t, T, xe, xg):
+    return xg + (xe - xg) * np.exp(-t / T)
+
+
+def damped_cosine(t, offset, amplitude, T2, frequency, phase):
+    return offset + amplitude * np.exp(-t / T2) * np.cos(2.0 * np.pi * frequency * t + phase)
+
+
+def decay_p0(t, y) -> np.ndarray:
+    """Initial guess for `decay`, one row per curve in `y`"""
+    y = np.atleast_2d(y)
+    T = np.full(len(y), 0.5 * (np.max(t) - np.min(t)))
+    return np.stack((T, y[:, 0], y[:, -1]), axis=-1)
+
+
+def optimal_decay_delays(T: float, t_min: float, t_max: float, nr_delays: int) -> np.ndarray:
+    """Delays in `[t_min, t_max]` that are most informative on the decay time `T` of `decay`.
+
+    This is the design that minimizes the variance of the fitted `T`, with `xe` and `xg` as
+    nuisance parameters. It has three support points: `t_min`, `t_max` and one inner delay,
+    searched among 201 uniformly spaced candidates. For each choice, the optimal weights follow
+    from Elfving's theorem. The weights are then rounded to `nr_delays` points. Repeated delays
+    are returned sorted, and stand for more averaging at that delay.
+    """
+    candidates = np.linspace(t_min, t_max, 201)
+    x = np.exp(-candidates / T)
+    # gradient of decay with respect to (T, xe, xg), the amplitude doesn't change the design
+    grad = np.stack((candidates / T**2 * x, x, 1.0 - x), axis=-1)
+    inner = np.arange(1, len(candidates) - 1)
+    support = np.stack(
+        (np.zeros_like(inner), inner, np.full_like(inner, len(candidates) - 1)), axis=-1
+    )
+    # with as many points as parameters, var(T) = (sum |u|)**2 with weights proportional to |u|,
+    # where u solves X.T @ u = (1, 0, 0) for the gradients X at the support points
+    X = grad[support]
+    rhs = np.zeros((len(inner), 3, 1))
+    rhs[:, 0] = 1.0
+    with np.errstate(invalid="ignore"):
+        u = np.abs(np.linalg.solve(np.swapaxes(X, -1, -2), rhs)[..., 0])
+    best = np.nanargmin(np.sum(u, axis=-1))
+    weights = u[best] / np.sum(u[best])
+
+    # largest remainder rounding of the weights to nr_delays points
+    counts = np.floor(weights * nr_delays).astype(np.int64)
+    remainders = weights * nr_delays - counts
+    counts[np.argsort(remainders)[::-1][: nr_delays - np.sum(counts)]] += 1
+    return np.repeat(candidates[support[best]], counts)
+
+
+def fit_decay(t, y) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit `decay` by variable projection.
+
+    Only the decay time is searched, the offset and the amplitude are solved by linear least
+    squares at each step. The search is started from each matrix-pencil estimate of the decay
+    rate if `t` is uniformly spaced, and from a scan of the decay time, and the best result is
+    kept.
+
+    Returns:
+        `(popt, perr)` as from `curve_fit`, with `popt = (T, xe, xg)`
+
+    Raises:
+        RuntimeError: if the fit fails
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    span = np.max(t) - np.min(t)
+
+    def basis(theta):
+        return np.stack((np.ones_like(t), np.exp(-t * np.exp(-theta[0]))), axis=-1)
+
+    seeds = []
+    dt = _uniform_step(t)
+    if dt is not None:
+        z = _matrix_pencil(y, 2)
+        z = z[(np.abs(z.imag) < 1e-9) & (z.real > 0.0) & (z.real < 1.0)].real
+        # one pole is the offset, at 1, but with a small offset it's a noise pole instead
+        seeds += [np.log(-dt / np.log(zz)) for zz in z]
+    seeds.append(np.log(_scan(basis, y, np.log(span * np.logspace(-2, 2, 41)))))
+
+    best = None
+    for log_T0 in seeds:
+        if not np.isfinite(log_T0):
+            continue
+        try:
+            theta, coef, cost = _varpro(basis, y, [log_T0])
+        except RuntimeError:
+            continue
+        if best is None or cost < best[2]:
+            best = (theta, coef, cost)
+    if best is None:
+        raise RuntimeError("fit failed")
+    theta, (xg, amp), _cost = best
+    popt = np.array([np.exp(theta[0]), xg + amp, xg])
+    return popt, _curve_fit_errors(decay, t, y, popt)
+
+
+def fit_damped_cosine(t, y) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit `damped_cosine` by variable projection.
+
+    Only the decay time and the frequency are searched, the offset and the cosine and sine
+    amplitudes are solved by linear least squares at each step. The search is started from the
+    matrix-pencil estimate of the complex pole and from the peak of the spectrum, and the best
+    result is kept; `t` must be uniformly spaced.
+
+    Returns:
+        `(popt, perr)` as from `curve_fit`, with `popt = (offset, amplitude, T2, frequency,
+        phase)` and a positive amplitude and frequency
+
+    Raises:
+        RuntimeError: if the fit fails
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dt = _uniform_step(t)
+    if dt is None:
+        raise RuntimeError("fit_damped_cosine needs uniformly spaced t")
+
+    def basis(theta):
+        envelope = np.exp(-t * np.exp(-theta[0]))
+        arg = 2.0 * np.pi * theta[1] * t
+        return np.stack((np.ones_like(t), envelope * np.cos(arg), envelope * np.sin(arg)), axis=-1)
+
+    span = np.max(t) - np.min(t)
+    rate, frequency = _damped_cosine_pencil(y, dt, span)
+    seeds = [[-np.log(rate), frequency]]
+    # the pencil is biased at low signal-to-noise ratio, try also the peak of the spectrum
+    seeds.append([np.log(0.5 * span), damped_cosine_p0(t, y)[0, 3]])
+
+    best = None
+    for theta0 in seeds:
+        if not np.all(np.isfinite(theta0)):
+            continue
+        try:
+            theta, coef, cost = _varpro(basis, y, theta0)
+        except RuntimeError:
+            continue
+        if best is None or cost < best[2]:
+            best = (theta, coef, cost)
+    if best is None:
+        raise RuntimeError("fit failed")
+    theta, (offset, a, b), _cost = best
+    # a * cos(x) + b * sin(x) = amplitude * cos(x + phase)
+    amplitude = np.hypot(a, b)
+    phase = np.arctan2(-b, a)
+    popt = np.array([offset, amplitude, np.exp(theta[0]), theta[1], phase])
+    if popt[3] < 0.0:
+        popt[3] = -popt[3]
+        popt[4] = -popt[4]
+    return popt, _curve_fit_errors(damped_cosine, t, y, popt)
+
+
+def _uniform_step(t) -> Optional[float]:
+    if len(t) < 3:
+        return None
+    steps = np.diff(t)
+    if np.allclose(steps, steps[0], rtol=1e-6, atol=0.0) and steps[0] > 0.0:
+        return float(steps[0])
+    return None
+
+
+def _matrix_pencil(y, order: int) -> np.ndarray:
+    """Poles `z` of a sum of `order` damped exponentials `y[n] = sum(c * z**n)`.
+
+    `y` can be a stack of curves along the last axis, the poles are then of shape
+    `(..., order)`.
+    """
+    nr_points = y.shape[-1]
+    pencil = max(nr_points // 3, order)
+    hankel = np.lib.stride_tricks.sliding_window_view(y, pencil + 1, axis=-1)
+    _u, _s, vh = np.linalg.svd(hankel, full_matrices=False)
+    v = np.swapaxes(vh[..., :order, :].conj(), -1, -2)
+    return np.linalg.eigvals(np.linalg.pinv(v[..., :-1, :]) @ v[..., 1:, :])
+
+
+def _damped_cosine_pencil(y, dt: float, span: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Decay rate and frequency of `damped_cosine` from the matrix pencil, for each curve in `y`"""
+    z = _matrix_pencil(y, 3)
+    # one of the pair of the damped oscillation
+    z = np.take_along_axis(z, np.argmax(np.abs(z.imag), axis=-1)[..., None], axis=-1)[..., 0]
+    frequency = np.abs(np.angle(z)) / (2.0 * np.pi * dt)
+    with np.errstate(divide="ignore"):
+        rate = -np.log(np.abs(z)) / dt
+    # undamped or growing, start from a long decay
+    rate = np.where(np.isfinite(rate) & (rate > 1.0 / (100.0 * span)), rate, 1.0 / span)
+    return rate, frequency
+
+
+def _linear_solve(basis_matrix, y):
+    # normal equations, fine for the few well separated basis functions used here
+    try:
+        return np.linalg.solve(basis_matrix.T @ basis_matrix, basis_matrix.T @ y)
+    except np.linalg.LinAlgError:
+        coef, *_ = np.linalg.lstsq(basis_matrix, y, rcond=None)
+        return coef
+
+
+def _scan(basis, y, log_T_arr) -> float:
+    costs = []
+    for log_T in log_T_arr:
+        phi = basis([log_T])
+        costs.append(np.sum((phi @ _linear_solve(phi, y) - y) ** 2))
+    return float(np.exp(log_T_arr[np.nanargmin(costs)]))
+
+
+def _varpro(basis, y, theta0, max_iter: int = 100, xtol: float = 1.5e-8, ftol: float = 1.5e-8):
+    # Levenberg-Marquardt on the few nonlinear parameters, with the linear ones projected out
+
+    def residuals(theta):
+        phi = basis(theta)
+        return phi @ _linear_solve(phi, y) - y
+
+    theta = np.asarray(theta0, dtype=np.float64)
+    nr_theta = len(theta)
+    with np.errstate(all="ignore"):
+        r = residuals(theta)
+        cost = np.sum(r**2)
+        lam = 1e-3
+        for _ in range(max_iter):
+            jac = np.empty((len(y), nr_theta))
+            for kk in range(nr_theta):
+                h = np.sqrt(_EPS) * max(abs(theta[kk]), 1.0)
+                theta_h = theta.copy()
+                theta_h[kk] += h
+                jac[:, kk] = (residuals(theta_h) - r) / h
+            jtj = jac.T @ jac
+            scale = 1.0 / np.sqrt(np.maximum(np.diag(jtj), _EPS))
+            damped = jtj * np.outer(scale, scale) + lam * np.eye(nr_theta)
+            step = -scale * np.linalg.solve(damped, scale * (jac.T @ r))
+            r_new = residuals(theta + step)
+            cost_new = np.sum(r_new**2)
+            if np.isfinite(cost_new) and cost_new < cost:
+                converged = np.all(np.abs(step) <= xtol * (np.abs(theta) + xtol)) or (
+                    cost - cost_new <= ftol * cost
+                )
+                theta, r, cost = theta + step, r_new, cost_new
+                lam = max(lam / 10, 1e-15)
+                if converged:
+                    break
+            else:
+                lam *= 10
+                if lam > 1e15:
+                    break  # no step reduces the cost any more
+    if not np.all(np.isfinite(theta)) or not np.isfinite(cost):
+        raise RuntimeError("fit failed")
+    return theta, _linear_solve(basis(theta), y), cost
+
+
+def _curve_fit_errors(func, t, y, popt) -> np.ndarray:
+    # standard errors of all the parameters, as in curve_fit with absolute_sigma=False
+    r = func(t, *popt) - y
+    jac = np.empty((len(t), len(popt)))
+    for kk in range(len(popt)):
+        h = np.sqrt(_EPS) * abs(popt[kk]) if popt[kk] != 0.0 else np.sqrt(_EPS)
+        p_h = popt.copy()
+        p_h[kk] += h
+        jac[:, kk] = (func(t, *p_h) - y - r) / h
+    jtj = jac.T @ jac
+    scale = 1.0 / np.sqrt(np.maximum(np.diag(jtj), _EPS))
+    cov = np.linalg.pinv(jtj * np.outer(scale, scale)) * np.outer(scale, scale)
+    s_sq = np.sum(r**2) / max(len(t) - len(popt), 1)
+    return np.sqrt(np.diag(cov) * s_sq)
+
+
+def damped_cosine_p0(t, y) -> np.ndarray:
+    """Initial guess for `damped_cosine` from the peak of the FFT, one row per curve in `y`.
+
+    `t` must be uniformly spaced.
+    """
+    y = np.atleast_2d(y)
+    nr_curves = len(y)
+    pkpk = np.max(y, axis=-1) - np.min(y, axis=-1)
+    offset = np.min(y, axis=-1) + pkpk / 2
+    amplitude = 0.5 * pkpk
+    T2 = np.full(nr_curves, 0.5 * (np.max(t) - np.min(t)))
+    freqs = np.fft.rfftfreq(len(t), t[1] - t[0])
+    fft = np.fft.rfft(y, axis=-1)
+    fft[:, 0] = 0
+    idx_max = np.argmax(np.abs(fft), axis=-1)
+    frequency = freqs[idx_max]
+    phase = np.angle(fft[np.arange(nr_curves), idx_max])
+    return np.stack((offset, amplitude, T2, frequency, phase), axis=-1)
+
+
+def fit_damped_cosine_p0(t, y) -> np.ndarray:
+    """Initial guess for `damped_cosine` from the matrix pencil, one row per curve in `y`.
+
+    As the seeds of `fit_damped_cosine`, but for all curves at once: the decay time and frequency
+    are from the matrix pencil or from `damped_cosine_p0`, whichever fits better with the offset,
+    amplitude and phase solved by linear least squares. Curves with NaN get the guess of
+    `damped_cosine_p0`. `t` must be uniformly spaced.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    p0 = damped_cosine_p0(t, y)
+    dt = _uniform_step(t)
+    finite = np.all(np.isfinite(y), axis=-1)
+    if dt is None or not np.any(finite):
+        return p0
+    y_ok = y[finite]
+    span = np.max(t) - np.min(t)
+
+    rate, frequency = _damped_cosine_pencil(y_ok, dt, span)
+    # the pencil is biased at low signal-to-noise ratio, try also the peak of the spectrum
+    seeds = [(rate, frequency), (np.full_like(rate, 2.0 / span), p0[finite, 3])]
+    best_cost = np.full(len(y_ok), np.inf)
+    best = np.empty((len(y_ok), 5))
+    for rate, frequency in seeds:
+        envelope = np.exp(-t * rate[:, None])
+        arg = 2.0 * np.pi * frequency[:, None] * t
+        phi = np.stack(
+            (np.ones_like(envelope), envelope * np.cos(arg), envelope * np.sin(arg)), axis=-1
+        )
+        coef = (np.linalg.pinv(phi) @ y_ok[..., None])[..., 0]
+        cost = np.sum(((phi @ coef[..., None])[..., 0] - y_ok) ** 2, axis=-1)
+        # a * cos(x) + b * sin(x) = amplitude * cos(x + phase)
+        offset, a, b = coef.T
+        params = np.stack(
+            (offset, np.hypot(a, b), 1.0 / rate, frequency, np.arctan2(-b, a)), axis=-1
+        )
+        better = cost < best_cost
+        best[better] = params[better]
+        best_cost[better] = cost[better]
+    p0[finite] = np.where(np.isfinite(best_cost)[:, None], best, p0[finite])
+    return p0
+
+
+def fit_batch(
+    func: Callable,
+    x,
+    y,
+    p0,
+    max_iter: int = 200,
+    xtol: float = 1e-10,
+    ftol: float = 1e-12,
+    nr_processes: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Fit `func` independently to each curve in `y`.
+
+    Args:
+        func: model `func(x, *params)`, each parameter is passed with shape `(nr_curves, 1)`
+        x: independent variable, shape `(nr_points,)` if common to all curves, or
+            `(nr_curves, nr_points)`
+        y: data, shape `(nr_curves, nr_points)`
+        p0: initial guess, shape `(nr_curves, nr_params)`
+        max_iter: maximum number of iterations
+        xtol: stop when the relative change of all the parameters is smaller than this
+        ftol: stop when the relative decrease of the sum of squares is smaller than this
+        nr_processes: split the curves among this many processes. If `None`, fit in the current
+            process. `func` must then be a module-level function.
+
+    Returns:
+        `(popt, perr, success)`: fitted parameters and their standard errors, estimated as in
+        `curve_fit`, with shape `(nr_curves, nr_params)`; and whether each fit converged. Curves
+        that didn't converge, or that contain NaN, have NaN parameters and errors.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    p0 = np.atleast_2d(np.asarray(p0, dtype=np.float64))
+    if x.ndim == 1:
+        x = x[None, :]
+    nr_curves = len(y)
+    if p0.shape[0] != nr_curves:
+        p0 = np.broadcast_to(p0, (nr_curves, p0.shape[-1]))
+
+    if nr_processes is None or nr_processes < 2 or nr_curves < 2:
+        return _levenberg_marquardt(func, x, y, p0, max_iter, xtol, ftol)
+
+    chunks = np.array_split(np.arange(nr_curves), min(nr_processes, nr_curves))
+    with ProcessPoolExecutor(len(chunks)) as executor:
+        futures = [
+            executor.submit(
+                _levenberg_marquardt,
+                func,
+                x if len(x) == 1 else x[chunk],
+                y[chunk],
+                p0[chunk],
+                max_iter,
+                xtol,
+                ftol,
+            )
+            for chunk in chunks
+        ]
+        results = [future.result() for future in futures]
+    popt, perr, success = zip(*results)
+    return np.concatenate(popt), np.concatenate(perr), np.concatenate(success)
+
+
+def _levenberg_marquardt(func, x, y, p0, max_iter, xtol, ftol):
+    nr_curves, nr_points = y.shape
+    nr_params = p0.shape[-1]
+    x_shared = len(x) == 1
+
+    def residuals(p, rows):
+        _x = x if x_shared else x[rows]
+        return func(_x, *p.T[:, :, None]) - y[rows]
+
+    def jacobian(p, r, rows):
+        # forward differences, all curves at once, step as in MINPACK
+        jac = np.empty((len(rows), nr_points, nr_params))
+        for kk in range(nr_params):
+            h = np.sqrt(_EPS) * np.abs(p[:, kk])
+            h[h == 0.0] = np.sqrt(_EPS)
+            p_h = p.copy()
+            p_h[:, kk] += h
+            jac[:, :, kk] = (residuals(p_h, rows) - r) / h[:, None]
+        return jac
+
+    p = p0.copy()
+    all_rows = np.arange(nr_curves)
+    with np.errstate(all="ignore"):
+        r = residuals(p, all_rows)
+        cost = np.sum(r**2, axis=-1)
+        active = np.isfinite(cost) & np.all(np.isfinite(p), axis=-1)
+        success = np.zeros(nr_curves, bool)
+        lam = np.full(nr_curves, 1e-3)
+
+        for _ in range(max_iter):
+            rows = np.flatnonzero(active)
+            if len(rows) == 0:
+                break
+            p_a, r_a, cost_a = p[rows], r[rows], cost[rows]
+            jac = jacobian(p_a, r_a, rows)
+            jtj = np.einsum("mnp,mnq->mpq", jac, jac)
+            grad = np.einsum("mnp,mn->mp", jac, r_a)
+            # solve in parameters scaled by the norm of the columns of the Jacobian, the scales
+            # of e.g. a frequency and a decay time differ by many orders of magnitude
+            scale = 1.0 / np.sqrt(np.maximum(np.diagonal(jtj, axis1=1, axis2=2), _EPS))
+            damped = jtj * scale[:, :, None] * scale[:, None, :]
+            damped += lam[rows, None, None] * np.eye(nr_params)
+            step = -scale * np.einsum("mpq,mq->mp", np.linalg.pinv(damped), scale * grad)
+
+            p_new = p_a + step
+            r_new = residuals(p_new, rows)
+            cost_new = np.sum(r_new**2, axis=-1)
+            better = np.isfinite(cost_new) & (cost_new < cost_a)
+
+            idx = rows[better]
+            p[idx] = p_new[better]
+            r[idx] = r_new[better]
+            cost[idx] = cost_new[better]
+            lam[rows] = np.where(better, np.maximum(lam[rows] / 10, 1e-15), lam[rows] * 10)
+
+            small_step = np.all(np.abs(step) <= xtol * (np.abs(p_a) + xtol), axis=-1)
+            small_decrease = cost_a - cost_new <= ftol * cost_a
+            done = better & (small_step | small_decrease) | (cost[rows] == 0.0)
+            success[rows[done]] = True
+            stuck = ~better & (lam[rows] > 1e15)  # no step reduces the cost any more
+            if np.any(stuck):
+                # converged only if even the Gauss-Newton step would reduce the cost by less
+                # than ftol, otherwise the fit stalled away from the minimum
+                g = scale[stuck] * grad[stuck]
+                jtj_scaled = jtj[stuck] * scale[stuck, :, None] * scale[stuck, None, :]
+                predicted = np.einsum("mp,mpq,mq->m", g, np.linalg.pinv(jtj_scaled), g)
+                success[rows[stuck][predicted <= ftol * cost_a[stuck]]] = True
+            active[rows[done | stuck]] = False
+
+        # standard errors as in curve_fit with absolute_sigma=False
+        popt = np.full_like(p, np.nan)
+        perr = np.full_like(p, np.nan)
+        rows = np.flatnonzero(success)
+        if len(rows) > 0:
+            jac = jacobian(p[rows], r[rows], rows)
+            jtj = np.einsum("mnp,mnq->mpq", jac, jac)
+            scale = 1.0 / np.sqrt(np.maximum(np.diagonal(jtj, axis1=1, axis2=2), _EPS))
+            cov = np.linalg.pinv(jtj * scale[:, :, None] * scale[:, None, :])
+            cov *= scale[:, :, None] * scale[:, None, :]
+            dof = max(nr_points - nr_params, 1)
+            s_sq = cost[rows] / dof
+            popt[rows] = p[rows]
+            perr[rows] = np.sqrt(np.diagonal(cov, axis1=1, axis2=2) * s_sq[:, None])
+
+    return popt, perr, success
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Histograms of data that arrive in chunks, e.g. millions of single-shot readout results, in
+constant memory.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+class StreamingHistogram:
+    """Histograms with shared bins of several streams of data, and their running moments.
+
+    The bins have equal width. The range starts around the first chunk of data, and doubles, by
+    merging pairs of bins, whenever data falls outside of it, so that the counts stay exact.
+    Mean and variance are kept separately below and above `threshold`, e.g. for the two states
+    of a qubit.
+
+    Args:
+        nr_streams: number of streams, i.e. of columns in the data passed to `update`
+        nr_bins: number of bins, even
+        threshold: the moments are split at this value
+    """
+
+    def __init__(self, nr_streams: int = 1, nr_bins: int = 4096, threshold: float = 0.0) -> None:
+        if nr_bins % 2 != 0:
+            raise ValueError("nr_bins must be even")
+        self.nr_streams = nr_streams
+        self.nr_bins = nr_bins
+        self.threshold = threshold
+        self.counts = np.zeros((nr_streams, nr_bins), np.int64)
+        self.low = 0.0  # lower edge of the first bin, replaced by update
+        self.width = 0.0  # bin width, replaced by update
+        # count, mean and sum of squared deviations, below and above threshold
+        self._n = np.zeros((nr_streams, 2), np.int64)
+        self._mean = np.zeros((nr_streams, 2), np.float64)
+        self._m2 = np.zeros((nr_streams, 2), np.float64)
+
+    @property
+    def high(self) -> float:
+        return self.low + self.nr_bins * self.width
+
+    @property
+    def edges(self) -> np.ndarray:
+        return self.low + self.width * np.arange(self.nr_bins + 1)
+
+    @property
+    def centers(self) -> np.ndarray:
+        return self.low + self.width * (np.arange(self.nr_bins) + 0.5)
+
+    def update(self, data) -> None:
+        """Add a chunk of data, of shape `(nr_samples, nr_streams)`"""
+        data = np.asarray(data, dtype=np.float64).reshape(-1, self.nr_streams)
+        if len(data) == 0:
+            return
+        data_min = np.min(data)
+        data_max = np.max(data)
+        if self.width == 0.0:
+            # first chunk: some margin around it
+            margin = 0.5 * (data_max - data_min) or 1.0
+            self.low = data_min - margin
+            self.width = (data_max - data_min + 2 * margin) / self.nr_bins
+        while data_min < self.low:
+            self._grow(left=True)
+        while data_max >= self.high:
+            self._grow(left=False)
+
+        # one contiguous row per stream: numpy is slow reducing along short axes
+        for ss, row in enumerate(np.ascontiguousarray(data.T)):
+            idx = np.clip(((row - self.low) / self.width).astype(np.int64), 0, self.nr_bins - 1)
+            self.counts[ss] += np.bincount(idx, minlength=self.nr_bins)
+
+            # merge the moments of the chunk into the running ones (Chan et al.)
+            high = row >= self.threshold
+            for side, x in enumerate((row[~high], row[high])):
+                if len(x) == 0:
+                    continue
+                n_a = self._n[ss, side]
+                n = n_a + len(x)
+                mean_b = np.mean(x)
+                delta = mean_b - self._mean[ss, side]
+                self._mean[ss, side] += delta * len(x) / n
+                self._m2[ss, side] += np.sum((x - mean_b) ** 2) + delta**2 * n_a * len(x) / n
+                self._n[ss, side] = n
+
+    def _grow(self, left: bool) -> None:
+        # double the range towards the left or the right, keeping the number of bins
+        merged = self.counts.reshape(self.nr_streams, -1, 2).sum(axis=-1)
+        self.counts[:] = 0
+        if left:
+            self.counts[:, self.nr_bins // 2 :] = merged
+            self.low -= self.nr_bins * self.width
+        else:
+            self.counts[:, : self.nr_bins // 2] = merged
+        self.width *= 2
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of samples in each stream"""
+        return np.sum(self._n, axis=-1)
+
+    def moments(self) -> np.ndarray:
+        """Mean, standard deviation and fraction of the samples below and above `threshold`.
+
+        Returns:
+            array of shape `(nr_streams, 6)`, each row `(mean_low, std_low, weight_low,
+            mean_high, std_high, weight_high)` like the parameters of a double Gaussian
+        """
+        n = np.maximum(self._n, 1)
+        std = np.sqrt(self._m2 / n)
+        weight = self._n / np.maximum(self.count, 1)[:, None]
+        return np.stack(
+            (
+                self._mean[:, 0],
+                std[:, 0],
+                weight[:, 0],
+                self._mean[:, 1],
+                std[:, 1],
+                weight[:, 1],
+            ),
+            axis=-1,
+        )
+
+    def histogram(self, x_min: float, x_max: float, nr_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Density in `[x_min, x_max]`, like `np.histogram(..., density=True)`.
+
+        The bins are merged to about `nr_bins` in the range, so the edges are rounded to those of
+        the accumulated bins.
+
+        Returns:
+            the density in each stream, of shape `(nr_streams, nr_bins)`, and the bin edges
+        """
+        i_min = int(np.clip(np.floor((x_min - self.low) / self.width), 0, self.nr_bins))
+        i_max = int(np.clip(np.ceil((x_max - self.low) / self.width), 0, self.nr_bins))
+        merge = max(1, (i_max - i_min) // nr_bins)
+        i_max = i_min + (i_max - i_min) // merge * merge
+        counts = self.counts[:, i_min:i_max].reshape(self.nr_streams, -1, merge).sum(axis=-1)
+        edges = self.low + self.width * np.arange(i_min, i_max + 1, merge)
+        total = np.maximum(np.sum(counts, axis=-1, keepdims=True), 1)
+        return counts / total / (merge * self.width), edges
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata index of the save files in a data directory.
+
+The index is an SQLite database `index.sqlite` next to the save files. It is updated by
+`Base._save` every time a file is saved, and `refresh` picks up files that were created, modified
+or deleted in some other way (e.g. copied from another computer).
+
+Example: the path of the last `ReadoutRef` on readout port 1 with a JPA
+>>> query("data", experiment="ReadoutRef", readout_port=1, jpa_params__ne="None", limit=1)
+"""
+
+import importlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Any, List, Optional, Tuple
+
+import h5py
+import numpy as np
+
+INDEX_FILENAME = "index.sqlite"
+_SKIP_FILENAMES = ("source_code.h5", "calibration.h5")
+_TIMESTAMP_RE = re.compile(r"^(.*)_(\d{8}_\d{6})\.h5$")
+_OPERATORS = {"eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    script TEXT,
+    experiment TEXT,
+    timestamp REAL,
+    mtime REAL,
+    size INTEGER,
+    datasets TEXT
+);
+CREATE TABLE IF NOT EXISTS attrs (
+    path TEXT,
+    name TEXT,
+    value,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS files_experiment ON files (experiment, timestamp);
+CREATE INDEX IF NOT EXISTS files_timestamp ON files (timestamp);
+CREATE INDEX IF NOT EXISTS attrs_name_value ON attrs (name, value);
+"""
+
+
+def _connect(data_dir: str) -> sqlite3.Connection:
+    con = sqlite3.connect(os.path.join(data_dir, INDEX_FILENAME), timeout=30.0)
+    con.executescript(_SCHEMA)
+    return con
+
+
+def _sql_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return None  # not indexed
+
+
+def _read_metadata(path: str) -> Tuple[list, dict]:
+    attrs = []
+    datasets = {}
+    with h5py.File(path, "r") as h5f:
+        for name, value in h5f.attrs.items():
+            value = _sql_value(value)
+            if value is not None:
+                attrs.append((name, value))
+        for name in h5f:
+            link = h5f.get(name, getlink=True)
+            if isinstance(link, h5py.ExternalLink):
+                continue  # e.g. shared source code, don't open the other file
+            obj = h5f[name]
+            if isinstance(obj, h5py.Dataset):
+                datasets[name] = list(obj.shape)
+    return attrs, datasets
+
+
+def _index_file(con: sqlite3.Connection, path: str, experiment: Optional[str]) -> None:
+    stat = os.stat(path)
+    match = _TIMESTAMP_RE.match(os.path.basename(path))
+    if match is None:
+        script = os.path.splitext(os.path.basename(path))[0]
+        timestamp = stat.st_mtime
+    else:
+        script = match.group(1)
+        timestamp = time.mktime(time.strptime(match.group(2), "%Y%m%d_%H%M%S"))
+    attrs, datasets = _read_metadata(path)
+    if experiment is None:
+        # keep the class name if known from a previous update
+        row = con.execute("SELECT experiment FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            experiment = row[0]
+
+    con.execute("DELETE FROM attrs WHERE path = ?", (path,))
+    con.execute(
+        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            path,
+            script,
+            experiment,
+            timestamp,
+            stat.st_mtime,
+            stat.st_size,
+            json.dumps(datasets),
+        ),
+    )
+    con.executemany(
+        "INSERT INTO attrs VALUES (?, ?, ?)", [(path, name, value) for name, value in attrs]
+    )
+
+
+def update(save_path: str, experiment: Optional[str] = None) -> None:
+    """Add or update a single save file in the index of its data directory.
+
+    Args:
+        save_path: path of the save file
+        experiment: name of the measurement class, e.g. `"T1"`
+    """
+    save_path = os.path.realpath(save_path)
+    with _connect(os.path.dirname(save_path)) as con:
+        _index_file(con, save_path, experiment)
+    con.close()
+
+
+def refresh(data_dir: str) -> int:
+    """Bring the index of `data_dir` up to date with the files on disk.
+
+    Only files that are new or were modified since they were indexed are opened.
+
+    Returns:
+        the number of files that were (re)indexed
+    """
+    data_dir = os.path.realpath(data_dir)
+    nr_indexed = 0
+    with _connect(data_dir) as con:
+        known = {
+            path: (mtime, size)
+            for path, mtime, size in con.execute("SELECT path, mtime, size FROM files")
+        }
+        on_disk = set()
+        with os.scandir(data_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".h5") or entry.name in _SKIP_FILENAMES:
+                    continue
+                path = os.path.join(data_dir, entry.name)
+                on_disk.add(path)
+                stat = entry.stat()
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    _index_file(con, path, None)
+                    nr_indexed += 1
+                except Exception as err:
+                    print(f"WARN: unable to index {path}: {err}")
+        for path in set(known) - on_disk:
+            con.execute("DELETE FROM files WHERE path = ?", (path,))
+            con.execute("DELETE FROM attrs WHERE path = ?", (path,))
+    con.close()
+    return nr_indexed
+
+
+def query(
+    data_dir: str,
+    experiment: Optional[str] = None,
+    script: Optional[str] = None,
+    after: Optional[float] = None,
+    before: Optional[float] = None,
+    limit: Optional[int] = None,
+    **conditions,
+) -> List[str]:
+    """Find save files by experiment, time and attribute values, newest first.
+
+    Args:
+        data_dir: directory with the save files
+        experiment: name of the measurement class, e.g. `"T1"`
+        script: name of the script, e.g. `"t1"`. Also works for files indexed by `refresh` only,
+            for which the class name is not known.
+        after: only files saved after this time, in seconds since the epoch (`time.time()`)
+        before: only files saved before this time, in seconds since the epoch
+        limit: return at most this many paths
+        conditions: conditions on the scalar attributes. `name=value` for equality, or
+            `name__op=value` with `op` one of `eq`, `ne`, `lt`, `le`, `gt`, `ge`. `jpa_params` and
+            `clear` are indexed as their string representation, e.g. `jpa_params__ne="None"`.
+
+    Returns:
+        list of paths to the matching save files
+    """
+    sql = "SELECT path FROM files WHERE 1"
+    args: list = []
+    if experiment is not None:
+        sql += " AND experiment = ?"
+        args.append(experiment)
+    if script is not None:
+        sql += " AND script = ?"
+        args.append(script)
+    if after is not None:
+        sql += " AND timestamp > ?"
+        args.append(after)
+    if before is not None:
+        sql += " AND timestamp < ?"
+        args.append(before)
+    for key, value in conditions.items():
+        name, _, op = key.partition("__")
+        if op == "":
+            op = "eq"
+        if op not in _OPERATORS:
+            raise ValueError(f"unknown operator {op} in {key}")
+        sql += f" AND path IN (SELECT path FROM attrs WHERE name = ? AND value {_OPERATORS[op]} ?)"
+        args.extend((name, _sql_value(value)))
+    sql += " ORDER BY timestamp DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        args.append(limit)
+
+    with _connect(os.path.realpath(data_dir)) as con:
+        paths = [row[0] for row in con.execute(sql, args)]
+    con.close()
+    return paths
+
+
+def query_load(data_dir: str, *args, lazy: bool = True, **kwargs) -> list:
+    """Like `query`, but return the loaded measurement objects instead of the paths.
+
+    The class is looked up in the module named after the script. With `lazy=True`, the default,
+    large datasets are only read when used, see `Base.load`.
+    """
+    from _base import Base
+
+    ret = []
+    with _connect(os.path.realpath(data_dir)) as con:
+        for path in query(data_dir, *args, **kwargs):
+            script, experiment = con.execute(
+                "SELECT script, experiment FROM files WHERE path = ?", (path,)
+            ).fetchone()
+            module = importlib.import_module(script)
+            if experiment is None:
+                # indexed by refresh only: the measurement class defined in the script
+                classes = [
+                    obj
+                    for obj in vars(module).values()
+                    if isinstance(obj, type)
+                    and issubclass(obj, Base)
+                    and obj.__module__ == module.__name__
+                ]
+                if len(classes) != 1:
+                    raise LookupError(f"unable to find the measurement class for {path}")
+                cls = classes[0]
+            else:
+                cls = getattr(module, experiment)
+            ret.append(cls.load(path, lazy=lazy))
+    con.close()
+    return ret
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Frequency sweeps in Lockin mode.
+
+Instead of reconfiguring the mixers, applying the settings and reading pixels back for each
+frequency, `sweep_freq` lets the instrument step the numerically-controlled oscillators (NCOs)
+through the whole frequency axis with `Lockin.sweep_nco`, with a single round trip.
+
+In 2D scans the frequency is then always the fast axis, and `scan_order` plans the slow one, e.g.
+a DC bias that has to be ramped. Consecutive frequency sweeps alternate direction (snake order),
+so that the NCOs step by `df` between rows instead of jumping back across the whole span.
+
+With `sweep_freq_multi`, several tones are output and measured at once, each covering a block of
+the frequency axis while the NCOs step through the block, see `tone_plan`.
+
+Narrow resonances can be swept adaptively: first on every `coarse_step`-th point of the grid, then
+on the full grid only where the response changes fast, see `coarse_idx` and `refine_idx`.
+"""
+
+from typing import Callable, Optional, Tuple
+import warnings
+
+import numpy as np
+
+from presto.lockin import Lockin
+
+
+def sweep_freq(
+    lck: Lockin,
+    input_port: int,
+    output_port: int,
+    freq_arr,
+    num_averages: int,
+    input_freq: Optional[float] = None,
+    status_callback: Optional[Callable] = None,
+    reverse: bool = False,
+) -> np.ndarray:
+    """Measure the response at each frequency of `freq_arr`, at zero IF.
+
+    The input and output groups must be set up with a single frequency at 0 Hz, and the settings
+    applied, before calling this.
+
+    Args:
+        lck: the instrument
+        input_port: port of the input group
+        output_port: port of the output group whose NCO is swept
+        freq_arr: frequencies of the sweep
+        num_averages: number of pixels averaged at each frequency
+        input_freq: keep the input NCO at this frequency, e.g. the readout frequency in two-tone
+            spectroscopy. If `None`, the input is swept along with the output.
+        status_callback: called after each frequency, e.g. `ProgressBar.increment`
+        reverse: sweep from the last frequency to the first, e.g. on every other row of a 2D scan.
+            The result is in the order of `freq_arr` anyway.
+
+    Returns:
+        complex response, same shape as `freq_arr`
+    """
+    freq_arr = np.asarray(freq_arr, dtype=np.float64)
+    if reverse:
+        return sweep_freq(
+            lck,
+            input_port,
+            output_port,
+            freq_arr[::-1],
+            num_averages,
+            input_freq=input_freq,
+            status_callback=status_callback,
+        )[::-1]
+    if input_freq is None:
+        input_freqs = freq_arr
+    else:
+        input_freqs = np.full_like(freq_arr, input_freq)
+    _d = lck.sweep_nco(
+        input_port=input_port,
+        input_freqs=input_freqs,
+        output_port=output_port,
+        output_freqs=freq_arr,
+        nr_averages=num_averages,
+        status_callback=status_callback,
+    )
+    data_i = _d[input_port][1][:, 0]
+    data_q = _d[input_port][2][:, 0]
+    return data_i.real + 1j * data_q.real  # using zero IF
+
+
+def check_num_skip(num_skip: int) -> None:
+    """Warn that `num_skip` is ignored, for the measurements that used to skip pixels while the
+    response settled: `sweep_freq` lets the instrument handle the settling"""
+    if num_skip != 0:
+        warnings.warn(
+            "num_skip is deprecated and ignored: sweep_nco handles the settling time",
+            FutureWarning,
+            stacklevel=3,
+        )
+
+
+def tone_plan(nr_freq: int, max_nr_tones: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Split a sweep of `nr_freq` points on the `df` grid among simultaneous tones.
+
+    Tone `k` measures the `k`-th block of the frequency axis while the NCOs step through the
+    block. The tones are shifted by a few `df` from a uniform spacing, so that no third-order
+    intermodulation product `f_a + f_b - f_c` of the tones falls on another tone: the
+    intermediate frequencies (IFs) form a Sidon set, in which all pairwise sums are different.
+    The NCOs take some extra steps to cover the blocks despite the shifts. Of all the numbers of
+    tones up to `max_nr_tones`, the one with the fewest NCO steps is chosen.
+
+    Returns:
+        if_idx: IF of each tone, in units of `df`, all positive. The NCOs are below the band.
+        nco_idx: NCO positions relative to the first frequency of the sweep, in units of `df`
+    """
+    best = (np.array([1]), np.arange(-1, nr_freq - 1))  # a single tone at IF = df
+    for nr_tones in range(2, max_nr_tones + 1):
+        block = -(-nr_freq // nr_tones)
+        offsets: list = []
+        sums: set = set()
+        for kk in range(nr_tones):
+            # smallest shift from the uniform position that keeps all pairwise sums different
+            for shift in sorted(range(-(block // 2), block), key=abs):
+                offset = kk * block + shift
+                new_sums = {offset + other for other in offsets} | {2 * offset}
+                if offset not in offsets and len(new_sums) == kk + 1 and not new_sums & sums:
+                    break
+            else:
+                break  # no room for this many tones
+            offsets.append(offset)
+            sums |= new_sums
+        if len(offsets) < nr_tones:
+            continue
+        shifts = np.array(offsets) - block * np.arange(nr_tones)
+        nco_idx = np.arange(-np.max(shifts) - 1, block - np.min(shifts) - 1)
+        if len(nco_idx) < len(best[1]):
+            best = (np.array(offsets) + 1, nco_idx)
+    return best
+
+
+def sweep_freq_multi(
+    lck: Lockin,
+    input_port: int,
+    output_port: int,
+    freq_arr,
+    num_averages: int,
+    if_idx: np.ndarray,
+    nco_idx: np.ndarray,
+    status_callback: Optional[Callable] = None,
+) -> np.ndarray:
+    """Measure the response at each frequency of `freq_arr`, with several tones per pixel.
+
+    The input and output groups must be set up with the IFs `if_idx * df` from `tone_plan`, the
+    output in the upper sideband, and the settings applied, before calling this. `freq_arr` must
+    be uniformly spaced by `df`. The response is on the same scale, and with the same phase, as
+    from `sweep_freq` with the same amplitude per tone.
+
+    Args:
+        lck: the instrument
+        input_port: port of the input group
+        output_port: port of the output group
+        freq_arr: frequencies of the sweep
+        num_averages: number of pixels averaged at each NCO step
+        if_idx, nco_idx: from `tone_plan(len(freq_arr), ...)`
+        status_callback: called after each NCO step, e.g. `ProgressBar.increment`
+
+    Returns:
+        complex response, same shape as `freq_arr`
+    """
+    freq_arr = np.asarray(freq_arr, dtype=np.float64)
+    nr_freq = len(freq_arr)
+    df = freq_arr[1] - freq_arr[0]
+    nco_arr = freq_arr[0] + df * nco_idx
+    _d = lck.sweep_nco(
+        input_port=input_port,
+        input_freqs=nco_arr,
+        output_port=output_port,
+        output_freqs=nco_arr,
+        nr_averages=num_averages,
+        status_callback=status_callback,
+    )
+    data_i = _d[input_port][1]  # shape (len(nco_idx), len(if_idx))
+    data_q = _d[input_port][2]
+    # upper sideband: with phases (0, -pi/2), a tone at IF reads twice its complex amplitude
+    # on I + 1j * Q, and nothing on the lower sideband conj(I) + 1j * conj(Q). Scaled to match
+    # `sweep_freq`, whose tone at 0 Hz with phases (0, 0) is output on both I and Q.
+    data = 0.5 * (1 + 1j) * (data_i + 1j * data_q)
+
+    # each frequency is taken from the tone whose block it belongs to
+    idx = nco_idx[:, None] + if_idx[None, :]
+    block = -(-nr_freq // len(if_idx))
+    mine = (idx >= 0) & (idx < nr_freq) & (idx // block == np.arange(len(if_idx)))
+    resp_arr = np.zeros(nr_freq, np.complex128)
+    resp_arr[idx[mine]] = data[mine]
+    return resp_arr
+
+
+def add_tone_groups(lck: Lockin, input_port: int, output_port: int, amp: float, if_arr):
+    """Add the output and input groups for `sweep_freq_multi`, with amplitude `amp` per tone.
+
+    The tones add up on the output, so `len(if_arr) * amp` must be at most full scale.
+
+    Returns:
+        the output and input groups
+    """
+    nr_tones = len(if_arr)
+    if nr_tones * amp > 1.0:
+        raise ValueError(
+            f"{nr_tones} tones at amplitude {amp} add up to more than full scale, "
+            f"use amp <= {1.0 / nr_tones:.3g} or fewer tones"
+        )
+    og = lck.add_output_group(output_port, nr_tones)
+    og.set_frequencies(if_arr)
+    og.set_amplitudes(np.full(nr_tones, amp))
+    og.set_phases(np.zeros(nr_tones), np.full(nr_tones, -np.pi / 2))  # upper sideband
+    ig = lck.add_input_group(input_port, nr_tones)
+    ig.set_frequencies(if_arr)
+    return og, ig
+
+
+def scan_order(values, start: Optional[float] = None) -> np.ndarray:
+    """Order in which to visit `values`, e.g. DC biases, to minimize the total distance traveled.
+
+    For points on a line, the shortest path visits them sorted, starting from the end closest to
+    `start`, e.g. the bias currently on the output. If `start` is `None`, from `values[0]`.
+
+    Returns:
+        indices into `values`, in the order in which to visit them
+    """
+    values = np.asarray(values)
+    if start is None:
+        start = values[0]
+    order = np.argsort(values, kind="stable")
+    if abs(values[order[-1]] - start) < abs(values[order[0]] - start):
+        order = order[::-1]
+    return order
+
+
+def coarse_idx(nr_freq: int, coarse_step: int) -> np.ndarray:
+    """Indices of every `coarse_step`-th point of a grid of `nr_freq` points, and of the last"""
+    return np.unique(np.r_[np.arange(0, nr_freq, coarse_step), nr_freq - 1])
+
+
+def refine_idx(idx, resp_arr, threshold: float = 4.0) -> np.ndarray:
+    """Indices of the grid to measure next, around the features of a coarse sweep.
+
+    A measured point is a feature if it is further from the straight line between its neighbors
+    than `threshold` times the median distance, i.e. where the coarse sweep doesn't resolve the
+    response. The intervals next to it, and their neighbors for the tails, are then refined.
+    The coarse step should be at most about the linewidth, or narrow resonances can be missed.
+
+    Args:
+        idx: sorted indices of the grid that were measured, at least 3
+        resp_arr: response at `idx`, along the last axis. If 2D, e.g. one row per drive
+            amplitude, the intervals are refined if any row has a feature.
+        threshold: how much further than the median
+
+    Returns:
+        sorted indices of the grid, between the first and the last of `idx`, not measured yet
+    """
+    idx = np.asarray(idx)
+    resp_arr = np.atleast_2d(resp_arr)
+    step = np.diff(idx)
+    # linear interpolation of each inner point from its neighbors
+    line = (resp_arr[:, :-2] * step[1:] + resp_arr[:, 2:] * step[:-1]) / (step[:-1] + step[1:])
+    dist = np.abs(resp_arr[:, 1:-1] - line)
+    feature = np.any(dist > threshold * np.median(dist, axis=-1, keepdims=True), axis=0)
+    refine = np.zeros(len(step), np.bool_)
+    refine[:-1] |= feature
+    refine[1:] |= feature
+    refine[1:] |= refine[:-1].copy()  # and the neighbors
+    refine[:-1] |= refine[1:].copy()
+    new = [np.arange(idx[ii] + 1, idx[ii + 1]) for ii in np.flatnonzero(refine)]
+    if len(new) == 0:
+        return np.zeros(0, np.int64)
+    return np.concatenate(new)
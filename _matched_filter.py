@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Matched-filter templates for template matching, from the noise of single-shot traces.
+
+Template matching compares `<s, ref_e> - <s, ref_g>` with the threshold `(|ref_e|**2 -
+|ref_g|**2) / 2`, i.e. it projects the trace `s` on `w = ref_e - ref_g` and decides at the
+midpoint `m` of the two states. The signal-to-noise ratio of the projection is largest for the
+noise-whitened difference `w = R^-1 (mean_e - mean_g)`, where `R` is the covariance of the noise
+over the window. With `ref_g = m - w / 2` and `ref_e = m + w / 2`, the comparator and its
+threshold stay the same as for the averaged traces, see `readout_reset._threshold`.
+
+The noise is assumed stationary, so that `R` is Toeplitz and given by the autocorrelation.
+"""
+
+from typing import Any, Dict, Sequence, Tuple, Union
+
+import numpy as np
+
+CHUNK_SIZE = 1024  # traces to process at once
+
+
+def noise_autocorrelation(
+    traces_g, traces_e, max_lag: int, chunk_size: int = CHUNK_SIZE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Mean traces and autocorrelation of the noise from single-shot traces, in a single pass.
+
+    Args:
+        traces_g, traces_e: single-shot traces with the qubit prepared in |g> and |e>, shape
+            `(nr_shots, nr_samples)`. Can be anything that supports slicing along the first axis,
+            e.g. an `h5py.Dataset` or a `np.memmap`.
+        max_lag: number of lags of the autocorrelation, e.g. the longest template
+        chunk_size: number of traces to process at once
+
+    Returns:
+        the mean traces for |g> and |e>, and `acf[k] = E[n(t + k) conj(n(t))]` for `k <
+        max_lag`, averaged over the shots and over `t`
+    """
+    nr_samples = traces_g.shape[1]
+    max_lag = min(max_lag, nr_samples)
+    nfft = 1 << int(np.ceil(np.log2(nr_samples + max_lag)))
+    sum_acf = np.zeros(max_lag, np.complex128)
+    means = []
+    nr_shots = 0
+    for traces in (traces_g, traces_e):
+        total = np.zeros(nr_samples, np.complex128)
+        power = np.zeros(nfft)
+        for start in range(0, len(traces), chunk_size):
+            chunk = np.asarray(traces[start : start + chunk_size], dtype=np.complex128)
+            total += np.sum(chunk, axis=0)
+            power += np.sum(np.abs(np.fft.fft(chunk, nfft)) ** 2, axis=0)
+        mean = total / len(traces)
+        # the noise is what is left after the mean: remove its contribution
+        power -= len(traces) * np.abs(np.fft.fft(mean, nfft)) ** 2
+        sum_acf += np.fft.ifft(power)[:max_lag]
+        means.append(mean)
+        nr_shots += len(traces)
+    # the lag k is seen by nr_samples - k pairs of samples in each trace
+    acf = sum_acf / (nr_shots * (nr_samples - np.arange(max_lag)))
+    return means[0], means[1], acf
+
+
+def design_templates(
+    trace_g,
+    trace_e,
+    acf,
+    match_len: Union[int, Sequence[int]],
+    step: int = 16,
+) -> Dict[str, Any]:
+    """Matched-filter templates for the window with the best signal-to-noise ratio.
+
+    Args:
+        trace_g, trace_e: mean traces for |g> and |e>
+        acf: autocorrelation of the noise, at least as long as the longest `match_len`, see
+            `noise_autocorrelation`
+        match_len: number of samples in the templates, or candidate numbers
+        step: windows start at multiples of this many samples
+
+    Returns:
+        dictionary with the templates `ref_g` and `ref_e`, the window `match_idx` and `match_len`,
+        the predicted signal-to-noise ratio `snr` of the comparator result and `snr_boxcar` with
+        the averaged traces as templates, and their ratio `snr_gain`. `snr_arr` is the best
+        `snr` for each candidate length.
+    """
+    from scipy.linalg import solve_toeplitz
+
+    trace_g = np.asarray(trace_g, dtype=np.complex128)
+    trace_e = np.asarray(trace_e, dtype=np.complex128)
+    acf = np.asarray(acf, dtype=np.complex128)
+    match_len_arr = np.atleast_1d(match_len).astype(np.int64)
+    if np.any(match_len_arr > len(acf)):
+        raise ValueError(f"acf has {len(acf)} lags, shorter than match_len {match_len}")
+    diff = trace_e - trace_g
+    nr_samples = len(diff)
+
+    snr_arr = np.zeros(len(match_len_arr))
+    best: Dict[str, Any] = {}
+    for ii, length in enumerate(match_len_arr):
+        # hermitian Toeplitz covariance: first column acf, first row its conjugate
+        cov = (acf[:length], acf[:length].conj())
+        for start in range(0, nr_samples - length + 1, step):
+            d = diff[start : start + length]
+            w = solve_toeplitz(cov, d)
+            # the real part of <n, w> has variance w^H R w / 2 for proper complex noise
+            snr = np.sqrt(2 * max(np.vdot(d, w).real, 0.0))
+            if snr > snr_arr[ii]:
+                snr_arr[ii] = snr
+                if snr >= best.get("snr", 0.0):
+                    best = {"snr": snr, "match_idx": start, "match_len": int(length), "w": w}
+    if len(best) == 0:
+        raise ValueError("no window fits in the traces")
+
+    start = best["match_idx"]
+    length = best["match_len"]
+    d = diff[start : start + length]
+    mid = 0.5 * (trace_g + trace_e)[start : start + length]
+    # same scale as the averaged traces, the comparator doesn't depend on it
+    w = best["w"] * np.max(np.abs(d)) / np.max(np.abs(best["w"]))
+    r_d = _toeplitz_matvec(acf[:length], d)
+    snr_boxcar = np.vdot(d, d).real / np.sqrt(0.5 * np.vdot(d, r_d).real)
+    return {
+        "ref_g": mid - 0.5 * w,
+        "ref_e": mid + 0.5 * w,
+        "match_idx": start,
+        "match_len": length,
+        "snr": best["snr"],
+        "snr_boxcar": snr_boxcar,
+        "snr_gain": best["snr"] / snr_boxcar,
+        "snr_arr": snr_arr,
+    }
+
+
+def _toeplitz_matvec(acf, x):
+    from scipy.linalg import matmul_toeplitz
+
+    return matmul_toeplitz((acf, acf.conj()), x)
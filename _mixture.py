@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Gaussian-mixture fits of single-shot readout data by expectation maximization.
+
+The fit works on the raw values, 1-D (e.g. the comparator result of template matching) or 2-D
+(complex IQ points), instead of on a histogram, so it doesn't depend on the binning. Each
+iteration is vectorized over all shots, optionally in chunks to bound memory.
+"""
+
+import functools
+from typing import Optional, Tuple
+
+import numpy as np
+
+CHUNK_SIZE = 2**16
+PRESAMPLE_SIZE = 100_000  # shots in the subset fitted first
+
+
+def fit_mixture(
+    data,
+    means,
+    covs=None,
+    weights=None,
+    counts=None,
+    shared_cov: bool = False,
+    fit_components: bool = True,
+    fit_weights: bool = True,
+    max_iter: int = 500,
+    tol: float = 1e-10,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Fit a mixture of Gaussians to `data` by expectation maximization.
+
+    Args:
+        data: real of shape `(nr_shots,)`, complex IQ points of shape `(nr_shots,)`, or real of
+            shape `(nr_shots, dim)`. Can be anything that supports slicing along the first axis,
+            e.g. an `h5py.Dataset` or a `np.memmap`.
+        means: initial means, one per component, in the same format as `data`.
+        covs: initial covariances of shape `(nr_components, dim, dim)`, or variances of shape
+            `(nr_components,)` in 1-D. If `None`, from the shots closest to each mean.
+        weights: initial weights. If `None`, from the shots closest to each mean.
+        counts: number of shots at each point of `data`, e.g. the counts of a fine histogram
+            with the bin centers as `data`. If `None`, one shot per point.
+        shared_cov: all components have the same covariance.
+        fit_components: if `False`, keep `means` and `covs` fixed and only fit the weights, e.g.
+            to measure the populations after a calibration.
+        fit_weights: if `False`, keep `weights` fixed.
+        max_iter: maximum number of iterations.
+        tol: stop when the mean log-likelihood per shot improves by less than this.
+        chunk_size: number of shots to process at once, small enough to stay in cache.
+
+    Returns:
+        means of shape `(nr_components, dim)`, covariances of shape `(nr_components, dim, dim)`
+        and weights of shape `(nr_components,)`; `dim` is 2 for complex data, with the real part
+        first.
+    """
+    mu = _as_points(means)
+    nr_comp, dim = mu.shape
+    nr_shots = len(data) if counts is None else np.sum(counts)
+
+    step = len(data) // PRESAMPLE_SIZE
+    if step > 1 and fit_components:
+        # converge on a subset first, the full data then only needs a few iterations
+        mu, covs, weights = fit_mixture(
+            data[::step],
+            mu,
+            covs,
+            weights,
+            None if counts is None else counts[::step],
+            shared_cov,
+            fit_components,
+            fit_weights,
+            max_iter,
+            tol,
+            chunk_size,
+        )
+
+    if covs is None or weights is None:
+        nk, s1, s2, _ = _accumulate(data, counts, mu, None, None, chunk_size)
+        cov_hard = _covariances(nk, s1, s2, shared_cov)
+    if covs is None:
+        cov = cov_hard
+    else:
+        cov = np.array(covs, dtype=np.float64).reshape(nr_comp, dim, dim)
+    if weights is None:
+        w = nk / nr_shots
+    else:
+        w = np.array(weights, dtype=np.float64)
+
+    loglik_old = -np.inf
+    for _ in range(max_iter):
+        nk, s1, s2, loglik = _accumulate(data, counts, mu, cov, w, chunk_size)
+        if fit_weights:
+            w = nk / nr_shots
+        if fit_components:
+            mu = mu + s1 / np.maximum(nk, _TINY)[:, None]
+            cov = _covariances(nk, s1, s2, shared_cov)
+        loglik /= nr_shots
+        if loglik - loglik_old < tol:
+            break
+        loglik_old = loglik
+
+    return mu, cov, w
+
+
+def readout_fidelity(means, covs, threshold: Optional[float] = None) -> Tuple[float, float, float]:
+    """Assignment fidelity of a two-state readout described by two Gaussians.
+
+    The shots are assigned along the direction that best separates the two states, `C^-1 (m_e -
+    m_g)` for the average covariance `C`, which is just the real axis in 1-D.
+
+    Args:
+        means: means of |g> and |e>, as returned by `fit_mixture`.
+        covs: covariances (or variances in 1-D) of |g> and |e>.
+        threshold: decision threshold, only in 1-D. If `None`, where the two states are equally
+            many standard deviations away.
+
+    Returns:
+        the fidelity `1 - (err_eg + err_ge) / 2`, the probability `err_eg` to measure |e> when
+        prepared in |g> and `err_ge` to measure |g> when prepared in |e>
+    """
+    from scipy.special import erfc
+
+    mu = _as_points(means)
+    dim = mu.shape[1]
+    cov = np.asarray(covs, dtype=np.float64).reshape(2, dim, dim)
+    if dim == 1:
+        direction = np.sign(mu[1] - mu[0])
+    elif threshold is None:
+        direction = np.linalg.solve(np.mean(cov, axis=0), mu[1] - mu[0])
+    else:
+        raise ValueError("threshold is only supported for 1-D data")
+    m = mu @ direction
+    s = np.sqrt(np.einsum("i,kij,j->k", direction, cov, direction))
+    if threshold is None:
+        threshold_proj = (m[0] * s[1] + m[1] * s[0]) / (s[0] + s[1])
+    else:
+        threshold_proj = threshold * direction[0]
+    err_eg = 0.5 * erfc((threshold_proj - m[0]) / (np.sqrt(2) * s[0]))
+    err_ge = 0.5 * erfc((m[1] - threshold_proj) / (np.sqrt(2) * s[1]))
+    return 1.0 - 0.5 * (err_eg + err_ge), err_eg, err_ge
+
+
+def t_eff(p, fq):
+    """Effective temperature of a qubit at frequency `fq` with excited-state population `p`"""
+    from scipy.constants import Boltzmann, Planck
+
+    return Planck * fq / (Boltzmann * np.log(1 / p - 1))
+
+
+_TINY = np.finfo(np.float64).tiny
+_LOG_TINY = np.log(_TINY)
+
+
+def _as_points(data) -> np.ndarray:
+    data = np.asarray(data)
+    if np.iscomplexobj(data):
+        return np.stack((data.real, data.imag), axis=-1).astype(np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        return data[:, None]
+    return data
+
+
+def _accumulate(data, counts, mu, cov, w, chunk_size: int):
+    # responsibility-weighted counts, first and second moments around mu, and log-likelihood;
+    # hard assignment to the nearest mean if cov is None
+    nr_comp, dim = mu.shape
+    nk = np.zeros(nr_comp)
+    s1 = np.zeros((nr_comp, dim))
+    s2 = np.zeros((nr_comp, dim, dim))
+    loglik = 0.0
+    if cov is not None:
+        inv_cov = np.linalg.inv(cov)
+        _, logdet = np.linalg.slogdet(cov)
+        with np.errstate(divide="ignore"):
+            log_norm = np.log(w) - 0.5 * (dim * np.log(2 * np.pi) + logdet)
+    for start in range(0, len(data), chunk_size):
+        # one row per dimension, shots along the fast axis; one array per component below
+        x = np.ascontiguousarray(_as_points(data[start : start + chunk_size]).T)
+        diff = [x - mu[kk, :, None] for kk in range(nr_comp)]
+        if counts is not None:
+            chunk_counts = np.asarray(counts[start : start + chunk_size], dtype=np.float64)
+        if cov is None:
+            nearest = np.argmin([_quad(np.eye(dim), d) for d in diff], axis=0)
+            resp = [(nearest == kk).astype(np.float64) for kk in range(nr_comp)]
+        else:
+            log_p = [log_norm[kk] - 0.5 * _quad(inv_cov[kk], d) for kk, d in enumerate(diff)]
+            log_max = functools.reduce(np.maximum, log_p)
+            # exp is slow on underflow, clip to the smallest normal number
+            resp = [np.exp(np.maximum(lp - log_max, _LOG_TINY)) for lp in log_p]
+            total = functools.reduce(np.add, resp)
+            inv_total = 1.0 / total
+            for r in resp:
+                r *= inv_total
+            log_total = log_max + np.log(total)
+            loglik += np.sum(log_total) if counts is None else chunk_counts @ log_total
+        if counts is not None:
+            for r in resp:
+                r *= chunk_counts
+        for kk, (r, d) in enumerate(zip(resp, diff)):
+            nk[kk] += np.sum(r)
+            s1[kk] += d @ r
+            s2[kk] += (d * r) @ d.T
+    return nk, s1, s2, loglik
+
+
+def _quad(inv_cov, d):
+    # d.T @ inv_cov @ d for each shot, by rows: numpy is slow on short axes
+    res = inv_cov[0, 0] * d[0] ** 2
+    for ii in range(len(d)):
+        for jj in range(ii + 1, len(d)):
+            res += (inv_cov[ii, jj] + inv_cov[jj, ii]) * d[ii] * d[jj]
+        if ii > 0:
+            res += inv_cov[ii, ii] * d[ii] ** 2
+    return res
+
+
+def _covariances(nk, s1, s2, shared_cov: bool) -> np.ndarray:
+    nk_safe = np.maximum(nk, _TINY)[:, None, None]
+    shift = s1[:, :, None] / nk_safe
+    cov = s2 / nk_safe - shift * np.swapaxes(shift, -1, -2)
+    if shared_cov:
+        cov[:] = np.sum(nk[:, None, None] * cov, axis=0) / np.sum(nk)
+    return cov
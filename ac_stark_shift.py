@@ -4,17 +4,17 @@
 Measure Ramsey oscillations while driving the resonator with variable power.
 """
 
-import ast
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import rotate_opt, sin2
+from presto.utils import sin2
 
 from _base import Base
+from _fit import fit_batch, fit_damped_cosine_p0
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -239,57 +239,6 @@ class AcStarkShift(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "AcStarkShift":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            ringup_duration = float(h5f.attrs["ringup_duration"])  # type: ignore
-            delay_arr: npt.NDArray[np.float64] = h5f["delay_arr"][()]  # type: ignore
-            ringup_amp_arr: npt.NDArray[np.float64] = h5f["ringup_amp_arr"][()]  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            ringup_duration=ringup_duration,
-            delay_arr=delay_arr,
-            ringup_amp_arr=ringup_amp_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-            drag=drag,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False):
         if self.t_arr is None:
             raise RuntimeError
@@ -332,19 +281,10 @@ class AcStarkShift(Base):
         fig2.show()
         ret_fig.append(fig2)
 
-        # Ramsey fits
-        popt_all = np.zeros((nr_amps, 5))
-        perr_all = np.zeros((nr_amps, 5))
-        for ii, amp in enumerate(self.ringup_amp_arr):
-            try:
-                popt, perr = _fit_simple(self.delay_arr, data[ii, :])
-                popt_all[ii, :] = popt
-                perr_all[ii, :] = perr
-            except Exception as err:
-                print(f"Unable to fit data for amp nr {ii}: {amp}!")
-                print(err)
-                popt_all[ii, :] = np.nan
-                perr_all[ii, :] = np.nan
+        # Ramsey fits, all amplitudes at once
+        popt_all, perr_all, success = _fit_batch(self.delay_arr, data)
+        for ii in np.flatnonzero(~success):
+            print(f"Unable to fit data for amp nr {ii}: {self.ringup_amp_arr[ii]}!")
 
         ringup_pwr_arr = self.ringup_amp_arr**2
         freq_arr = popt_all[:, 3]
@@ -393,32 +333,7 @@ def _func(t, offset, amplitude, gamma, frequency, phase):
     return offset + amplitude * np.exp(-gamma * t) * np.cos(2.0 * np.pi * frequency * t + phase)
 
 
-def _fit_simple(x, y):
-    from scipy.optimize import curve_fit
-
-    pkpk = np.max(y) - np.min(y)
-    offset = np.min(y) + pkpk / 2
-    amplitude = 0.5 * pkpk
-    T2 = 0.5 * (np.max(x) - np.min(x))
-    gamma = 1 / T2
-    freqs = np.fft.rfftfreq(len(x), x[1] - x[0])
-    fft = np.fft.rfft(y)
-    fft[0] = 0
-    idx_max = np.argmax(np.abs(fft))
-    frequency = freqs[idx_max]
-    phase = np.angle(fft[idx_max])
-    p0 = (
-        offset,
-        amplitude,
-        gamma,
-        frequency,
-        phase,
-    )
-    popt, pcov = curve_fit(
-        _func,
-        x,
-        y,
-        p0=p0,
-    )
-    perr = np.sqrt(np.diag(pcov))
-    return popt, perr
+def _fit_batch(x, y):
+    p0 = fit_damped_cosine_p0(x, y)
+    p0[:, 2] = 1 / p0[:, 2]  # decay rate gamma instead of T2
+    return fit_batch(_func, x, y, p0)
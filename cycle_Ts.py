@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
-import ast
 import os
+import queue
 import signal
+import threading
 import time
 from typing import List, Optional, Union
 
@@ -14,14 +15,22 @@ import numpy.typing as npt
 
 from presto.utils import format_precision
 
+from _appender import Appender
 from _base import Base
+from _fit import decay, decay_p0, fit_batch, fit_decay, optimal_decay_delays
 from ramsey_echo import RamseyEcho
 from t1 import T1 as T1Class
 
 KEEP_GOING = True
+QUEUE_SIZE = 4  # measurements waiting to be analyzed before the acquisition blocks
 
 
 class CycleTs(Base):
+    CHUNK_ROWS: int = 64
+    """Rows per chunk of the saved arrays, also written to disk at once"""
+    FSYNC_INTERVAL: Optional[float] = 300.0
+    """s -- Maximum time between syncs of the save file to disk, bounds the data lost on a crash"""
+
     def __init__(
         self,
         readout_freq: float,
@@ -43,6 +52,7 @@ class CycleTs(Base):
         drag: float = 0.0,
         ref_g: Optional[List[complex]] = None,
         ref_e: Optional[List[complex]] = None,
+        adaptive_nr_delays: Optional[int] = None,
     ) -> None:
         self.readout_freq = readout_freq
         self.control_freq = control_freq
@@ -61,11 +71,14 @@ class CycleTs(Base):
         self.num_averages = num_averages
         self.jpa_params = jpa_params
         self.drag = drag
+        self.adaptive_nr_delays = adaptive_nr_delays
         # self.ref_g = ref_g
         # self.ref_e = ref_e
 
         self.time_start: float = 0.0  # replaced by run
         self._nr_delays = len(self.delay_arr)
+        if adaptive_nr_delays is not None and not 3 <= adaptive_nr_delays <= self._nr_delays:
+            raise ValueError(f"adaptive_nr_delays must be between 3 and {self._nr_delays}")
 
         if ref_g is None or ref_e is None:
             self._ref_templates = None
@@ -73,6 +86,7 @@ class CycleTs(Base):
             self._ref_templates = (ref_g, ref_e)
 
         self._save_filename: str = ""  # replaced by save
+        self._appender: Optional[Appender] = None  # replaced by save
         self._time1_arr = np.zeros(0, np.float64)
         self._time2_arr = np.zeros(0, np.float64)
         self._t1_arr = np.zeros(0, np.float64)
@@ -83,6 +97,12 @@ class CycleTs(Base):
         # self._data2 = np.zeros((0, self._nr_delays), np.float64)
         self._data1 = np.zeros(0, np.float64)  # will have shape (self._nr_delays,)
         self._data2 = np.zeros(0, np.float64)  # will have shape (self._nr_delays,)
+        self._delay1 = self.delay_arr  # delays of self._data1
+        self._delay2 = self.delay_arr  # delays of self._data2
+        self._data1_arr = np.zeros((0, self._nr_delays), np.float64)  # replaced by load
+        self._data2_arr = np.zeros((0, self._nr_delays), np.float64)  # replaced by load
+        self._delay1_arr = np.zeros((0, self._nr_delays), np.float64)  # replaced by load
+        self._delay2_arr = np.zeros((0, self._nr_delays), np.float64)  # replaced by load
 
     def run(
         self,
@@ -107,187 +127,192 @@ class CycleTs(Base):
         _my_pause()
 
         signal.signal(signal.SIGINT, _handler)
-        count = 0
-        global KEEP_GOING
-        while KEEP_GOING:
-            print("\n\n\n")
-            print(f"******* Run number {count+1:d} *******")
-            count += 1
+        # acquire on a separate thread, so that the instrument is not idle while fitting, saving
+        # and plotting here on the main thread, which also handles the signals and the GUI
+        results: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+        stop = threading.Event()  # no new runs
+        gone = threading.Event()  # no more results taken from the queue
+        worker = threading.Thread(
+            target=self._acquire,
+            args=(presto_address, presto_port, ext_ref_clk, results, stop, gone),
+        )
+        time_acquire = 0.0
+        worker.start()
+        try:
+            while True:
+                try:
+                    item = results.get_nowait()
+                except queue.Empty:
+                    _my_pause()  # keep the plot responsive while waiting
+                    continue
+                if item is None:
+                    break  # acquisition is done
+                if isinstance(item, Exception):
+                    raise item
+                time_acquire += self._process(item, line_t1, line_t2)
+                ax.relim()
+                ax.autoscale()
+                _my_pause()
+        finally:
+            # e.g. after a second Ctrl-C: wait for the run in progress and keep its result
+            # before closing the save file
+            stop.set()
+            try:
+                while worker.is_alive() or not results.empty():
+                    try:
+                        item = results.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if isinstance(item, tuple):
+                        time_acquire += self._process(item, line_t1, line_t2)
+                worker.join()
+            finally:
+                gone.set()
+                if self._appender is not None:
+                    self._appender.close()
+                    self._appender = None
+
+        time_total = time.time() - self.time_start
+        print(f"Instrument busy {100 * time_acquire / time_total:.1f}% of the time")
+        print("\n\n\n")
+        print("Done")
+        input("___ Press Enter to close ___")
+
+    def _process(self, item, line_t1, line_t2) -> float:
+        # fit, save and plot a measurement from the worker thread, return the acquisition time
+        which, m, delays, t_start, t_stop = item
+        data, (popt, perr) = m.analyze_batch(self._ref_templates)
+        t_fit = np.nan if popt is None else popt[0]
+        t_fit_err = np.nan if perr is None else perr[0]
 
+        if which == 1:
+            print("\n\n\n")
+            print(f"******* Run number {len(self._t1_arr) + 1:d} *******")
             print("\n")
             print("------- measure T1 -------")
-            self._data1, t1, t1_err = self.measure_t1(presto_address, presto_port, ext_ref_clk)
-            print("T1 = {:s} μs".format(format_precision(1e6 * t1, 1e6 * t1_err)))
-
-            # self._data1 = np.vstack((self._data1, data1))
-            self._t1_arr = np.r_[self._t1_arr, t1]
-            self._t1_err_arr = np.r_[self._t1_err_arr, t1_err]
-            self._time1_arr = np.r_[self._time1_arr, time.time()]
+            print("T1 = {:s} μs".format(format_precision(1e6 * t_fit, 1e6 * t_fit_err)))
+            self._data1 = data
+            self._delay1 = delays
+            self._t1_arr = np.r_[self._t1_arr, t_fit]
+            self._t1_err_arr = np.r_[self._t1_err_arr, t_fit_err]
+            self._time1_arr = np.r_[self._time1_arr, t_stop]
             self.append(1)
-
             line_t1.set_data(self._time1_arr - self.time_start, 1e6 * self._t1_arr)
-            ax.relim()
-            ax.autoscale()
-            _my_pause(1.0)
-
+        else:
             print("\n")
             print("------- measure T2 -------")
-            self._data2, t2, t2_err = self.measure_t2(presto_address, presto_port, ext_ref_clk)
-            print("T2 = {:s} μs".format(format_precision(1e6 * t2, 1e6 * t2_err)))
-
-            # self._data2 = np.vstack((self._data2, data2))
-            self._t2_arr = np.r_[self._t2_arr, t2]
-            self._t2_err_arr = np.r_[self._t2_err_arr, t2_err]
-            self._time2_arr = np.r_[self._time2_arr, time.time()]
+            print("T2 = {:s} μs".format(format_precision(1e6 * t_fit, 1e6 * t_fit_err)))
+            self._data2 = data
+            self._delay2 = delays
+            self._t2_arr = np.r_[self._t2_arr, t_fit]
+            self._t2_err_arr = np.r_[self._t2_err_arr, t_fit_err]
+            self._time2_arr = np.r_[self._time2_arr, t_stop]
             self.append(2)
-
             line_t2.set_data(self._time2_arr - self.time_start, 1e6 * self._t2_arr)
-            ax.relim()
-            ax.autoscale()
-            _my_pause(1.0)
-
-        print("\n\n\n")
-        print("Done")
-        input("___ Press Enter to close ___")
+        return t_stop - t_start
 
     def save(self, save_filename: Optional[str] = None) -> str:
-        # save parameters
-        self._save_filename = super()._save(__file__, save_filename=save_filename)
-        # add growable arrays
-        with h5py.File(self._save_filename, "a") as h5f:
-            # h5f.create_dataset('data1', data=self._data1, compression="gzip", chunks=True, maxshape=(None, self._nr_delays))
-            # h5f.create_dataset('data2', data=self._data2, compression="gzip", chunks=True, maxshape=(None, self._nr_delays))
-            h5f.create_dataset(
-                "data1",
-                shape=(0, self._nr_delays),
-                dtype=np.float64,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None, self._nr_delays),
-            )
-            h5f.create_dataset(
-                "data2",
-                shape=(0, self._nr_delays),
-                dtype=np.float64,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None, self._nr_delays),
-            )
-            h5f.create_dataset(
-                "time1_arr",
-                data=self._time1_arr,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None,),
-            )
-            h5f.create_dataset(
-                "time2_arr",
-                data=self._time2_arr,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None,),
-            )
-            h5f.create_dataset(
-                "t1_arr", data=self._t1_arr, compression="gzip", chunks=True, maxshape=(None,)
-            )
-            h5f.create_dataset(
-                "t2_arr", data=self._t2_arr, compression="gzip", chunks=True, maxshape=(None,)
-            )
-            h5f.create_dataset(
-                "t1_err_arr",
-                data=self._t1_err_arr,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None,),
-            )
-            h5f.create_dataset(
-                "t2_err_arr",
-                data=self._t2_err_arr,
-                compression="gzip",
-                chunks=True,
-                maxshape=(None,),
-            )
+        # save parameters and create growable arrays, then keep the file open to append to them
+        if self._appender is not None:
+            self._appender.close()
+        self._save_filename = self._stream_open(
+            __file__,
+            {
+                "data1": ((0, self._nr_delays), np.float64),
+                "data2": ((0, self._nr_delays), np.float64),
+                "delay1": ((0, self._nr_delays), np.float64),
+                "delay2": ((0, self._nr_delays), np.float64),
+                "time1_arr": ((0,), np.float64),
+                "time2_arr": ((0,), np.float64),
+                "t1_arr": ((0,), np.float64),
+                "t2_arr": ((0,), np.float64),
+                "t1_err_arr": ((0,), np.float64),
+                "t2_err_arr": ((0,), np.float64),
+            },
+            save_filename=save_filename,
+            compression="gzip",
+            chunk_rows=self.CHUNK_ROWS,
+            swmr=True,
+        )
+        self._appender = Appender(
+            self._save_filename, chunk_rows=self.CHUNK_ROWS, fsync_interval=self.FSYNC_INTERVAL
+        )
         return self._save_filename
 
-    @staticmethod
-    def _append(h5f, ds, data):
-        data = np.atleast_1d(data)
-        h5f[ds].resize((h5f[ds].shape[0] + data.shape[0]), axis=0)
-        h5f[ds][-data.shape[0] :] = data
-
     def append(self, which: int = 3):
-        with h5py.File(self._save_filename, "a") as h5f:
-            if which & 0b01 > 0:
-                self._append(h5f, "data1", self._data1)
-                self._append(h5f, "time1_arr", self._time1_arr[-1])
-                self._append(h5f, "t1_arr", self._t1_arr[-1])
-                self._append(h5f, "t1_err_arr", self._t1_err_arr[-1])
-            if which & 0b10 > 0:
-                self._append(h5f, "data2", self._data2)
-                self._append(h5f, "time2_arr", self._time2_arr[-1])
-                self._append(h5f, "t2_arr", self._t2_arr[-1])
-                self._append(h5f, "t2_err_arr", self._t2_err_arr[-1])
-
-        print(f"Data appended to: {self._save_filename}")
+        rows = {}
+        if which & 0b01 > 0:
+            rows["data1"] = _pad(self._data1, self._nr_delays)
+            rows["delay1"] = _pad(self._delay1, self._nr_delays)
+            rows["time1_arr"] = self._time1_arr[-1]
+            rows["t1_arr"] = self._t1_arr[-1]
+            rows["t1_err_arr"] = self._t1_err_arr[-1]
+        if which & 0b10 > 0:
+            rows["data2"] = _pad(self._data2, self._nr_delays)
+            rows["delay2"] = _pad(self._delay2, self._nr_delays)
+            rows["time2_arr"] = self._time2_arr[-1]
+            rows["t2_arr"] = self._t2_arr[-1]
+            rows["t2_err_arr"] = self._t2_err_arr[-1]
+        if self._appender is None:
+            self._stream_append(rows)
+            print(f"Data appended to: {self._save_filename}")
+        else:
+            self._appender.append(rows)
 
     @classmethod
-    def load(cls, load_filename: str) -> "CycleTs":
+    def load(cls, load_filename: str, lazy: bool = False) -> "CycleTs":
+        self = super().load(load_filename, lazy=lazy)
         with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp_90 = float(h5f.attrs["control_amp_90"])  # type: ignore
-            control_amp_180 = float(h5f.attrs["control_amp_180"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            delay_arr = np.array(h5f["delay_arr"])
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            jpa_params = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            time_start = float(h5f.attrs["time_start"])  # type: ignore
-            time1_arr = np.array(h5f["time1_arr"])
-            time2_arr = np.array(h5f["time2_arr"])
-            t1_arr = np.array(h5f["t1_arr"])
-            t2_arr = np.array(h5f["t2_arr"])
-            t1_err_arr = np.array(h5f["t1_err_arr"])
-            t2_err_arr = np.array(h5f["t2_err_arr"])
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp_90=control_amp_90,
-            control_amp_180=control_amp_180,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            delay_arr=delay_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-            drag=drag,
-        )
-        self.time_start = time_start
-        self._time1_arr = time1_arr
-        self._time2_arr = time2_arr
-        self._t1_arr = t1_arr
-        self._t2_arr = t2_arr
-        self._t1_err_arr = t1_err_arr
-        self._t2_err_arr = t2_err_arr
+            # growable arrays are private, not handled by Base.load
+            self._time1_arr = h5f["time1_arr"][()]  # type: ignore
+            self._time2_arr = h5f["time2_arr"][()]  # type: ignore
+            self._t1_arr = h5f["t1_arr"][()]  # type: ignore
+            self._t2_arr = h5f["t2_arr"][()]  # type: ignore
+            self._t1_err_arr = h5f["t1_err_arr"][()]  # type: ignore
+            self._t2_err_arr = h5f["t2_err_arr"][()]  # type: ignore
+            # all the traces, only used by refit
+            self._data1_arr = h5f["data1"][()]  # type: ignore
+            self._data2_arr = h5f["data2"][()]  # type: ignore
+            if "delay1" in h5f:
+                self._delay1_arr = h5f["delay1"][()]  # type: ignore
+                self._delay2_arr = h5f["delay2"][()]  # type: ignore
+            else:
+                # saved before adaptive delays, always the full delay_arr
+                self._delay1_arr = np.tile(self.delay_arr, (len(self._data1_arr), 1))
+                self._delay2_arr = np.tile(self.delay_arr, (len(self._data2_arr), 1))
 
         return self
 
+    def refit(self, nr_processes: Optional[int] = None):
+        """Fit again all the T1 and T2 traces of a loaded measurement.
+
+        Traces measured on the full `delay_arr` are fitted in one batch, those measured on
+        adaptive delays one by one. Updates the fitted times and their errors in place.
+        """
+        for data, delays, t_arr, t_err_arr in (
+            (self._data1_arr, self._delay1_arr, self._t1_arr, self._t1_err_arr),
+            (self._data2_arr, self._delay2_arr, self._t2_arr, self._t2_err_arr),
+        ):
+            full = np.all(delays == self.delay_arr, axis=-1)
+            if np.any(full):
+                popt, perr, _success = fit_batch(
+                    decay,
+                    self.delay_arr,
+                    data[full],
+                    decay_p0(self.delay_arr, data[full]),
+                    nr_processes=nr_processes,
+                )
+                t_arr[full] = popt[:, 0]
+                t_err_arr[full] = perr[:, 0]
+            for idx in np.flatnonzero(~full):
+                good = np.isfinite(delays[idx])
+                try:
+                    popt, perr = fit_decay(delays[idx, good], data[idx, good])
+                except Exception:
+                    popt = perr = np.full(3, np.nan)
+                t_arr[idx] = popt[0]
+                t_err_arr[idx] = perr[0]
+
     def analyze(self, selector=True):
         ret_fig = []
 
@@ -348,8 +373,41 @@ class CycleTs(Base):
 
         return ret_fig
 
-    def measure_t1(self, presto_address, presto_port, ext_ref_clk):
-        m = T1Class(
+    def _next_delays(self, t_arr):
+        """Delays for the next measurement, designed on the last fitted time if adaptive."""
+        if self.adaptive_nr_delays is None or len(t_arr) == 0:
+            return self.delay_arr
+        T = t_arr[-1]
+        if not np.isfinite(T) or T <= 0.0:
+            return self.delay_arr  # last fit failed, measure everything again
+        return optimal_decay_delays(
+            T, np.min(self.delay_arr), np.max(self.delay_arr), self.adaptive_nr_delays
+        )
+
+    def _acquire(self, presto_address, presto_port, ext_ref_clk, results, stop, gone):
+        # runs on the worker thread: measure T1 and T2 until Ctrl-C, and hand over the results
+        try:
+            while True:
+                for which in (1, 2):
+                    if not KEEP_GOING or stop.is_set():
+                        return
+                    # designed on the last available fit, the previous cycle's may be pending
+                    if which == 1:
+                        delays = self._next_delays(self._t1_arr)
+                        m = self._make_t1(delays)
+                    else:
+                        delays = self._next_delays(self._t2_arr)
+                        m = self._make_t2(delays)
+                    t_start = time.time()
+                    m.run(presto_address, presto_port, ext_ref_clk, save=False)
+                    _put(results, (which, m, delays, t_start, time.time()), gone)
+        except Exception as err:
+            _put(results, err, gone)
+        finally:
+            _put(results, None, gone)
+
+    def _make_t1(self, delay_arr) -> T1Class:
+        return T1Class(
             readout_freq=self.readout_freq,
             control_freq=self.control_freq,
             readout_amp=self.readout_amp,
@@ -357,7 +415,7 @@ class CycleTs(Base):
             readout_duration=self.readout_duration,
             control_duration=self.control_duration,
             sample_duration=self.sample_duration,
-            delay_arr=self.delay_arr,
+            delay_arr=delay_arr,
             readout_port=self.readout_port,
             control_port=self.control_port,
             sample_port=self.sample_port,
@@ -367,16 +425,9 @@ class CycleTs(Base):
             jpa_params=self.jpa_params,
             drag=self.drag,
         )
-        m.run(presto_address, presto_port, ext_ref_clk, save=False)
-        data, (popt, perr) = m.analyze_batch(self._ref_templates)
 
-        t1 = np.nan if popt is None else popt[0]
-        t1_err = np.nan if perr is None else perr[0]
-
-        return data, t1, t1_err
-
-    def measure_t2(self, presto_address, presto_port, ext_ref_clk):
-        m = RamseyEcho(
+    def _make_t2(self, delay_arr) -> RamseyEcho:
+        return RamseyEcho(
             readout_freq=self.readout_freq,
             control_freq=self.control_freq,
             readout_amp=self.readout_amp,
@@ -385,7 +436,7 @@ class CycleTs(Base):
             readout_duration=self.readout_duration,
             control_duration=self.control_duration,
             sample_duration=self.sample_duration,
-            delay_arr=self.delay_arr,
+            delay_arr=delay_arr,
             readout_port=self.readout_port,
             control_port=self.control_port,
             sample_port=self.sample_port,
@@ -395,13 +446,6 @@ class CycleTs(Base):
             jpa_params=self.jpa_params,
             drag=self.drag,
         )
-        m.run(presto_address, presto_port, ext_ref_clk, save=False)
-        data, (popt, perr) = m.analyze_batch(self._ref_templates)
-
-        t2 = np.nan if popt is None else popt[0]
-        t2_err = np.nan if perr is None else perr[0]
-
-        return data, t2, t2_err
 
 
 def get_save_filename():
@@ -426,6 +470,16 @@ def _my_pause(interval=0.1):
         time.sleep(interval)
 
 
+def _put(results, item, gone):
+    # like results.put(item), but give up if the consumer has stopped
+    while not gone.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
 def _handler(signum, frame):
     global KEEP_GOING
     if KEEP_GOING:
@@ -472,6 +526,13 @@ def _hist_plot(ax, spec, bin_ar, **kwargs):
     return ax.plot(x_quad, y_quad, **kwargs)
 
 
+def _pad(data, length):
+    # rows of the growable arrays are as long as delay_arr, adaptive ones are padded with NaN
+    ret = np.full(length, np.nan)
+    ret[: len(data)] = data
+    return ret
+
+
 def _irq(data):
     return np.percentile(data, 75) - np.percentile(data, 25)
 
@@ -4,14 +4,14 @@
 import math
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import rotate_opt, sin2
+from presto.utils import sin2
 
 from _base import Base
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -190,58 +190,6 @@ class DisplacementCalibration(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "DisplacementCalibration":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            control_df_arr: npt.NDArray[np.float64] = h5f["control_df_arr"][()]  # type: ignore
-            memory_freq = float(h5f.attrs["memory_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            memory_amp_arr: npt.NDArray[np.float64] = h5f["memory_amp_arr"][()]  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            memory_duration = float(h5f.attrs["memory_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            memory_port = int(h5f.attrs["memory_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type:ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type:ignore
-            control_freq_arr: npt.NDArray[np.float64] = h5f["control_freq_arr"][()]  # type:ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            control_df_arr=control_df_arr,
-            memory_freq=memory_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            memory_amp_arr=memory_amp_arr,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            memory_duration=memory_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            memory_port=memory_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-        self.control_freq_arr = control_freq_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False, blit: bool = False, _do_fit: bool = True):
         assert self.t_arr is not None
         assert self.store_arr is not None
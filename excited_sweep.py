@@ -3,9 +3,7 @@
 
 from typing import Optional
 
-import h5py
 import numpy as np
-import numpy.typing as npt
 
 from presto import pulsed
 from presto.utils import sin2, untwist_downconversion
@@ -162,58 +160,6 @@ class ExcitedSweep(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "ExcitedSweep":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq_center = float(h5f.attrs["readout_freq_center"])  # type: ignore
-            readout_freq_span = float(h5f.attrs["readout_freq_span"])  # type: ignore
-            readout_freq_nr = int(h5f.attrs["readout_freq_nr"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-            readout_nco = float(h5f.attrs["readout_nco"])  # type: ignore
-
-            readout_freq_arr: npt.NDArray[np.float64] = h5f["readout_freq_arr"][()]  # type: ignore
-            readout_if_arr: npt.NDArray[np.float64] = h5f["readout_if_arr"][()]  # type: ignore
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq_center=readout_freq_center,
-            readout_freq_span=readout_freq_span,
-            readout_freq_nr=readout_freq_nr,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            drag=drag,
-        )
-        self.readout_freq_arr = readout_freq_arr
-        self.readout_if_arr = readout_if_arr
-        self.readout_nco = readout_nco
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False):
         assert self.t_arr is not None
         assert self.store_arr is not None
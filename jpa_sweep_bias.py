@@ -5,7 +5,6 @@
 
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -13,6 +12,7 @@ from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, sweep_freq
 
 
 class JpaSweepBias(Base):
@@ -40,7 +40,7 @@ class JpaSweepBias(Base):
         self.input_port = input_port
         self.bias_port = bias_port
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
 
         self.freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
@@ -95,23 +95,23 @@ class JpaSweepBias(Base):
             lck.apply_settings()
             lck.hardware.dac_autoconfig = False
 
+            self._stream_open(__file__, {"resp_arr": (self.resp_arr.shape, np.complex128)})
+
             pb = ProgressBar(nr_bias * nr_freq)
             pb.start()
             for jj, bias in enumerate(self.bias_arr):
                 lck.hardware.set_dc_bias(bias, self.bias_port)
                 lck.hardware.sleep(1.0, False)
 
-                _d = lck.sweep_nco(
-                    input_port=self.input_port,
-                    input_freqs=self.freq_arr,
-                    output_port=self.output_port,
-                    output_freqs=self.freq_arr,
-                    nr_averages=self.num_averages,
+                self.resp_arr[jj] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr,
+                    self.num_averages,
                     status_callback=pb.increment,
                 )
-                data_i = _d[self.input_port][1][:, 0]
-                data_q = _d[self.input_port][2][:, 0]
-                self.resp_arr[jj] = data_i.real + 1j * data_q.real  # using zero IF
+                self._stream_write("resp_arr", jj, self.resp_arr[jj])
 
             pb.done()
 
@@ -120,47 +120,11 @@ class JpaSweepBias(Base):
             lck.apply_settings()
             lck.hardware.set_dc_bias(0.0, self.bias_port)
 
-        return self.save()
+        return self._stream_close()
 
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "JpaSweepBias":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            amp = float(h5f.attrs["amp"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            bias_port = int(h5f.attrs["bias_port"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            bias_arr: npt.NDArray[np.float64] = h5f["bias_arr"][()]  # type: ignore
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp=amp,
-            bias_arr=bias_arr,
-            output_port=output_port,
-            input_port=input_port,
-            bias_port=bias_port,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.freq_arr = freq_arr
-        self.resp_arr = resp_arr
-
-        return self
-
     def analyze(self, quantity: str):
         assert self.freq_arr is not None
         assert self.resp_arr is not None
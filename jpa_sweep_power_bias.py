@@ -6,7 +6,6 @@
 import math
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -14,6 +13,7 @@ from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, sweep_freq
 
 
 class JpaSweepPowerBias(Base):
@@ -47,7 +47,7 @@ class JpaSweepPowerBias(Base):
         self.pump_port = pump_port
         self.pump_freq = 2 * self.freq_center if pump_freq is None else pump_freq
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
 
         self.freq_arr = None  # replaced by run
         self.ref_resp_arr = None  # replaced by run
@@ -109,6 +109,14 @@ class JpaSweepPowerBias(Base):
 
             lck.apply_settings()
 
+            self._stream_open(
+                __file__,
+                {
+                    "ref_resp_arr": (self.ref_resp_arr.shape, np.complex128),
+                    "resp_arr": (self.resp_arr.shape, np.complex128),
+                },
+            )
+
             pb = ProgressBar((nr_pump_pwr + 1) * nr_bias * nr_freq)
             pb.start()
             for kk, pump_pwr in enumerate(np.r_[-1, self.pump_pwr_arr]):
@@ -121,21 +129,20 @@ class JpaSweepPowerBias(Base):
                     lck.hardware.set_dc_bias(bias, self.bias_port)
                     lck.hardware.sleep(0.1, False)
 
-                    _d = lck.sweep_nco(
-                        input_port=self.input_port,
-                        input_freqs=self.freq_arr,
-                        output_port=self.output_port,
-                        output_freqs=self.freq_arr,
-                        nr_averages=self.num_averages,
+                    data = sweep_freq(
+                        lck,
+                        self.input_port,
+                        self.output_port,
+                        self.freq_arr,
+                        self.num_averages,
                         status_callback=pb.increment,
                     )
-                    data_i = _d[self.input_port][1][:, 0]
-                    data_q = _d[self.input_port][2][:, 0]
-                    data = data_i.real + 1j * data_q.real  # using zero IF
                     if kk == 0:
                         self.ref_resp_arr[jj, :] = data
+                        self._stream_write("ref_resp_arr", jj, data)
                     else:
                         self.resp_arr[kk - 1, jj, :] = data
+                        self._stream_write("resp_arr", (kk - 1, jj), data)
 
             pb.done()
 
@@ -145,59 +152,11 @@ class JpaSweepPowerBias(Base):
             lck.hardware.set_dc_bias(0.0, self.bias_port)
             lck.hardware.set_lmx(0.0, 0, self.pump_port)
 
-        return self.save()
+        return self._stream_close()
 
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "JpaSweepPowerBias":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            amp = float(h5f.attrs["amp"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            bias_port = int(h5f.attrs["bias_port"])  # type: ignore
-            pump_port = int(h5f.attrs["pump_port"])  # type: ignore
-            pump_freq = float(h5f.attrs["pump_freq"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            bias_arr: npt.NDArray[np.float64] = h5f["bias_arr"][()]  # type: ignore
-            pump_pwr_arr: npt.NDArray[np.int64] = h5f["pump_pwr_arr"][()]  # type: ignore
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            ref_resp_arr: npt.NDArray[np.complex128] = h5f["ref_resp_arr"][()]  # type: ignore
-            ref_pwr_arr: npt.NDArray[np.float64] = h5f["ref_pwr_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-            pwr_arr: npt.NDArray[np.float64] = h5f["pwr_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp=amp,
-            bias_arr=bias_arr,
-            pump_pwr_arr=pump_pwr_arr,
-            output_port=output_port,
-            input_port=input_port,
-            bias_port=bias_port,
-            pump_port=pump_port,
-            pump_freq=pump_freq,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.freq_arr = freq_arr
-        self.ref_resp_arr = ref_resp_arr
-        self.ref_pwr_arr = ref_pwr_arr
-        self.resp_arr = resp_arr
-        self.pwr_arr = pwr_arr
-
-        return self
-
     def analyze(self, quantity: str = "signal", marker_freq: Optional[float] = None):
         assert self.freq_arr is not None
         assert self.ref_resp_arr is not None
@@ -5,18 +5,17 @@ Measure Rabi oscillation by changing the amplitude of the control pulse.
 The control pulse has a square envelope, while the readout pulse is square.
 """
 
-import ast
 import math
 from typing import List, Optional, Tuple, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import format_precision, rotate_opt
+from presto.utils import format_precision
 
 from _base import Base
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -149,57 +148,6 @@ class RabiAmp(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "RabiAmp":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp_arr: npt.NDArray[np.float64] = h5f["control_amp_arr"][()]  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            num_pulses = int(h5f.attrs["num_pulses"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-
-            try:
-                drag = float(h5f.attrs["drag"])  # type: ignore
-            except KeyError:
-                drag = 0.0
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp_arr=control_amp_arr,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            num_pulses=num_pulses,
-            jpa_params=jpa_params,
-            drag=drag,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False):
         if self.t_arr is None:
             raise RuntimeError
@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 """Measure a Ramsey fringes pattern by changing the frequency of two π/2 pulses and their delay."""
 
-import ast
 from typing import Any, List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import format_precision, rotate_opt, sin2, si_prefix_scale
+from presto.utils import format_precision, sin2, si_prefix_scale
 
 from _base import Base
+from _fit import fit_batch, fit_damped_cosine_p0
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -176,63 +176,6 @@ class RamseyFringes(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "RamseyFringes":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq_center = float(h5f.attrs["control_freq_center"])  # type: ignore
-            control_freq_span = float(h5f.attrs["control_freq_span"])  # type: ignore
-            control_freq_nr = int(h5f.attrs["control_freq_nr"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            delay_arr: npt.NDArray[np.float64] = h5f["delay_arr"][()]  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-
-            control_freq_arr: npt.NDArray[np.float64] = h5f["control_freq_arr"][()]  # type: ignore
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-
-            try:
-                drag = float(h5f.attrs["drag"])  # type: ignore
-            except KeyError:
-                drag = 0.0
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq_center=control_freq_center,
-            control_freq_span=control_freq_span,
-            control_freq_nr=control_freq_nr,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            delay_arr=delay_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-            drag=drag,
-        )
-        self.control_freq_arr = control_freq_arr
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False):
         assert self.t_arr is not None
         assert self.store_arr is not None
@@ -314,15 +257,13 @@ class RamseyFringes(Base):
         # fig2.show()
         # ret_fig.append(fig2)
 
-        fit_freq = np.zeros_like(self.control_freq_arr)
-        err_freq = np.zeros_like(self.control_freq_arr)
-        for jj in range(self.control_freq_nr):
-            try:
-                res, err = _fit_simple(self.delay_arr, plot_data[jj])
-                fit_freq[jj] = np.abs(res[3])
-                err_freq[jj] = err[3]
-            except Exception:
-                fit_freq[jj] = np.nan
+        # fit all control frequencies at once from the matrix-pencil guesses, NaN where the fit
+        # fails
+        res, err, _success = fit_batch(
+            _func, self.delay_arr, plot_data, fit_damped_cosine_p0(self.delay_arr, plot_data)
+        )
+        fit_freq = np.abs(res[:, 3])
+        err_freq = err[:, 3]
 
         # n_fit = self.control_freq_nr // 4
         # pfit1 = np.polyfit(self.control_freq_arr[:n_fit], fit_freq[:n_fit], 1)
@@ -374,33 +315,3 @@ class RamseyFringes(Base):
 
 def _func(t, offset, amplitude, T2, frequency, phase):
     return offset + amplitude * np.exp(-t / T2) * np.cos(2.0 * np.pi * frequency * t + phase)
-
-
-def _fit_simple(x, y):
-    from scipy.optimize import curve_fit
-
-    pkpk = np.max(y) - np.min(y)
-    offset = np.min(y) + pkpk / 2
-    amplitude = 0.5 * pkpk
-    T2 = 0.5 * (np.max(x) - np.min(x))
-    freqs = np.fft.rfftfreq(len(x), x[1] - x[0])
-    fft = np.fft.rfft(y)
-    fft[0] = 0
-    idx_max = np.argmax(np.abs(fft))
-    frequency = freqs[idx_max]
-    phase = np.angle(fft[idx_max])
-    p0 = (
-        offset,
-        amplitude,
-        T2,
-        frequency,
-        phase,
-    )
-    popt, pcov = curve_fit(
-        _func,
-        x,
-        y,
-        p0=p0,
-    )
-    perr = np.sqrt(np.diag(pcov))
-    return popt, perr
@@ -3,25 +3,30 @@
 Randomized benchmarking of a single qubit.
 
 Use π/2 pulses (SX gates) and virtual Z gates (RZ gates).
-Requires third-party packages:
+The random Clifford sequences are generated natively by default. Generating them with
+`rb_generator="qiskit"` requires third-party packages:
   - qiskit 0.45.1
   - qiskit_experiments 0.5.4
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
 import time
-from typing import List, Optional, Tuple, TypeAlias, Union
+from typing import TYPE_CHECKING, List, Optional, Tuple, TypeAlias, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
-from qiskit.circuit import QuantumCircuit
-from qiskit.compiler import transpile
-from qiskit_experiments.library import StandardRB
 
 from presto import pulsed
-from presto.utils import rotate_opt, sin2
+from presto.utils import sin2
 
 from _base import Base
+from _rotate import rotate_opt
+
+if TYPE_CHECKING:
+    from qiskit.circuit import QuantumCircuit
 
 Gate: TypeAlias = Tuple[str, int]
 GateSeq: TypeAlias = List[Gate]
@@ -29,8 +34,75 @@ GateSeq: TypeAlias = List[Gate]
 IDX_LOW = 0
 IDX_HIGH = -1
 
+# The 24 single-qubit Clifford gates (up to a global phase) decomposed in SX and RZ gates, with
+# RZ angles in units of π/2 and gates listed in order of application
+_CLIFFORD_GATES: List[List[tuple]] = [
+    [],
+    [("rz", 1)],
+    [("rz", 2)],
+    [("rz", 3)],
+    [("sx",)],
+    [("sx",), ("rz", 1)],
+    [("sx",), ("rz", 2)],
+    [("sx",), ("rz", 3)],
+    [("rz", 1), ("sx",)],
+    [("rz", 2), ("sx",)],
+    [("rz", 3), ("sx",)],
+    [("rz", 1), ("sx",), ("rz", 1)],
+    [("rz", 1), ("sx",), ("rz", 2)],
+    [("rz", 1), ("sx",), ("rz", 3)],
+    [("rz", 2), ("sx",), ("rz", 1)],
+    [("rz", 2), ("sx",), ("rz", 2)],
+    [("rz", 2), ("sx",), ("rz", 3)],
+    [("rz", 3), ("sx",), ("rz", 1)],
+    [("rz", 3), ("sx",), ("rz", 2)],
+    [("rz", 3), ("sx",), ("rz", 3)],
+    [("sx",), ("sx",)],
+    [("sx",), ("sx",), ("rz", 1)],
+    [("sx",), ("sx",), ("rz", 2)],
+    [("sx",), ("sx",), ("rz", 3)],
+]
+
+
+def _clifford_tables() -> Tuple[List[List[int]], List[int]]:
+    sx = 0.5 * np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]])
+
+    def rz(k):
+        return np.diag(np.exp(np.array([-1j, 1j]) * k * np.pi / 4))
+
+    unitaries = []
+    for gates in _CLIFFORD_GATES:
+        u = np.eye(2, dtype=np.complex128)
+        for gate in gates:
+            u = (sx if gate[0] == "sx" else rz(gate[1])) @ u
+        unitaries.append(u)
+
+    def index(u):
+        for ii, v in enumerate(unitaries):
+            # equal up to a global phase
+            if abs(abs(np.trace(v.conj().T @ u)) - 2.0) < 1e-6:
+                return ii
+        raise RuntimeError("not a Clifford")
+
+    # compose[a][b]: first a, then b
+    compose = [[index(ub @ ua) for ub in unitaries] for ua in unitaries]
+    inverse = [row.index(0) for row in compose]
+    return compose, inverse
+
+
+_CLIFFORD_COMPOSE, _CLIFFORD_INVERSE = _clifford_tables()
+
 
 class Rb(Base):
+    BATCH_MAX_PULSES: int = 100_000
+    """Maximum number of control pulses in a single pulse program when running in batches"""
+    BATCH_MAX_STORE_SAMPLES: int = 2**20
+    """Maximum number of samples stored in a single pulse program when running in batches"""
+    RB_CACHE_DIR: Optional[str] = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "data", "rb_cache"
+    )
+    """Directory where generated sequences are cached by content. Set to `None` to disable"""
+
     def __init__(
         self,
         readout_freq: float,
@@ -49,6 +121,8 @@ class Rb(Base):
         rb_len_arr: Union[List[int], npt.NDArray[np.int64]],
         rb_nr_realizations: int,
         drag: float = 0.0,
+        rb_seed: Optional[int] = None,
+        rb_generator: str = "native",
     ) -> None:
         self.readout_freq = readout_freq
         self.control_freq = control_freq
@@ -66,6 +140,11 @@ class Rb(Base):
         self.rb_len_arr = np.atleast_1d(rb_len_arr).astype(np.int64)
         self.rb_nr_realizations = rb_nr_realizations
         self.drag = drag
+        self.rb_seed = rb_seed  # random if None, replaced by run
+        self.rb_generator = rb_generator
+
+        if self.rb_generator not in ["native", "qiskit"]:
+            raise ValueError(f"unknown RB generator: {self.rb_generator}")
 
         self.t_arr = None  # replaced by run
         self.store_arr = None  # replaced by run
@@ -76,10 +155,26 @@ class Rb(Base):
         presto_address: str,
         presto_port: Optional[int] = None,
         ext_ref_clk: bool = False,
+        reuse_session: bool = False,
+        nr_processes: Optional[int] = None,
+        batch: bool = False,
     ) -> str:
+        """Run all the randomized-benchmarking sequences.
+
+        Args:
+            reuse_session: if `True`, connect to Presto only once and keep data converters and
+                mixers configured across sequences. The pulses are also set up only once, and
+                for each point only the sequence is cleared with `Pulsed.reset` and programmed
+                again. If `False` (default), reconnect and reconfigure for each sequence.
+            nr_processes: number of worker processes used to generate the random sequences with
+                qiskit. If `None`, use as many as the number of processors on the machine.
+            batch: if `True`, pack as many sequences as allowed by `BATCH_MAX_PULSES` and
+                `BATCH_MAX_STORE_SAMPLES` in a single pulse program, with one readout per sequence.
+                Implies `reuse_session`, with the program cleared before each batch.
+        """
         rb_nr_lengths = len(self.rb_len_arr)
         print("Generating random sequences, this might take a while...")
-        self._rb_sequences = self._rbgen()
+        self._rb_sequences = self._rbgen(nr_processes)
         assert len(self._rb_sequences) == self.rb_nr_realizations
         assert len(self._rb_sequences[0]) == rb_nr_lengths
         print("Done!")
@@ -90,6 +185,13 @@ class Rb(Base):
         self.store_arr = np.zeros(
             (self.rb_nr_realizations, rb_nr_lengths, samples_per_store), np.complex128
         )
+        if batch:
+            self._run_batched(presto_address, presto_port, ext_ref_clk)
+            return self.save()
+        if reuse_session:
+            self._run_session(presto_address, presto_port, ext_ref_clk)
+            return self.save()
+
         for i, a in enumerate(self._rb_sequences):
             for j, seq in enumerate(a):
                 cnt = cnt + 1
@@ -106,54 +208,6 @@ class Rb(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "Rb":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            rb_len_arr: npt.NDArray[np.int64] = h5f["rb_len_arr"][()]  # type: ignore
-            rb_nr_realizations = int(h5f.attrs["rb_nr_realizations"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-            rb_sequences = h5f["rb_sequences"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            rb_len_arr=rb_len_arr,
-            rb_nr_realizations=rb_nr_realizations,
-            drag=drag,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-        self._rb_sequences = rb_sequences  # type: ignore
-
-        return self
-
     def _run_sequence(
         self,
         sequence: GateSeq,
@@ -167,93 +221,227 @@ class Rb(Base):
             ext_ref_clk=ext_ref_clk,
             **self.DC_PARAMS,
         ) as pls:
-            pls.hardware.set_adc_attenuation(self.sample_port, self.ADC_ATTENUATION)
-            pls.hardware.set_dac_current(self.readout_port, self.DAC_CURRENT)
-            pls.hardware.set_dac_current(self.control_port, self.DAC_CURRENT)
-            pls.hardware.set_inv_sinc(self.readout_port, 0)
-            pls.hardware.set_inv_sinc(self.control_port, 0)
-
-            pls.hardware.configure_mixer(
-                self.control_freq,
-                out_ports=self.control_port,
-            )
-            pls.hardware.configure_mixer(
-                self.readout_freq,
-                out_ports=self.readout_port,
-                in_ports=self.sample_port,
-            )
+            self._setup_hardware(pls)
+            readout_pulse, control_pulses = self._setup_pulses(pls)
+            T = self._program_sequence(pls, sequence, readout_pulse, control_pulses)
+
+            pls.run(T, 1, self.num_averages)
+            return pls.get_store_data()
+
+    def _run_session(
+        self,
+        presto_address: str,
+        presto_port: Optional[int] = None,
+        ext_ref_clk: bool = False,
+    ):
+        assert self.store_arr is not None
+
+        cnt = 0
+        tot = self.rb_nr_realizations * len(self.rb_len_arr)
+        with pulsed.Pulsed(
+            address=presto_address,
+            port=presto_port,
+            ext_ref_clk=ext_ref_clk,
+            **self.DC_PARAMS,
+        ) as pls:
+            # converters, mixers and pulses are set up only once, each point only programs its
+            # sequence
+            self._setup_hardware(pls)
+            readout_pulse, control_pulses = self._setup_pulses(pls)
+
+            for i, a in enumerate(self._rb_sequences):
+                for j, seq in enumerate(a):
+                    cnt = cnt + 1
+                    print()
+                    print(f"****** {cnt}/{tot} ******")
+                    self._clear_sequence(pls)
+                    T = self._program_sequence(pls, seq, readout_pulse, control_pulses)
+                    pls.run(T, 1, self.num_averages)
+                    self.t_arr, data = pls.get_store_data()
+                    self.store_arr[i, j, :] = data[0, 0, :]
+
+    def _run_batched(
+        self,
+        presto_address: str,
+        presto_port: Optional[int] = None,
+        ext_ref_clk: bool = False,
+    ):
+        assert self.store_arr is not None
+
+        indices = [
+            (i, j) for i in range(self.rb_nr_realizations) for j in range(len(self.rb_len_arr))
+        ]
+        sequences = [self._rb_sequences[i][j] for i, j in indices]
+        samples_per_store = self.store_arr.shape[-1]
+        batches = _schedule_batches(
+            sequences,
+            max_pulses=self.BATCH_MAX_PULSES,
+            max_stores=max(1, self.BATCH_MAX_STORE_SAMPLES // samples_per_store),
+        )
 
-            readout_pulse = pls.setup_long_drive(
-                self.readout_port,
-                group=0,
-                duration=self.readout_duration,
-                amplitude=1.0 + 1j,
-                envelope=False,
+        with pulsed.Pulsed(
+            address=presto_address,
+            port=presto_port,
+            ext_ref_clk=ext_ref_clk,
+            **self.DC_PARAMS,
+        ) as pls:
+            self._setup_hardware(pls)
+            readout_pulse, control_pulses = self._setup_pulses(pls)
+
+            for cnt, batch in enumerate(batches):
+                print()
+                print(f"****** batch {cnt + 1}/{len(batches)}: {len(batch)} sequences ******")
+                # sequences one after the other, each with its own readout and store
+                self._clear_sequence(pls)
+                T = 0.0
+                for kk in batch:
+                    T = self._program_sequence(
+                        pls, sequences[kk], readout_pulse, control_pulses, T, verbose=False
+                    )
+                pls.run(T, 1, self.num_averages)
+                self.t_arr, data = pls.get_store_data()
+                for store_idx, kk in enumerate(batch):
+                    i, j = indices[kk]
+                    self.store_arr[i, j, :] = data[store_idx, 0, :]
+
+    def _clear_sequence(self, pls: pulsed.Pulsed):
+        """Clear the events programmed for the previous run in the same session, so that a run
+        never replays the sequence of an earlier one. The pulses, scales and store set up by
+        `_setup_pulses` are kept."""
+        if not hasattr(pls, "reset"):
+            raise RuntimeError(
+                "this version of presto can't clear the pulse program between runs, "
+                "run with reuse_session=False"
             )
+        pls.reset()
+
+    def _setup_hardware(self, pls: pulsed.Pulsed):
+        pls.hardware.set_adc_attenuation(self.sample_port, self.ADC_ATTENUATION)
+        pls.hardware.set_dac_current(self.readout_port, self.DAC_CURRENT)
+        pls.hardware.set_dac_current(self.control_port, self.DAC_CURRENT)
+        pls.hardware.set_inv_sinc(self.readout_port, 0)
+        pls.hardware.set_inv_sinc(self.control_port, 0)
+
+        pls.hardware.configure_mixer(
+            self.control_freq,
+            out_ports=self.control_port,
+        )
+        pls.hardware.configure_mixer(
+            self.readout_freq,
+            out_ports=self.readout_port,
+            in_ports=self.sample_port,
+        )
 
-            control_ns = int(round(self.control_duration * pls.get_fs("dac")))
-            control_envelope = sin2(control_ns, drag=self.drag)
-            control_pulses = [
-                pls.setup_template(
-                    self.control_port,
-                    0,
-                    np.real(control_envelope),
-                    np.imag(control_envelope),
-                ),
-                pls.setup_template(
-                    self.control_port,
-                    0,
-                    np.imag(control_envelope),
-                    -np.real(control_envelope),
-                ),
-                pls.setup_template(
-                    self.control_port,
-                    0,
-                    -np.real(control_envelope),
-                    -np.imag(control_envelope),
-                ),
-                pls.setup_template(
-                    self.control_port,
-                    0,
-                    -np.imag(control_envelope),
-                    np.real(control_envelope),
-                ),
-            ]
-
-            pls.setup_store(self.sample_port, self.sample_duration)
-
-            pls.setup_scale_lut(self.control_port, 0, self.control_amp)
-            pls.setup_scale_lut(self.readout_port, 0, self.readout_amp)
-
-            T = 0
-            vphase: int = 0
-
-            # reset phase on control_port here if using IF
-            pulse_count = 0
-            for gate in sequence:
-                if gate[0] == "rz":
-                    vphase = (vphase + gate[1]) % 4
-                elif gate[0] == "sx":
-                    pls.output_pulse(T, control_pulses[vphase])
-                    T += self.control_duration
-                    pulse_count = pulse_count + 1
-                else:
-                    raise NotImplementedError(f"unknown gate {gate}")
+    def _setup_pulses(self, pls: pulsed.Pulsed):
+        readout_pulse = pls.setup_long_drive(
+            self.readout_port,
+            group=0,
+            duration=self.readout_duration,
+            amplitude=1.0 + 1j,
+            envelope=False,
+        )
 
+        control_ns = int(round(self.control_duration * pls.get_fs("dac")))
+        control_envelope = sin2(control_ns, drag=self.drag)
+        control_pulses = [
+            pls.setup_template(
+                self.control_port,
+                0,
+                np.real(control_envelope),
+                np.imag(control_envelope),
+            ),
+            pls.setup_template(
+                self.control_port,
+                0,
+                np.imag(control_envelope),
+                -np.real(control_envelope),
+            ),
+            pls.setup_template(
+                self.control_port,
+                0,
+                -np.real(control_envelope),
+                -np.imag(control_envelope),
+            ),
+            pls.setup_template(
+                self.control_port,
+                0,
+                -np.imag(control_envelope),
+                np.real(control_envelope),
+            ),
+        ]
+
+        pls.setup_store(self.sample_port, self.sample_duration)
+
+        pls.setup_scale_lut(self.control_port, 0, self.control_amp)
+        pls.setup_scale_lut(self.readout_port, 0, self.readout_amp)
+
+        return readout_pulse, control_pulses
+
+    def _program_sequence(
+        self,
+        pls: pulsed.Pulsed,
+        sequence: GateSeq,
+        readout_pulse,
+        control_pulses: list,
+        T: float = 0.0,
+        verbose: bool = True,
+    ) -> float:
+        vphase: int = 0
+
+        # reset phase on control_port here if using IF
+        pulse_count = 0
+        for gate in sequence:
+            if gate[0] == "rz":
+                vphase = (vphase + gate[1]) % 4
+            elif gate[0] == "sx":
+                pls.output_pulse(T, control_pulses[vphase])
+                T += self.control_duration
+                pulse_count = pulse_count + 1
+            else:
+                raise NotImplementedError(f"unknown gate {gate}")
+
+        if verbose:
             print(f"{pulse_count = }")
 
-            # reset phase on readout_port here if using IF
-            pls.output_pulse(T, readout_pulse)
-            pls.store(T + self.readout_sample_delay)
+        # reset phase on readout_port here if using IF
+        pls.output_pulse(T, readout_pulse)
+        pls.store(T + self.readout_sample_delay)
 
-            # wait for qubit decay
-            T += self.wait_delay
+        # wait for qubit decay
+        T += self.wait_delay
 
-            pls.run(T, 1, self.num_averages)
-            return pls.get_store_data()
+        return T
+
+    def _rbgen(self, nr_processes: Optional[int] = None) -> List[List[GateSeq]]:
+        if self.rb_seed is None:
+            self.rb_seed = int(np.random.SeedSequence().generate_state(1)[0])
+            use_cache = False
+        else:
+            # the native generator is faster than reading back from cache
+            use_cache = self.RB_CACHE_DIR is not None and self.rb_generator == "qiskit"
+
+        lengths = self.rb_len_arr.tolist()
+        if self.rb_generator == "native":
+            return _native_singlequbitrb(lengths, self.rb_nr_realizations, self.rb_seed)
+
+        cache_path = ""
+        if use_cache:
+            assert self.RB_CACHE_DIR is not None
+            key = _cache_key(lengths, self.rb_nr_realizations, self.rb_seed)
+            cache_path = os.path.join(self.RB_CACHE_DIR, f"{key}.json")
+            sequences = _cache_read(cache_path)
+            if sequences is not None:
+                print(f"Loaded sequences from cache: {cache_path}")
+                return sequences
+
+        sequences = _singlequbitrb(
+            lengths, self.rb_nr_realizations, self.rb_seed, nr_processes=nr_processes
+        )
 
-    def _rbgen(self) -> List[List[GateSeq]]:
-        return _singlequbitrb(self.rb_len_arr.tolist(), self.rb_nr_realizations)
+        if use_cache:
+            _cache_write(cache_path, sequences)
+
+        return sequences
 
     def analyze(self):
         if self.t_arr is None:
@@ -422,22 +610,118 @@ class Rb(Base):
         return ret_fig
 
 
-def _singlequbitrb(lengths: List[int], num_samples: int) -> List[List[GateSeq]]:
+def _schedule_batches(
+    sequences: List[GateSeq], max_pulses: int, max_stores: int
+) -> List[List[int]]:
+    """Group consecutive sequences so that no program exceeds `max_pulses` control pulses nor
+    `max_stores` stores. Return the indices of the sequences in each group.
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    nr_pulses = 0
+    for kk, seq in enumerate(sequences):
+        seq_pulses = sum(1 for gate in seq if gate[0] == "sx")
+        if seq_pulses > max_pulses:
+            raise ValueError(f"sequence {kk} has {seq_pulses} pulses, maximum is {max_pulses}")
+        if batch and (nr_pulses + seq_pulses > max_pulses or len(batch) >= max_stores):
+            batches.append(batch)
+            batch = []
+            nr_pulses = 0
+        batch.append(kk)
+        nr_pulses += seq_pulses
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _singlequbitrb(
+    lengths: List[int],
+    num_samples: int,
+    seed: int,
+    nr_processes: Optional[int] = None,
+) -> List[List[GateSeq]]:
+    # one independent seed per realization, so that the result doesn't depend on how the
+    # realizations are distributed among processes
+    seed_seqs = np.random.SeedSequence(seed).spawn(num_samples)
+    seeds = [int(ss.generate_state(1)[0]) for ss in seed_seqs]
+    with ProcessPoolExecutor(max_workers=nr_processes) as executor:
+        sequences = list(executor.map(_singlequbitrb_realization, [lengths] * num_samples, seeds))
+    return sequences
+
+
+def _singlequbitrb_realization(lengths: List[int], seed: int) -> List[GateSeq]:
+    from qiskit.compiler import transpile
+    from qiskit_experiments.library import StandardRB
+
     qubits = [1]
 
-    exp = StandardRB(qubits, lengths, num_samples=num_samples)
+    exp = StandardRB(qubits, lengths, num_samples=1, seed=seed)
     basis_gates = ["sx", "rz"]
     ct = transpile(exp.circuits(), basis_gates=basis_gates)
-    sequences: List[List[GateSeq]] = []
-    for i in range(num_samples):
-        inner: List[GateSeq] = []
-        sequences.append(inner)
-        for j in range(len(lengths)):
-            inner.append(_translateseq(ct[i * len(lengths) + j]))
-    return sequences
+    return [_translateseq(ct[j]) for j in range(len(lengths))]
+
+
+def _cache_key(lengths: List[int], num_samples: int, seed: int) -> str:
+    content = json.dumps(
+        {"lengths": lengths, "num_samples": num_samples, "seed": seed},
+        sort_keys=True,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _cache_read(cache_path: str) -> Optional[List[List[GateSeq]]]:
+    try:
+        with open(cache_path, "r") as f:
+            sequences = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # JSON turns tuples into lists
+    return [
+        [[tuple(gate) for gate in seq] for seq in inner]  # type: ignore
+        for inner in sequences
+    ]
+
+
+def _cache_write(cache_path: str, sequences: List[List[GateSeq]]) -> None:
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(sequences, f)
+        os.replace(tmp_path, cache_path)  # atomic, never leave a partial file behind
+    except OSError as err:
+        print(f"WARN: unable to cache sequences: {err}")
+
+
+def _native_singlequbitrb(lengths: List[int], num_samples: int, seed: int) -> List[List[GateSeq]]:
+    seed_seqs = np.random.SeedSequence(seed).spawn(num_samples)
+    return [_native_singlequbitrb_realization(lengths, ss) for ss in seed_seqs]
+
+
+def _native_singlequbitrb_realization(
+    lengths: List[int], seed: Union[int, np.random.SeedSequence]
+) -> List[GateSeq]:
+    rng = np.random.default_rng(seed)
+    max_len = max(lengths)
+    # as in qiskit's StandardRB, shorter sequences are prefixes of the longest one
+    cliffords = rng.integers(len(_CLIFFORD_GATES), size=max_len).tolist()
+
+    # index of the Clifford obtained by composing the first k elements
+    composed = [0] * (max_len + 1)
+    for k, c in enumerate(cliffords):
+        composed[k + 1] = _CLIFFORD_COMPOSE[composed[k]][c]
+
+    result = []
+    for length in lengths:
+        seq = []
+        for c in cliffords[:length]:
+            seq.extend(_CLIFFORD_GATES[c])
+        seq.extend(_CLIFFORD_GATES[_CLIFFORD_INVERSE[composed[length]]])
+        result.append(seq)
+    return result
 
 
-def _translateseq(quantum_circuit: QuantumCircuit) -> GateSeq:
+def _translateseq(quantum_circuit: "QuantumCircuit") -> GateSeq:
     result = []
     for circuit_instruction in quantum_circuit:
         name = circuit_instruction.operation.name
@@ -4,18 +4,17 @@
 Acquire reference templates for template matching.
 """
 
-import ast
-from typing import Optional
+from typing import Optional, Sequence, Tuple, Union
 
-import h5py
 import numpy as np
-import numpy.typing as npt
 
 from presto import pulsed
 from presto.pulsed import MAX_TEMPLATE_LEN
-from presto.utils import sin2, to_pm_pi
+from presto.utils import sin2
 
 from _base import Base
+from _matched_filter import design_templates, noise_autocorrelation
+from _rotate import optimal_angle
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -240,61 +239,39 @@ class ReadoutRef(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "ReadoutRef":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-            clear: dict = ast.literal_eval(h5f.attrs["clear"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.float64] = h5f["store_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-            drag=drag,
-            clear=clear,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
-    def analyze(self, plot: bool = True, rotate: bool = False, match_len: Optional[int] = None):
+    def analyze(
+        self,
+        plot: bool = True,
+        rotate: bool = False,
+        match_len: Union[None, int, Sequence[int]] = None,
+        single_shots: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
+        """Find the window where |g> and |e> are most different and extract the templates.
+
+        Args:
+            plot: plot the traces and the distance between them
+            rotate: rotate the traces so that the difference between them is mostly along I
+            match_len: number of samples in the templates. If `None`, the maximum allowed. If a
+                sequence, all the candidate lengths are searched at once and the one with the
+                best boxcar signal-to-noise ratio `sum(distance) / sqrt(match_len)` is chosen.
+            single_shots: single-shot traces `(traces_g, traces_e)` measured with the same
+                settings, e.g. from `SingleShotReadout`. If given, the templates are the matched
+                filter for the measured noise instead of the averaged traces, and the window and
+                length are those with the best predicted signal-to-noise ratio, see
+                `_matched_filter`.
+
+        Returns:
+            dictionary with the traces, the templates and the timing of the match. `match_score`
+            is the summed distance for each start of the window, for diagnostics; with several
+            candidate lengths, `match_len_scores` has one row of scores per length. With
+            `single_shots`, also the predicted signal-to-noise ratio `snr` of the comparator
+            result, `snr_boxcar` with the averaged traces as templates and their ratio `snr_gain`.
+        """
         assert self.t_arr is not None
         assert self.store_arr is not None
 
         ret_fig = []
 
-        nr_samples = len(self.t_arr)
-
         trace_g = self.store_arr[0, 0, :]
         trace_e = self.store_arr[1, 0, :]
         if rotate:
@@ -304,22 +281,29 @@ class ReadoutRef(Base):
 
         max_match_len = MAX_TEMPLATE_LEN // 2  # I and Q
         if match_len is None:
-            match_len = max_match_len
+            match_len_arr = np.array([max_match_len])
         else:
-            match_len = int(match_len)
-            if match_len > max_match_len:  # I and Q
-                raise ValueError("maximum match length is {max_match_len}, got {match_len}")
-
-        max_idx = 0
-        max_dist = 0.0
-        for idx in range(0, nr_samples - match_len, 2):
-            dist = np.sum(distance[idx : idx + match_len])
-            if dist > max_dist:
-                max_dist = dist
-                max_idx = idx
+            match_len_arr = np.atleast_1d(match_len).astype(np.int64)
+            if np.any(match_len_arr > max_match_len):  # I and Q
+                raise ValueError(f"maximum match length is {max_match_len}, got {match_len}")
+
+        max_idx, best, scores = _window_search(distance, match_len_arr)
+        match_len = int(match_len_arr[best])
 
         ref_g = trace_g[max_idx : max_idx + match_len]
         ref_e = trace_e[max_idx : max_idx + match_len]
+        if single_shots is not None:
+            acf = noise_autocorrelation(*single_shots, max_lag=int(np.max(match_len_arr)))[2]
+            mf = design_templates(trace_g, trace_e, acf, match_len_arr)
+            max_idx = mf["match_idx"]
+            match_len = mf["match_len"]
+            best = int(np.flatnonzero(match_len_arr == match_len)[0])
+            ref_g = mf["ref_g"]
+            ref_e = mf["ref_e"]
+            print(
+                f"Matched filter: SNR {mf['snr']:.1f}, "
+                f"{mf['snr_gain']:.2f} times that of the averaged traces"
+            )
         match_t_in_store = self.t_arr[max_idx]
         readout_match_delay = self.readout_sample_delay + match_t_in_store
         print(f"Match starts at {1e9 * match_t_in_store:.0f} ns in store")
@@ -331,7 +315,16 @@ class ReadoutRef(Base):
             "ref_e": ref_e,
             "match_t_in_store": match_t_in_store,
             "readout_match_delay": readout_match_delay,
+            "match_len": match_len,
+            "match_score": scores[best],
         }
+        if single_shots is not None:
+            ret_dict["snr"] = mf["snr"]
+            ret_dict["snr_boxcar"] = mf["snr_boxcar"]
+            ret_dict["snr_gain"] = mf["snr_gain"]
+        if len(match_len_arr) > 1:
+            ret_dict["match_len_arr"] = match_len_arr
+            ret_dict["match_len_scores"] = scores
 
         if plot:
             import matplotlib.pyplot as plt
@@ -391,37 +384,43 @@ class ReadoutRef(Base):
             return ret_dict
 
 
+def _window_search(
+    distance: np.ndarray, match_len_arr: np.ndarray, step: int = 2
+) -> Tuple[int, int, np.ndarray]:
+    """Find the window with the largest summed `distance`, for several window lengths at once.
+
+    Window sums come from a single cumulative sum, O(N) per length instead of O(N * match_len).
+    Windows start at multiples of `step` and end before the last sample.
+
+    Returns:
+        the start of the best window, the index in `match_len_arr` of the best length and the
+        window sums with shape `(len(match_len_arr), len(distance))`, NaN where a window doesn't
+        fit
+    """
+    nr_samples = len(distance)
+    csum = np.concatenate(([0.0], np.cumsum(distance)))
+    idx = np.arange(nr_samples)
+    stop = idx[None, :] + match_len_arr[:, None]
+    valid = stop < nr_samples
+    scores = np.full((len(match_len_arr), nr_samples), np.nan)
+    scores[valid] = csum[stop[valid]] - csum[np.broadcast_to(idx, stop.shape)[valid]]
+
+    # candidate starts, as many as fit in the trace for each length
+    candidates = np.where(valid & (idx % step == 0)[None, :], scores, -np.inf)
+    best_idx = np.argmax(candidates, axis=-1)
+    best_score = candidates[np.arange(len(match_len_arr)), best_idx]
+    best_score = np.where(np.isfinite(best_score), best_score, 0.0)
+    best_idx[best_score <= 0.0] = 0  # as with no distance at all
+    best = int(np.argmax(best_score / np.sqrt(match_len_arr)))
+    return int(best_idx[best]), best, scores
+
+
 def _rotate_opt(trace_g, trace_e):
-    data = trace_e - trace_g  # complex distance
-
-    # calculate the mean of data.imag**2 in steps of 1 deg
-    N = 360
-    _mean = np.zeros(N)
-    for ii in range(N):
-        _data = data * np.exp(1j * 2 * np.pi / N * ii)
-        _mean[ii] = np.mean(_data.imag**2)
-
-    # the mean goes like cos(x)**2
-    # FFT and find the phase at frequency "2"
-    fft = np.fft.rfft(_mean) / N
-    # first solution
-    x_fft1 = -np.angle(fft[2])  # compensate for measured phase
-    x_fft1 -= np.pi  # we want to be at the zero of cos(2x)
-    x_fft1 /= 2  # move from frequency "2" to "1"
-    # there's a second solution np.pi away (a minus sign)
-    x_fft2 = x_fft1 + np.pi
-
-    # convert to +/- interval
-    x_fft1 = to_pm_pi(x_fft1)
-    x_fft2 = to_pm_pi(x_fft2)
-    # choose the closest to zero
-    if np.abs(x_fft1) < np.abs(x_fft2):
-        x_fft = x_fft1
-    else:
-        x_fft = x_fft2
+    # rotate so that the complex distance is mostly along I
+    x = optimal_angle(trace_e - trace_g, centered=False)
 
     # rotate the data and return a copy
-    trace_g = trace_g * np.exp(1j * x_fft)
-    trace_e = trace_e * np.exp(1j * x_fft)
+    trace_g = trace_g * np.exp(1j * x)
+    trace_e = trace_e * np.exp(1j * x)
 
     return trace_g, trace_e
@@ -5,10 +5,8 @@ Perform pulsed readout starting from ground and excited state using template mat
 reference traces. Use feedback to correct the state of the qubit.
 """
 
-import ast
 from typing import Optional
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -16,9 +14,13 @@ from presto import pulsed
 from presto.utils import sin2
 
 from _base import Base
+from _calibration import CalibrationStore, get_store
+from _histogram import StreamingHistogram
+from _mixture import fit_mixture, readout_fidelity, t_eff
 
 IDX_LOW = 0
 IDX_HIGH = -1
+CHUNK_SIZE = 2**18  # repetitions to histogram at once
 
 
 class ReadoutReset(Base):
@@ -44,6 +46,7 @@ class ReadoutReset(Base):
         jpa_params: Optional[dict] = None,
         drag: float = 0.0,
         clear: Optional[dict] = None,
+        threshold: Optional[float] = None,
     ) -> None:
         self.readout_freq = readout_freq
         self.control_freq = control_freq
@@ -73,6 +76,30 @@ class ReadoutReset(Base):
         self.jpa_params = jpa_params
 
         assert self.ref_g.shape == self.ref_e.shape
+        # comparator threshold, from the templates unless calibrated
+        self.threshold = _threshold(self.ref_g, self.ref_e) if threshold is None else threshold
+
+    @classmethod
+    def from_calibration(
+        cls, key: str, store: Optional[CalibrationStore] = None, **kwargs
+    ) -> "ReadoutReset":
+        """Create with the templates, threshold and match delay of calibration `key`.
+
+        Args:
+            key: name of the calibration, see `_calibration.ReadoutPipeline`
+            store: where the calibration is, by default in the default data directory
+            kwargs: all the other arguments to the constructor
+        """
+        if store is None:
+            store = get_store()
+        values = store.get(key)
+        return cls(
+            ref_g=values["ref_g"],
+            ref_e=values["ref_e"],
+            threshold=values["threshold"],
+            readout_match_delay=values["readout_match_delay"],
+            **kwargs,
+        )
 
     def run(
         self,
@@ -212,7 +239,6 @@ class ReadoutReset(Base):
 
             # Setup template matching
             # threshold = 0.5 * (_norm(self.ref_e)**2 - _norm(self.ref_g)**2)
-            threshold = _threshold(self.ref_g, self.ref_e)
             # templ_g = np.zeros(len(self.ref_g) * 2, np.float64)
             # templ_g[0::2] = np.real(self.ref_g)
             # templ_g[1::2] = np.imag(self.ref_g)
@@ -223,7 +249,7 @@ class ReadoutReset(Base):
                 input_port=self.sample_port,
                 template1=-self.ref_g,  # NOTE minus sign
                 template2=self.ref_e,
-                threshold=threshold,
+                threshold=self.threshold,
             )  # success when match_e + match_g - threshold > 0
 
             # Setup feedback
@@ -318,66 +344,65 @@ class ReadoutReset(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "ReadoutReset":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            readout_match_delay = float(h5f.attrs["readout_match_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            extra_wait = float(h5f.attrs["extra_wait"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-            clear: dict = ast.literal_eval(h5f.attrs["clear"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-            ref_g: npt.NDArray[np.complex128] = h5f["ref_g"][()]  # type: ignore
-            ref_e: npt.NDArray[np.complex128] = h5f["ref_e"][()]  # type: ignore
-            match_g_arr: npt.NDArray[np.float64] = h5f["match_g_arr"][()]  # type: ignore
-            match_e_arr: npt.NDArray[np.float64] = h5f["match_e_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            readout_match_delay=readout_match_delay,
-            ref_g=ref_g,
-            ref_e=ref_e,
-            num_averages=num_averages,
-            extra_wait=extra_wait,
-            jpa_params=jpa_params,
-            drag=drag,
-            clear=clear,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-        self.match_g_arr = match_g_arr
-        self.match_e_arr = match_e_arr
-
-        return self
+    def histogram(
+        self,
+        match_g_arr=None,
+        match_e_arr=None,
+        hist: Optional[StreamingHistogram] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> StreamingHistogram:
+        """Accumulate the comparator results `match_e + match_g - threshold` in histograms.
+
+        The data is processed `chunk_size` repetitions at a time, so memory use does not grow
+        with the number of shots.
+
+        Args:
+            match_g_arr, match_e_arr: template-matching results, e.g. from
+                `get_template_matching_data`, an `h5py.Dataset` or a `np.memmap`. Default to those
+                of the last `run` or `load`.
+            hist: add to these histograms, e.g. from a previous run. If `None`, start new ones.
+            chunk_size: number of repetitions to process at once.
+
+        Returns:
+            histograms in four streams, `2 * idx_excited + idx_readout`: prepared in |g> (0) or
+            |e> (1), first (0) or second (1) readout
+        """
+        if match_g_arr is None:
+            match_g_arr = self.match_g_arr
+        if match_e_arr is None:
+            match_e_arr = self.match_e_arr
+        assert match_g_arr is not None
+        assert match_e_arr is not None
+        if hist is None:
+            hist = StreamingHistogram(nr_streams=4, nr_bins=2**14)
+
+        step = 4 * chunk_size  # 2 preparations and 2 readouts per repetition
+        for start in range(0, len(match_g_arr), step):
+            stop = min(start + step, len(match_g_arr))
+            # does |e> match better than |g>?
+            match_diff = (
+                np.asarray(match_e_arr[start:stop])
+                + np.asarray(match_g_arr[start:stop])
+                - self.threshold
+            )
+            hist.update(match_diff.reshape(-1, 4))
+        return hist
 
-    def analyze(self, fix_sum: bool = True, logscale: bool = False):
+    def analyze(
+        self,
+        fix_sum: bool = True,
+        logscale: bool = False,
+        hist: Optional[StreamingHistogram] = None,
+    ):
+        """Plot the histograms of the comparator result before and after reset.
+
+        Args:
+            fix_sum: if `True`, fit the weights constrained to sum to one by expectation
+                maximization, with the Gaussians after reset the same as before. If `False`, fit
+                all parameters, weights included, freely by least squares on the histogram.
+            logscale: logarithmic y axis.
+            hist: histograms from `histogram`. If `None`, of the last `run` or `load`.
+        """
         assert self.t_arr is not None
         assert self.store_arr is not None
         assert self.match_g_arr is not None
@@ -402,77 +427,34 @@ class ReadoutReset(Base):
         fig1.show()
         ret_fig.append(fig1)
 
-        threshold = _threshold(self.ref_g, self.ref_e)
-        match_diff = (
-            self.match_e_arr + self.match_g_arr - threshold
-        )  # does |e> match better than |g>?
-        match_diff.shape = (
-            -1,
-            2,
-            2,
-        )  # -1: repetitions; 2: prepared in |g> or |e>; 2: 1st and 2nd readout
+        if hist is None:
+            hist = self.histogram()
+        # initial guesses for the fits, split at the threshold
+        moments = hist.moments()
+        ntot = hist.count[0]
+        nr_bins = int(round(np.sqrt(ntot)))
         for idx_excited in [0, 1]:
-            match_diff_1 = match_diff[
-                :, idx_excited, 0
-            ]  # prepared in |g/e>, first readout (before reset)
-            match_diff_2 = match_diff[
-                :, idx_excited, 1
-            ]  # prepared in |g/e>, second readout (after reset)
-
-            idx_low_1 = match_diff_1 < 0
-            idx_high_1 = np.logical_not(idx_low_1)
-            idx_low_2 = match_diff_2 < 0
-            idx_high_2 = np.logical_not(idx_low_2)
-            mean_low_1 = match_diff_1[idx_low_1].mean()
-            mean_high_1 = match_diff_1[idx_high_1].mean()
-            mean_low_2 = match_diff_2[idx_low_2].mean()
-            mean_high_2 = match_diff_2[idx_high_2].mean()
-            std_low_1 = match_diff_1[idx_low_1].std()
-            std_high_1 = match_diff_1[idx_high_1].std()
-            std_low_2 = match_diff_2[idx_low_2].std()
-            std_high_2 = match_diff_2[idx_high_2].std()
-            weight_low_1 = np.sum(idx_low_1) / len(idx_low_1)
-            weight_high_1 = 1.0 - weight_low_1
-            weight_low_2 = np.sum(idx_low_2) / len(idx_low_2)
-            weight_high_2 = 1.0 - weight_low_2
-            std = max(std_low_1, std_high_1, std_low_2, std_high_2)
-            x_min = min(mean_low_1, mean_low_2) - 5 * std
-            x_max = max(mean_high_1, mean_high_2) + 5 * std
-            nr_bins = int(round(np.sqrt(match_diff.shape[0])))
-            H_1, xedges = np.histogram(
-                match_diff_1, bins=nr_bins, range=(x_min, x_max), density=True
-            )
-            H_2, xedges = np.histogram(
-                match_diff_2, bins=nr_bins, range=(x_min, x_max), density=True
-            )
+            # prepared in |g/e>, first readout (before reset) and second readout (after reset)
+            init_1 = moments[2 * idx_excited]
+            init_2 = moments[2 * idx_excited + 1]
+            std = max(init_1[1], init_1[4], init_2[1], init_2[4])
+            x_min = min(init_1[0], init_2[0]) - 5 * std
+            x_max = max(init_1[3], init_2[3]) + 5 * std
+            H, xedges = hist.histogram(x_min, x_max, nr_bins)
+            H_1 = H[2 * idx_excited]
+            H_2 = H[2 * idx_excited + 1]
             xdata = 0.5 * (xedges[1:] + xedges[:-1])
             dx = xdata[1] - xdata[0]
-            ntot = match_diff.shape[0]
             min_dens = 1.0 / ntot / dx
 
-            init_1 = np.array(
-                [mean_low_1, std_low_1, weight_low_1, mean_high_1, std_high_1, weight_high_1]
-            )
-            init_2 = np.array(
-                [mean_low_2, std_low_2, weight_low_2, mean_high_2, std_high_2, weight_high_2]
-            )
             if fix_sum:
-                # skip second weight
-                popt_1, _ = curve_fit(double_gaussian_fixed, xdata, H_1, p0=init_1[:-1])
-
-                def double_gaussian_fixed_no_ms(x, w0):
-                    w1 = 1.0 - w0
-                    return double_gaussian(x, popt_1[0], popt_1[1], w0, popt_1[3], popt_1[4], w1)
-
-                # popt_2, pcov_2 = curve_fit(double_gaussian_fixed, xdata, H_2, p0=init_2[:-1])
-                _popt_2, _ = curve_fit(double_gaussian_fixed_no_ms, xdata, H_2, p0=init_2[2])
-                # add back second weight for ease of use
-                popt_1 = np.r_[popt_1, 1.0 - popt_1[2]]
-                # popt_2 = np.r_[popt_2, 1.0 - popt_2[2]]
-                popt_2 = popt_1.copy()
-                popt_2[2] = _popt_2[0]
-                popt_2[5] = 1 - _popt_2[0]
+                # expectation maximization on the fine bins of the histogram, exact up to the
+                # bin width and independent of the nr_bins used for plotting
+                popt_1 = fit_double_gaussian(hist, 2 * idx_excited, init_1)
+                # same Gaussians after reset, only the populations change
+                popt_2 = fit_double_gaussian(hist, 2 * idx_excited + 1, init_2, popt_1)
             else:
+                # free weights, not constrained to sum to one: least squares on the histogram
                 popt_1, _ = curve_fit(double_gaussian, xdata, H_1, p0=init_1)
                 popt_2, _ = curve_fit(double_gaussian, xdata, H_2, p0=init_2)
 
@@ -490,9 +472,10 @@ class ReadoutReset(Base):
             print(f"  T_e: {1e3 * Teff_2:.1f}mK")
 
             # *** Readout fidelity ***
-            err_eg = error(popt_1[0], popt_1[1])  # measure |e> but it was |g>
-            err_ge = error(popt_1[3], popt_1[4])  # measure |g> but it was |e>
-            fidelity = 1.0 - 0.5 * (err_eg + err_ge)
+            # err_eg: measure |e> but it was |g>, err_ge: measure |g> but it was |e>
+            fidelity, err_eg, err_ge = readout_fidelity(
+                popt_1[[0, 3]], popt_1[[1, 4]] ** 2, threshold=0.0
+            )
             print(f"{err_eg = }")
             print(f"{err_ge = }")
             print(f"{fidelity = }")
@@ -615,6 +598,27 @@ def double_gaussian_fixed(x, m0, s0, w0, m1, s1):
     return double_gaussian(x, m0, s0, w0, m1, s1, w1)
 
 
+def fit_double_gaussian(hist: StreamingHistogram, stream: int, init, popt_fixed=None):
+    """Fit `double_gaussian` to one stream of `hist` by expectation maximization.
+
+    If `popt_fixed` is given, keep its means and standard deviations and only fit the weights.
+    Returns the parameters of `double_gaussian`.
+    """
+    counts = hist.counts[stream]
+    nonzero = counts > 0
+    p0 = init if popt_fixed is None else popt_fixed
+    means, covs, weights = fit_mixture(
+        hist.centers[nonzero],
+        p0[[0, 3]],
+        p0[[1, 4]] ** 2,
+        init[[2, 5]],
+        counts=counts[nonzero],
+        fit_components=popt_fixed is None,
+    )
+    std = np.sqrt(covs[:, 0, 0])
+    return np.array([means[0, 0], std[0], weights[0], means[1, 0], std[1], weights[1]])
+
+
 def transparent(rgb, alpha):
     r = (rgb >> 16) & 0xFF
     g = (rgb >> 8) & 0xFF
@@ -628,22 +632,6 @@ def transparent(rgb, alpha):
     return new_rgb
 
 
-def error(m, s):
-    from scipy.special import erf
-
-    x = abs(m) / (np.sqrt(2) * s)
-    # if m < 0.0:
-    #     return 0.5 * (1 + erf(x))
-    # else:
-    return 0.5 * (1 - erf(x))
-
-
-def t_eff(p, fq):
-    from scipy.constants import Boltzmann, Planck
-
-    return Planck * fq / (Boltzmann * np.log(1 / p - 1))
-
-
 def hist_plot(ax, spec, bin_ar, **kwargs):
     x_quad = np.zeros((len(bin_ar) - 1) * 4)  # length 4*N
     # bin_ar[0:-1] takes all but the rightmost element of bin_ar -> length N
@@ -3,16 +3,22 @@
 Perform single-shot readout with template matching and build IQ cloud.
 """
 
-from typing import Optional
+from typing import Any, Dict, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import rotate_opt, sin2
+from presto.pulsed import MAX_TEMPLATE_LEN
+from presto.utils import sin2
 
-from _base import Base
+import _calibration
+from _base import Base, _read_dataset, project
+from _matched_filter import CHUNK_SIZE, design_templates, noise_autocorrelation
+from _mixture import fit_mixture, readout_fidelity, t_eff
+from _rotate import rotate_opt
+
+RAW_CHUNK_SIZE = 1000  # shots per run with raw_traces, to bound the memory on the board
 
 
 class SingleShotReadout(Base):
@@ -35,6 +41,9 @@ class SingleShotReadout(Base):
         template_match_duration: Optional[float] = None,
         template_match_phase: float = 0.0,
         drag: float = 0.0,
+        template: Optional[npt.NDArray[np.complex128]] = None,
+        raw_traces: bool = False,
+        raw_chunk_size: int = RAW_CHUNK_SIZE,
     ) -> None:
         self.readout_freq = readout_freq
         self.control_freq = control_freq
@@ -50,16 +59,27 @@ class SingleShotReadout(Base):
         self.readout_sample_delay = readout_sample_delay
         self.num_averages = num_averages
         self.template_match_start = template_match_start
-        if template_match_duration is None:
-            self.template_match_duration = sample_duration
-        else:
-            self.template_match_duration = template_match_duration
+        if template_match_duration is None and template is None:
+            template_match_duration = sample_duration
+        # from the length of template if None, see run
+        self.template_match_duration = template_match_duration
         self.template_match_phase = template_match_phase
         self.drag = drag
+        # shape of the template, e.g. the matched filter `ref_e - ref_g` from ReadoutRef.analyze
+        # with single_shots; flat over template_match_duration if None
+        self.template = None if template is None else np.asarray(template, np.complex128)
+        if self.template is not None and len(self.template) > MAX_TEMPLATE_LEN // 2:  # I and Q
+            raise ValueError(
+                f"maximum template length is {MAX_TEMPLATE_LEN // 2}, got {len(self.template)}"
+            )
+        # also keep the trace of each shot, acquired raw_chunk_size shots at a time
+        self.raw_traces = raw_traces
+        self.raw_chunk_size = raw_chunk_size
 
         self.t_arr = None  # replaced by run
         self.store_arr = None  # replaced by run
         self.match_arr = None  # replaced by run
+        self.trace_arr = None  # replaced by run if raw_traces
 
     def run(
         self,
@@ -123,7 +143,20 @@ class SingleShotReadout(Base):
             pls.setup_store(self.sample_port, self.sample_duration)
 
             # Setup template matching
-            shape = np.ones(int(round(self.template_match_duration * pls.get_fs("dac"))))
+            if self.template is None:
+                assert self.template_match_duration is not None
+                shape = np.ones(int(round(self.template_match_duration * pls.get_fs("dac"))))
+            else:
+                shape = self.template
+                # analyze takes the window from template_match_duration
+                fs = pls.get_fs("dac")
+                if self.template_match_duration is None:
+                    self.template_match_duration = len(shape) / fs
+                elif abs(self.template_match_duration * fs - len(shape)) > 0.5:
+                    raise ValueError(
+                        f"template has {len(shape)} samples, but template_match_duration is "
+                        f"{1e9 * self.template_match_duration:.0f} ns: leave it to None"
+                    )
             match_events = pls.setup_template_matching_pair(
                 input_port=self.sample_port,
                 template1=shape * np.exp(self.template_match_phase),
@@ -148,67 +181,45 @@ class SingleShotReadout(Base):
             # *** Run the experiment ***
             # **************************
 
+            if self.raw_traces:
+                return self._run_raw(pls, T, match_events)
             pls.run(period=T, repeat_count=1, num_averages=self.num_averages)
             self.t_arr, self.store_arr = pls.get_store_data()
             self.match_arr = pls.get_template_matching_data(match_events)
 
         return self.save()
 
+    def _run_raw(self, pls: pulsed.Pulsed, T: float, match_events) -> str:
+        # one shot per repetition, so that the store data are the single-shot traces; the save
+        # file is created first and the traces are written to it directly, one chunk at a time
+        self._stream_open(__file__, {})
+        trace_arr = None
+        store_sum = 0.0
+        match_list = []
+        for start in range(0, self.num_averages, self.raw_chunk_size):
+            nr_shots = min(self.raw_chunk_size, self.num_averages - start)
+            pls.run(period=T, repeat_count=nr_shots, num_averages=1)
+            self.t_arr, data = pls.get_store_data()
+            if trace_arr is None:
+                shape = (self.num_averages, 2, len(self.t_arr))
+                trace_arr = self._stream_map("trace_arr", shape, np.complex64)
+            # (shot, state, sample) from (shot * state, port, sample)
+            trace_arr[start : start + nr_shots] = data.reshape(nr_shots, 2, -1)
+            store_sum += data.reshape(nr_shots, 2, 1, -1).sum(axis=0)
+            match_list.append(pls.get_template_matching_data(match_events))
+        assert trace_arr is not None
+        trace_arr.flush()
+        del trace_arr
+
+        self.store_arr = store_sum / self.num_averages
+        self.match_arr = np.concatenate(match_list, axis=-1)
+        save_path = self._stream_close()
+        self.trace_arr = _read_dataset(save_path, "trace_arr")  # mapped, not in memory
+        return save_path
+
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "SingleShotReadout":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            template_match_start = float(h5f.attrs["template_match_start"])  # type: ignore
-            template_match_duration = float(h5f.attrs["template_match_duration"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-            match_arr: npt.NDArray[np.float64] = h5f["match_arr"][()]  # type: ignore
-
-            try:
-                drag = float(h5f.attrs["drag"])  # type: ignore
-            except KeyError:
-                drag = 0.0
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            template_match_start=template_match_start,
-            template_match_duration=template_match_duration,
-            num_averages=num_averages,
-            drag=drag,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-        self.match_arr = match_arr
-
-        return self
-
     def analyze(self, rotate_optimally: bool = True, all_plots: bool = False):
         if self.t_arr is None:
             raise RuntimeError
@@ -216,6 +227,8 @@ class SingleShotReadout(Base):
             raise RuntimeError
         if self.match_arr is None:
             raise RuntimeError
+        if self.template_match_duration is None:
+            raise RuntimeError
         import matplotlib.pyplot as plt
 
         ret_fig = []
@@ -242,12 +255,20 @@ class SingleShotReadout(Base):
         ax1 = fig2.add_subplot(1, 1, 1)
 
         complex_match_data = self.match_arr[0] + 1j * self.match_arr[1]
-        avg_data = np.array(
-            [
-                np.sum(self.store_arr[0, 0, IDX_LOW:IDX_HIGH]),
-                np.sum(self.store_arr[1, 0, IDX_LOW:IDX_HIGH]),
-            ]
-        )
+        # the averaged traces weighted as by the template matching, so that they rotate like the
+        # single shots
+        avg_traces = self.store_arr[:2, 0, IDX_LOW:IDX_HIGH]
+        if self.template is None:
+            weights = np.ones(avg_traces.shape[-1])
+        else:
+            # the template, at the DAC sample rate, on the time axis of the store
+            t_template = np.arange(len(self.template)) / len(self.template)
+            t_store = (self.t_arr[IDX_LOW:IDX_HIGH] - t_low) / self.template_match_duration
+            weights = np.interp(t_store, t_template, self.template.real) + 1j * np.interp(
+                t_store, t_template, self.template.imag
+            )
+        weights = weights * np.exp(self.template_match_phase)
+        avg_data = np.sum(np.conj(weights) * avg_traces, axis=-1)
         if rotate_optimally:
             avg_data, angle = rotate_opt(avg_data, True)
         else:
@@ -258,6 +279,23 @@ class SingleShotReadout(Base):
         ground_avg_data = avg_data[0]
         excited_avg_data = avg_data[1]
 
+        # Gaussian mixture in the IQ plane: the two states from all shots, then the populations
+        # of the shots prepared in |g> and in |e>
+        means, covs, _ = fit_mixture(
+            np.r_[ground_data, excited_data],
+            [np.mean(ground_data), np.mean(excited_data)],
+            shared_cov=True,
+        )
+        _, _, weights_g = fit_mixture(ground_data, means, covs, fit_components=False)
+        _, _, weights_e = fit_mixture(excited_data, means, covs, fit_components=False)
+        fidelity, err_eg, err_ge = readout_fidelity(means, covs)
+        print(f"{err_eg = }")
+        print(f"{err_ge = }")
+        print(f"{fidelity = }")
+        print(f"Prepared in |g>: {weights_g[1]:5.1%} in |e>")
+        print(f"  T_e: {1e3 * t_eff(weights_g[1], self.control_freq):.1f}mK")
+        print(f"Prepared in |e>: {weights_e[1]:5.1%} in |e>")
+
         ax1.plot(ground_data.real, ground_data.imag, ".", alpha=0.2, label="ground")
         ax1.plot(excited_data.real, excited_data.imag, ".", alpha=0.2, label="excited")
         ax1.plot(
@@ -266,6 +304,7 @@ class SingleShotReadout(Base):
         ax1.plot(
             excited_avg_data.real, excited_avg_data.imag, "C1o", alpha=1, markeredgecolor="white"
         )
+        ax1.plot(means[:, 0], means[:, 1], "kx")
         ax1.legend()
         ax1.set_aspect("equal", adjustable="box")
         ax1.set_xlabel("In phase [FS]")
@@ -273,3 +312,70 @@ class SingleShotReadout(Base):
         ret_fig.append(fig2)
 
         return ret_fig
+
+    def analyze_traces(
+        self,
+        reference_templates: Union[None, tuple, str] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> Dict[str, Any]:
+        """Template matching in post-processing, on the single-shot traces from `raw_traces`.
+
+        The traces are processed `chunk_size` shots at a time, so after `load(..., lazy=True)`
+        they are read from the memory-mapped save file and never all in memory.
+
+        Args:
+            reference_templates: templates `(ref_g, ref_e)` applied from `template_match_start`,
+                or the key of a calibration, see `project`. If `None`, the matched filter for the
+                noise of the traces, with the length of `template_match_duration`, see
+                `_matched_filter`.
+            chunk_size: number of shots to process at once
+
+        Returns:
+            dictionary with the templates and their window `match_idx` and `match_len`, the
+            projected shots `proj_g` and `proj_e` (|g> at 0.0 and |e> at 1.0), and the fidelity
+            and errors of a Gaussian-mixture fit to them
+        """
+        if self.t_arr is None:
+            raise RuntimeError
+        if self.trace_arr is None:
+            raise RuntimeError("no single-shot traces: run with raw_traces=True")
+        if self.template_match_duration is None:
+            raise RuntimeError
+
+        fs = 1 / (self.t_arr[1] - self.t_arr[0])
+        traces_g = self.trace_arr[:, 0, :]
+        traces_e = self.trace_arr[:, 1, :]
+        if reference_templates is None:
+            match_len = int(round(self.template_match_duration * fs))
+            mean_g, mean_e, acf = noise_autocorrelation(traces_g, traces_e, match_len, chunk_size)
+            mf = design_templates(mean_g, mean_e, acf, match_len)
+            match_idx = mf["match_idx"]
+            reference_templates = (mf["ref_g"], mf["ref_e"])
+            print(f"Matched filter: SNR {mf['snr']:.1f}")
+        else:
+            match_idx = int(round(self.template_match_start * fs))
+        if isinstance(reference_templates, str):
+            key = reference_templates
+            reference_templates = _calibration.get_store().templates(key)
+        ref_g, ref_e = reference_templates
+        match_len = len(ref_g)
+        window = slice(match_idx, match_idx + match_len)
+
+        proj_g = project(traces_g[:, window], (ref_g, ref_e), True, chunk_size)
+        proj_e = project(traces_e[:, window], (ref_g, ref_e), True, chunk_size)
+        means, covs, _ = fit_mixture(np.r_[proj_g, proj_e], [0.0, 1.0])
+        fidelity, err_eg, err_ge = readout_fidelity(means, covs)
+        print(f"{err_eg = }")
+        print(f"{err_ge = }")
+        print(f"{fidelity = }")
+        return {
+            "ref_g": ref_g,
+            "ref_e": ref_e,
+            "match_idx": match_idx,
+            "match_len": match_len,
+            "proj_g": proj_g,
+            "proj_e": proj_e,
+            "fidelity": fidelity,
+            "err_eg": err_eg,
+            "err_ge": err_ge,
+        }
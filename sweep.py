@@ -5,14 +5,21 @@ Simple frequency sweep using the Lockin mode.
 
 from typing import Optional
 
-import h5py
 import numpy as np
-import numpy.typing as npt
 
 from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import (
+    add_tone_groups,
+    check_num_skip,
+    coarse_idx,
+    refine_idx,
+    sweep_freq,
+    sweep_freq_multi,
+    tone_plan,
+)
 
 
 class Sweep(Base):
@@ -27,7 +34,9 @@ class Sweep(Base):
         input_port: int,
         dither: bool = True,
         num_skip: int = 0,
-        electrical_delay = 0
+        electrical_delay = 0,
+        nr_tones: int = 1,
+        coarse_step: int = 1,
     ) -> None:
         self.freq_center = freq_center
         self.freq_span = freq_span
@@ -37,8 +46,13 @@ class Sweep(Base):
         self.output_port = output_port
         self.input_port = input_port
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
         self.electrical_delay = electrical_delay
+        self.nr_tones = nr_tones  # measure up to this many frequencies at once, see tone_plan
+        # if > 1, sweep every coarse_step-th frequency, then the full grid around features
+        self.coarse_step = coarse_step
+        if nr_tones > 1 and coarse_step > 1:
+            raise ValueError("nr_tones needs a uniform sweep, with coarse_step = 1")
         self.freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
 
@@ -77,36 +91,82 @@ class Sweep(Base):
             )
 
             lck.set_df(self.df)
-            og = lck.add_output_group(self.output_port, 1)
-            og.set_frequencies(0.0)
-            og.set_amplitudes(self.amp)
-            og.set_phases(0.0, 0.0)
+            if self.nr_tones > 1:
+                if_idx, nco_idx = tone_plan(nr_freq, self.nr_tones)
+                og, ig = add_tone_groups(
+                    lck, self.input_port, self.output_port, self.amp, self.df * if_idx
+                )
+            else:
+                og = lck.add_output_group(self.output_port, 1)
+                og.set_frequencies(0.0)
+                og.set_amplitudes(self.amp)
+                og.set_phases(0.0, 0.0)
 
-            lck.set_dither(self.dither, self.output_port)
+                ig = lck.add_input_group(self.input_port, 1)
+                ig.set_frequencies(0.0)
 
-            ig = lck.add_input_group(self.input_port, 1)
-            ig.set_frequencies(0.0)
+            lck.set_dither(self.dither, self.output_port)
 
             lck.apply_settings()
 
-            pb = ProgressBar(nr_freq)
-            pb.start()
-            for ii in range(len(n_arr)):
-                f = self.freq_arr[ii]
-                lck.hardware.configure_mixer(
-                    freq=f, in_ports=self.input_port, out_ports=self.output_port
+            if self.nr_tones > 1:
+                pb = ProgressBar(len(nco_idx))
+                pb.start()
+                self.resp_arr[:] = sweep_freq_multi(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr,
+                    self.num_averages,
+                    if_idx,
+                    nco_idx,
+                    status_callback=pb.increment,
+                )
+            elif self.coarse_step > 1:
+                idx = coarse_idx(nr_freq, self.coarse_step)
+                pb = ProgressBar(len(idx))
+                pb.start()
+                resp = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr[idx],
+                    self.num_averages,
+                    status_callback=pb.increment,
+                )
+                pb.done()
+
+                fine_idx = refine_idx(idx, resp)
+                pb = ProgressBar(len(fine_idx))
+                pb.start()
+                if len(fine_idx) > 0:
+                    fine_resp = sweep_freq(
+                        lck,
+                        self.input_port,
+                        self.output_port,
+                        self.freq_arr[fine_idx],
+                        self.num_averages,
+                        status_callback=pb.increment,
+                    )
+                    idx = np.r_[idx, fine_idx]
+                    resp = np.r_[resp, fine_resp]
+
+                # non-uniform, but in the same format as a uniform sweep
+                order = np.argsort(idx)
+                self.freq_arr = self.freq_arr[idx[order]]
+                self.resp_arr = resp[order]
+                print(f"measured {len(idx)} of {nr_freq} frequencies")
+            else:
+                pb = ProgressBar(nr_freq)
+                pb.start()
+                self.resp_arr[:] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr,
+                    self.num_averages,
+                    status_callback=pb.increment,
                 )
-                lck.apply_settings()
-
-                _d = lck.get_pixels(self.num_skip + self.num_averages, quiet=True)
-                data_i = _d[self.input_port][1][:, 0]
-                data_q = _d[self.input_port][2][:, 0]
-                data = data_i.real + 1j * data_q.real  # using zero IF
-
-                self.resp_arr[ii] = np.mean(data[-self.num_averages :])
-
-                pb.increment()
-
             pb.done()
 
             # Mute outputs at the end of the sweep
@@ -118,38 +178,6 @@ class Sweep(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "Sweep":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            amp = float(h5f.attrs["amp"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp=amp,
-            output_port=output_port,
-            input_port=input_port,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.freq_arr = freq_arr
-        self.resp_arr = resp_arr
-
-        return self
-
     def analyze(self):
         if self.freq_arr is None:
             raise RuntimeError
@@ -5,7 +5,6 @@
 
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -13,9 +12,19 @@ from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, scan_order, sweep_freq
 
 
 class SweepFreqAndDC(Base):
+    """Frequency sweep at each DC bias of `bias_arr`, ramped at `bias_ramp_rate`.
+
+    Ramping the bias is the slow part. By default the biases are visited sorted, starting from the
+    end of `bias_arr` closest to the bias already on `bias_port`, so the bias never ramps back
+    across the range. With `reorder=False`, they are visited in the order of `bias_arr`, e.g. to
+    follow a hysteresis loop. Either way, consecutive frequency sweeps alternate direction and
+    `resp_arr` is stored in the order of `bias_arr`.
+    """
+
     def __init__(
         self,
         freq_center: float,
@@ -30,6 +39,7 @@ class SweepFreqAndDC(Base):
         bias_ramp_rate: float = 0.01,
         dither: bool = True,
         num_skip: int = 0,
+        reorder: bool = True,
     ) -> None:
         self.freq_center = freq_center
         self.freq_span = freq_span
@@ -42,7 +52,8 @@ class SweepFreqAndDC(Base):
         self.input_port = input_port
         self.bias_port = bias_port
         self.dither = dither
-        self.num_skip = num_skip
+        self.reorder = reorder
+        check_num_skip(num_skip)  # deprecated, not used
 
         self.freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
@@ -98,8 +109,15 @@ class SweepFreqAndDC(Base):
                 if new_range != active_range:
                     lck.hardware.set_dc_bias(active_bias, self.bias_port, new_range)
                     lck.hardware.sleep(1.0, False)
-            if active_bias != self.bias_arr[0]:
-                lck.hardware.ramp_dc_bias(self.bias_arr[0], self.bias_port, self.bias_ramp_rate)
+            if self.reorder:
+                # ramping is the slow part: visit the biases sorted, starting from the closest end
+                bias_order = scan_order(self.bias_arr, active_bias)
+            else:
+                bias_order = np.arange(nr_bias)
+            if active_bias != self.bias_arr[bias_order[0]]:
+                lck.hardware.ramp_dc_bias(
+                    self.bias_arr[bias_order[0]], self.bias_port, self.bias_ramp_rate
+                )
 
             lck.hardware.configure_mixer(
                 freq=self.freq_arr[0],
@@ -119,26 +137,23 @@ class SweepFreqAndDC(Base):
 
             lck.apply_settings()
 
-            pb = ProgressBar(nr_bias)
-            pb.start()
-            for jj, bias in enumerate(self.bias_arr):
-                lck.hardware.ramp_dc_bias(bias, self.bias_port, self.bias_ramp_rate)
-
-                for ii, freq in enumerate(self.freq_arr):
-                    lck.hardware.configure_mixer(
-                        freq=freq,
-                        in_ports=self.input_port,
-                        out_ports=self.output_port,
-                    )
-                    lck.apply_settings()
-
-                    _d = lck.get_pixels(self.num_skip + self.num_averages, quiet=True)
-                    data_i = _d[self.input_port][1][:, 0]
-                    data_q = _d[self.input_port][2][:, 0]
-                    data = data_i.real + 1j * data_q.real  # using zero IF
+            self._stream_open(__file__, {"resp_arr": (self.resp_arr.shape, np.complex128)})
 
-                    self.resp_arr[jj, ii] = np.mean(data[-self.num_averages :])
-                pb.increment()
+            pb = ProgressBar(nr_bias * nr_freq)
+            pb.start()
+            for kk, jj in enumerate(bias_order):
+                lck.hardware.ramp_dc_bias(self.bias_arr[jj], self.bias_port, self.bias_ramp_rate)
+
+                self.resp_arr[jj] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr,
+                    self.num_averages,
+                    status_callback=pb.increment,
+                    reverse=kk % 2 == 1,
+                )
+                self._stream_write("resp_arr", jj, self.resp_arr[jj])
 
             pb.done()
 
@@ -147,50 +162,11 @@ class SweepFreqAndDC(Base):
             lck.apply_settings()
             # lck.hardware.ramp_dc_bias(0.0, self.bias_port,self.bias_ramp_rate)
 
-        return self.save()
+        return self._stream_close()
 
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "SweepFreqAndDC":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            amp = float(h5f.attrs["amp"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            bias_port = int(h5f.attrs["bias_port"])  # type: ignore
-            bias_ramp_rate = float(h5f.attrs["bias_ramp_rate"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            bias_arr: npt.NDArray[np.float64] = h5f["bias_arr"][()]  # type: ignore
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp=amp,
-            bias_arr=bias_arr,
-            output_port=output_port,
-            input_port=input_port,
-            bias_port=bias_port,
-            bias_ramp_rate=bias_ramp_rate,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.bias_arr = bias_arr
-        self.freq_arr = freq_arr
-        self.resp_arr = resp_arr
-
-        return self
-
     def analyze(self, quantity: str):
         assert self.freq_arr is not None
         assert self.resp_arr is not None
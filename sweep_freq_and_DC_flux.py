@@ -5,7 +5,6 @@ Simple frequency sweep using the Lockin mode.
 
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -13,9 +12,16 @@ from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, sweep_freq
 
 
 class SweepFreqAndDC(Base):
+    """Frequency sweep at each DC bias of `bias_arr`, output by the lock-in on `bias_port`.
+
+    The bias changes in one step, so the biases are visited in the order of `bias_arr` and there
+    is nothing to reorder. Consecutive frequency sweeps alternate direction.
+    """
+
     def __init__(
         self,
         freq_center: float,
@@ -40,7 +46,7 @@ class SweepFreqAndDC(Base):
         self.input_port = input_port
         self.bias_port = bias_port
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
 
         self.freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
@@ -98,26 +104,26 @@ class SweepFreqAndDC(Base):
 
             lck.apply_settings()
 
-            pb = ProgressBar(nr_freq)
+            self._stream_open(__file__, {"resp_arr": (self.resp_arr.shape, np.complex128)})
+
+            pb = ProgressBar(nr_bias * nr_freq)
             pb.start()
-            for ii in range(len(n_arr)):
-                f = self.freq_arr[ii]
-                lck.hardware.configure_mixer(
-                    freq=f, in_ports=self.input_port, out_ports=self.output_port
-                )
+            # one frequency sweep per bias point: the bias changes nr_bias times instead of
+            # nr_bias * nr_freq times
+            for jj, bias in enumerate(self.bias_arr):
+                og_b.set_amplitudes(bias)
                 lck.apply_settings()
-                for jj, bias in enumerate(self.bias_arr):
-                    og_b.set_amplitudes(bias)
-                    lck.apply_settings()
-
-                    _d = lck.get_pixels(self.num_skip + self.num_averages, quiet=True)
-                    data_i = _d[self.input_port][1][:, 0]
-                    data_q = _d[self.input_port][2][:, 0]
-                    data = data_i.real + 1j * data_q.real  # using zero IF
-
-                    self.resp_arr[jj, ii] = np.mean(data[-self.num_averages :])
 
-                pb.increment()
+                self.resp_arr[jj] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr,
+                    self.num_averages,
+                    status_callback=pb.increment,
+                    reverse=jj % 2 == 1,
+                )
+                self._stream_write("resp_arr", jj, self.resp_arr[jj])
 
             pb.done()
 
@@ -126,48 +132,11 @@ class SweepFreqAndDC(Base):
             og_b.set_amplitudes(0.0)
             lck.apply_settings()
 
-        return self.save()
+        return self._stream_close()
 
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "SweepFreqAndDC":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            amp = float(h5f.attrs["amp"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            bias_port = int(h5f.attrs["bias_port"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            bias_arr: npt.NDArray[np.float64] = h5f["bias_arr"][()]  # type: ignore
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp=amp,
-            output_port=output_port,
-            input_port=input_port,
-            bias_port=bias_port,
-            dither=dither,
-            num_skip=num_skip,
-            bias_arr=bias_arr,
-        )
-
-        self.freq_arr = freq_arr
-        self.resp_arr = resp_arr
-
-        return self
-
     def analyze(self, quantity: str):
         if self.freq_arr is None:
             raise RuntimeError
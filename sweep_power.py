@@ -5,7 +5,6 @@
 
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
@@ -13,6 +12,7 @@ from presto import lockin
 from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, coarse_idx, refine_idx, sweep_freq
 
 
 class SweepPower(Base):
@@ -27,6 +27,7 @@ class SweepPower(Base):
         input_port: int,
         dither: bool = True,
         num_skip: int = 0,
+        coarse_step: int = 1,
     ) -> None:
         self.freq_center = freq_center
         self.freq_span = freq_span
@@ -36,7 +37,10 @@ class SweepPower(Base):
         self.output_port = output_port
         self.input_port = input_port
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
+        # if > 1, sweep every coarse_step-th frequency, then the full grid around features, at
+        # each amplitude. resp_arr is NaN where an amplitude was not refined.
+        self.coarse_step = coarse_step
 
         self.freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
@@ -76,80 +80,100 @@ class SweepPower(Base):
                 freq=self.freq_arr[0], in_ports=self.input_port, out_ports=self.output_port
             )
 
+            # a single tone: with simultaneous tones, the drive power would grow with their number
             og = lck.add_output_group(self.output_port, 1)
             og.set_frequencies(0.0)
             og.set_amplitudes(self.amp_arr[0])
             og.set_phases(0.0, 0.0)
 
-            lck.set_dither(self.dither, self.output_port)
             ig = lck.add_input_group(self.input_port, 1)
             ig.set_frequencies(0.0)
 
+            lck.set_dither(self.dither, self.output_port)
+
             lck.apply_settings()
 
-            pb = ProgressBar(nr_amps * nr_freq)
-            pb.start()
-            for jj, amp in enumerate(self.amp_arr):
-                og.set_amplitudes(amp)
-                lck.apply_settings()
+            self._stream_open(__file__, {"resp_arr": (self.resp_arr.shape, np.complex128)})
 
-                for ii, freq in enumerate(self.freq_arr):
-                    lck.hardware.configure_mixer(
-                        freq=freq, in_ports=self.input_port, out_ports=self.output_port
-                    )
+            if self.coarse_step > 1:
+                self._run_adaptive(lck, og)
+            else:
+                pb = ProgressBar(nr_amps * nr_freq)
+                pb.start()
+                for jj, amp in enumerate(self.amp_arr):
+                    og.set_amplitudes(amp)
                     lck.apply_settings()
 
-                    _d = lck.get_pixels(self.num_skip + self.num_averages, quiet=True)
-                    data_i = _d[self.input_port][1][:, 0]
-                    data_q = _d[self.input_port][2][:, 0]
-                    data = data_i.real + 1j * data_q.real  # using zero IF
-
-                    self.resp_arr[jj, ii] = np.mean(data[-self.num_averages :])
-
-                    pb.increment()
+                    self.resp_arr[jj] = sweep_freq(
+                        lck,
+                        self.input_port,
+                        self.output_port,
+                        self.freq_arr,
+                        self.num_averages,
+                        status_callback=pb.increment,
+                    )
+                    self._stream_write("resp_arr", jj, self.resp_arr[jj])
 
-            pb.done()
+                pb.done()
 
             # Mute outputs at the end of the sweep
             og.set_amplitudes(0.0)
             lck.apply_settings()
 
-        return self.save()
+        return self._stream_close()
 
-    def save(self, save_filename: Optional[str] = None) -> str:
-        return super()._save(__file__, save_filename=save_filename)
+    def _run_adaptive(self, lck, og) -> None:
+        """Coarse sweep at each amplitude, immediately followed by the full grid around its
+        features, so that drift doesn't show up between the coarse and the fine points.
 
-    @classmethod
-    def load(cls, load_filename: str) -> "SweepPower":
-        with h5py.File(load_filename, "r") as h5f:
-            freq_center = float(h5f.attrs["freq_center"])  # type: ignore
-            freq_span = float(h5f.attrs["freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            output_port = int(h5f.attrs["output_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            amp_arr: npt.NDArray[np.float64] = h5f["amp_arr"][()]  # type: ignore
-            freq_arr: npt.NDArray[np.float64] = h5f["freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            freq_center=freq_center,
-            freq_span=freq_span,
-            df=df,
-            num_averages=num_averages,
-            amp_arr=amp_arr,
-            output_port=output_port,
-            input_port=input_port,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.freq_arr = freq_arr
-        self.resp_arr = resp_arr
+        Only the frequencies measured at any amplitude are kept, in the same format as a uniform
+        sweep. The points of a row that were refined only at other amplitudes are not measured,
+        and are NaN in `resp_arr`.
+        """
+        nr_amps = len(self.amp_arr)
+        nr_freq = len(self.freq_arr)
+        idx = coarse_idx(nr_freq, self.coarse_step)
+        self.resp_arr[:] = np.nan
+
+        # counts grid points: the ones that are not refined are skipped once the fine points of
+        # an amplitude are known
+        pb = ProgressBar(nr_amps * nr_freq)
+        pb.start()
+        for jj, amp in enumerate(self.amp_arr):
+            og.set_amplitudes(amp)
+            lck.apply_settings()
+            self.resp_arr[jj, idx] = sweep_freq(
+                lck,
+                self.input_port,
+                self.output_port,
+                self.freq_arr[idx],
+                self.num_averages,
+                status_callback=pb.increment,
+            )
+            fine_idx = refine_idx(idx, self.resp_arr[jj, idx])
+            for _ in range(nr_freq - len(idx) - len(fine_idx)):
+                pb.increment()
+            if len(fine_idx) > 0:
+                self.resp_arr[jj, fine_idx] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.output_port,
+                    self.freq_arr[fine_idx],
+                    self.num_averages,
+                    status_callback=pb.increment,
+                )
+            self._stream_write("resp_arr", jj, self.resp_arr[jj])
+        pb.done()
+
+        keep = np.any(np.isfinite(self.resp_arr), axis=0)
+        print(f"measured {np.sum(np.isfinite(self.resp_arr))} of {nr_amps * nr_freq} points")
+        self.freq_arr = self.freq_arr[keep]
+        self.resp_arr = self.resp_arr[:, keep]
+        # saved again in the compact format by _stream_close
+        self._stream_datasets.remove("resp_arr")
 
-        return self
+    def save(self, save_filename: Optional[str] = None) -> str:
+        return super()._save(__file__, save_filename=save_filename)
 
     def analyze(self, norm: bool = True, portrait: bool = True, blit: bool = False):
         if self.freq_arr is None:
@@ -180,18 +204,10 @@ class SweepPower(Base):
         resp_dB = 20.0 * np.log10(np.abs(resp_scaled))
         amp_dBFS = 20 * np.log10(self.amp_arr / 1.0)
 
-        # choose limits for colorbar
+        # choose limits for colorbar, NaN where an adaptive sweep didn't measure
         cutoff = 1.0  # %
-        lowlim = np.percentile(resp_dB, cutoff)
-        highlim = np.percentile(resp_dB, 100.0 - cutoff)
-
-        # extent
-        x_min = 1e-9 * self.freq_arr[0]
-        x_max = 1e-9 * self.freq_arr[-1]
-        dx = 1e-9 * (self.freq_arr[1] - self.freq_arr[0])
-        y_min = amp_dBFS[0]
-        y_max = amp_dBFS[-1]
-        dy = amp_dBFS[1] - amp_dBFS[0]
+        lowlim = np.nanpercentile(resp_dB, cutoff)
+        highlim = np.nanpercentile(resp_dB, 100.0 - cutoff)
 
         if portrait:
             fig1 = plt.figure(tight_layout=True, figsize=(6.4, 9.6))
@@ -199,12 +215,12 @@ class SweepPower(Base):
         else:
             fig1 = plt.figure(tight_layout=True, figsize=(12.8, 4.8))
             ax1 = fig1.add_subplot(1, 2, 1)
-        im = ax1.imshow(
+        # pcolormesh rather than imshow: freq_arr is not uniform after an adaptive sweep, and the
+        # points that were not measured are left blank
+        im = ax1.pcolormesh(
+            1e-9 * _edges(self.freq_arr),
+            _edges(amp_dBFS),
             resp_dB,
-            origin="lower",
-            aspect="auto",
-            interpolation="none",
-            extent=(x_min - dx / 2, x_max + dx / 2, y_min - dy / 2, y_max + dy / 2),
             vmin=lowlim,  # type: ignore
             vmax=highlim,  # type: ignore
         )
@@ -252,8 +268,8 @@ class SweepPower(Base):
         f_min = 1e-9 * self.freq_arr.min()
         f_max = 1e-9 * self.freq_arr.max()
         f_rng = f_max - f_min
-        a_min = resp_dB.min()
-        a_max = resp_dB.max()
+        a_min = np.nanmin(resp_dB)
+        a_max = np.nanmax(resp_dB)
         a_rng = a_max - a_min
         p_min = -np.pi
         p_max = np.pi
@@ -315,7 +331,8 @@ class SweepPower(Base):
 
             def onselect(xmin, xmax):
                 assert self.resp_arr is not None
-                port = circuit.notch_port(self.freq_arr, self.resp_arr[self._AMP_IDX])  # pyright: ignore [reportPossiblyUnboundVariable]
+                ok = np.isfinite(self.resp_arr[self._AMP_IDX])
+                port = circuit.notch_port(self.freq_arr[ok], self.resp_arr[self._AMP_IDX, ok])  # pyright: ignore [reportPossiblyUnboundVariable]
                 port.autofit(fcrop=(xmin * 1e9, xmax * 1e9))
                 if norm:
                     line_fit_a.set_data(  # pyright: ignore [reportPossiblyUnboundVariable]
@@ -368,3 +385,12 @@ class SweepPower(Base):
             fig1.canvas.blit(fig1.bbox)
 
         return fig1
+
+
+def _edges(centers):
+    # edges of the cells around each of the sorted centers, halfway to the neighbors
+    centers = np.asarray(centers, dtype=np.float64)
+    if len(centers) == 1:
+        return np.r_[centers - 0.5, centers + 0.5]
+    middle = 0.5 * (centers[1:] + centers[:-1])
+    return np.r_[2 * centers[0] - middle[0], middle, 2 * centers[-1] - middle[-1]]
@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 """Measure the energy-relaxation time T1."""
 
-import ast
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import format_precision, rotate_opt, sin2
+from presto.utils import format_precision, sin2
 
 from _base import Base, project
+from _fit import fit_decay
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -151,54 +151,7 @@ class T1(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "T1":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            delay_arr: npt.NDArray[np.float64] = h5f["delay_arr"][()]  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            drag = float(h5f.attrs["drag"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            delay_arr=delay_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-            drag=drag,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
-    def analyze_batch(self, reference_templates: Optional[tuple] = None):
+    def analyze_batch(self, reference_templates: Union[None, tuple, str] = None):
         assert self.t_arr is not None
         assert self.store_arr is not None
 
@@ -210,7 +163,7 @@ class T1(Base):
             data = project(resp_arr, reference_templates)
 
         try:
-            popt, perr = _fit_simple(self.delay_arr, data)
+            popt, perr = fit_decay(self.delay_arr, data)
         except Exception as err:
             print(f"unable to fit T1: {err}")
             popt, perr = None, None
@@ -244,7 +197,7 @@ class T1(Base):
         resp_arr = rotate_opt(resp_arr)
 
         # Fit data
-        popt, perr = _fit_simple(self.delay_arr, np.real(resp_arr))
+        popt, perr = fit_decay(self.delay_arr, np.real(resp_arr))
 
         T1 = popt[0]
         T1_err = perr[0]
@@ -297,14 +250,3 @@ class T1(Base):
 def _decay(t, *p):
     T1, xe, xg = p
     return xg + (xe - xg) * np.exp(-t / T1)
-
-
-def _fit_simple(t, x):
-    from scipy.optimize import curve_fit
-
-    T1 = 0.5 * (t[-1] - t[0])
-    xe, xg = x[0], x[-1]
-    p0 = (T1, xe, xg)
-    popt, pcov = curve_fit(_decay, t, x, p0)
-    perr = np.sqrt(np.diag(pcov))
-    return popt, perr
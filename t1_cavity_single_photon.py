@@ -8,9 +8,10 @@ import numpy as np
 import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import format_precision, rotate_opt, sin2
+from presto.utils import format_precision, sin2
 
 from _base import Base, project
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -169,55 +170,7 @@ class T1_cavity(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "T1_cavity":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq = float(h5f.attrs["control_freq"])  # type: ignore
-            cavity_freq = float(h5f.attrs["cavity_freq"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            control_amp = float(h5f.attrs["control_amp"])  # type: ignore
-            opt_control = str(h5f.attrs["opt_control"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            control_duration = float(h5f.attrs["control_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            delay_arr: npt.NDArray[np.float64] = h5f["delay_arr"][()]  # type:ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            cavity_port = int(h5f.attrs["cavity_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type:ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type:ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq=control_freq,
-            cavity_freq=cavity_freq,
-            readout_amp=readout_amp,
-            control_amp=control_amp,
-            opt_control=opt_control,
-            readout_duration=readout_duration,
-            control_duration=control_duration,
-            sample_duration=sample_duration,
-            delay_arr=delay_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            cavity_port=cavity_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-
-        return self
-
-    def analyze_batch(self, reference_templates: Optional[tuple] = None):
+    def analyze_batch(self, reference_templates: Union[None, tuple, str] = None):
         assert self.t_arr is not None
         assert self.store_arr is not None
 
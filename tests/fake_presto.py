@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for the parts of `presto` used by the measurements, to test them without an instrument.
+
+`FakePulsed` records the events of each run. Like an instrument that doesn't clear its program on
+its own, events accumulate across runs in the same session until `reset` is called. The templates
+set up are kept across `reset`.
+
+`FakeLockin` measures a device with a known frequency response, through a model of the mixers.
+"""
+
+import enum
+import importlib.util
+import sys
+import types
+from typing import Any, Callable, Dict, List, Tuple
+from unittest import mock
+
+import numpy as np
+
+
+class FakePulsed:
+    """Recording stand-in for `presto.pulsed.Pulsed`.
+
+    Each stored trace is filled with a signature of the control pulses output since the previous
+    store: their number in the real part and the sum of their template indices in the imaginary
+    part. `runs` keeps the events of each run, as `(time, kind, value)`.
+    """
+
+    FS = 1e9
+
+    def __init__(self, **kwargs) -> None:
+        self.hardware = mock.MagicMock()
+        self.runs: List[List[Tuple[float, str, Any]]] = []
+        self.nr_resets = 0
+        self._events: List[Tuple[float, str, Any]] = []
+        self._templates: List[int] = []
+        self._store_samples = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def reset(self) -> None:
+        self.nr_resets += 1
+        self._events = []
+
+    def get_fs(self, which: str) -> float:
+        return self.FS
+
+    def setup_long_drive(self, *args, **kwargs):
+        return "readout"
+
+    def setup_template(self, *args, **kwargs) -> int:
+        self._templates.append(len(self._templates))
+        return self._templates[-1]
+
+    def setup_store(self, port: int, duration: float) -> None:
+        self._store_samples = int(round(duration * self.FS))
+
+    def setup_scale_lut(self, *args, **kwargs) -> None:
+        pass
+
+    def output_pulse(self, T: float, pulse) -> None:
+        if isinstance(pulse, int) and pulse not in self._templates:
+            raise RuntimeError(f"template {pulse} is not set up")
+        self._events.append((T, "pulse", pulse))
+
+    def store(self, T: float) -> None:
+        self._events.append((T, "store", None))
+
+    def run(self, period: float, repeat_count: int, num_averages: int) -> None:
+        self.runs.append(sorted(self._events, key=lambda event: event[0]))
+
+    def get_store_data(self) -> Tuple[np.ndarray, np.ndarray]:
+        signatures = []
+        count = 0
+        total = 0
+        for _T, kind, value in self.runs[-1]:
+            if kind == "store":
+                signatures.append(count + 1j * total)
+                count = 0
+                total = 0
+            elif value != "readout":
+                count += 1
+                total += value
+        t_arr = np.arange(self._store_samples) / self.FS
+        data = np.repeat(np.array(signatures)[:, None, None], self._store_samples, axis=-1)
+        return t_arr, data
+
+
+class _Group:
+    def __init__(self, nr_freq: int) -> None:
+        self.freqs = np.zeros(nr_freq)
+        self.amps = np.zeros(nr_freq)
+        self.phases_i = np.zeros(nr_freq)
+        self.phases_q = np.zeros(nr_freq)
+
+    def set_frequencies(self, freqs) -> None:
+        self.freqs = np.broadcast_to(np.asarray(freqs, np.float64), self.freqs.shape).copy()
+
+    def set_amplitudes(self, amps) -> None:
+        self.amps = np.broadcast_to(np.asarray(amps, np.float64), self.amps.shape).copy()
+
+    def set_phases(self, phases, phases_q) -> None:
+        self.phases_i = np.broadcast_to(np.asarray(phases, np.float64), self.amps.shape).copy()
+        self.phases_q = np.broadcast_to(np.asarray(phases_q, np.float64), self.amps.shape).copy()
+
+
+class FakeLockin:
+    """Stand-in for `presto.lockin.Lockin`, measuring a device with complex response `response`.
+
+    A tone at IF `f` outputs `amp * cos(2 pi f t + phase)` on I and Q, and the mixer outputs
+    `Re[(I + iQ) exp(i w_nco t)]`: `phase_q = phase_i - pi/2` is the upper sideband. The input is
+    mixed down to `I + iQ = 2 s(t) exp(-i w_nco t)`, low-passed. Each input frequency reads
+    `a * exp(i phi)` for `a * cos(2 pi f t + phi)` on I or Q, the same convention as the output,
+    and the mean at 0 Hz.
+    """
+
+    def __init__(self, response: Callable = lambda f: np.ones_like(f), **kwargs) -> None:
+        self.hardware = mock.MagicMock()
+        self.response = response
+        self.outputs: Dict[int, List[_Group]] = {}
+        self.inputs: Dict[int, List[_Group]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def tune(self, f: float, df: float) -> Tuple[float, float]:
+        return f, df
+
+    def set_df(self, df: float) -> None:
+        pass
+
+    def set_dither(self, *args) -> None:
+        pass
+
+    def apply_settings(self) -> None:
+        pass
+
+    def add_output_group(self, port: int, nr_freq: int) -> _Group:
+        self.outputs.setdefault(port, []).append(_Group(nr_freq))
+        return self.outputs[port][-1]
+
+    def add_input_group(self, port: int, nr_freq: int) -> _Group:
+        self.inputs.setdefault(port, []).append(_Group(nr_freq))
+        return self.inputs[port][-1]
+
+    def sweep_nco(
+        self, input_port, input_freqs, output_port, output_freqs, nr_averages, status_callback=None
+    ):
+        ig = self.inputs[input_port][-1]
+        pixels_i = np.zeros((len(input_freqs), len(ig.freqs)), np.complex128)
+        pixels_q = np.zeros_like(pixels_i)
+        for kk, (nco_in, nco_out) in enumerate(zip(input_freqs, output_freqs)):
+            # complex amplitude of each output frequency, from the upper and lower sidebands
+            freqs = []
+            amps = []
+            for og in self.outputs[output_port]:
+                ph_i = og.amps / 2 * np.exp(1j * og.phases_i)
+                ph_q = og.amps / 2 * np.exp(1j * og.phases_q)
+                freqs += [nco_out + og.freqs, nco_out - og.freqs]
+                amps += [ph_i + 1j * ph_q, np.conj(ph_i) + 1j * np.conj(ph_q)]
+            freqs = np.concatenate(freqs)
+            amps = np.concatenate(amps) * self.response(freqs)
+            # I + iQ after the input mixer is the sum of amps * exp(i 2 pi (freqs - nco_in) t)
+            offset = freqs - nco_in
+            for jj, f in enumerate(ig.freqs):
+                upper = np.sum(amps[np.isclose(offset, f)])
+                lower = np.sum(amps[np.isclose(offset, -f)])
+                weight = 0.5 if f == 0.0 else 1.0  # the mean of both at 0 Hz
+                pixels_i[kk, jj] = weight * (upper + np.conj(lower))
+                pixels_q[kk, jj] = weight * (-1j * upper + 1j * np.conj(lower))
+            if status_callback is not None:
+                status_callback()
+        return {input_port: (ig.freqs, pixels_i, pixels_q)}
+
+
+def install() -> None:
+    """Make `presto` importable with these stand-ins, if the real package is missing"""
+    if importlib.util.find_spec("presto") is not None:
+        return
+    package = types.ModuleType("presto")
+    pulsed = types.ModuleType("presto.pulsed")
+    pulsed.Pulsed = FakePulsed  # type: ignore
+    pulsed.MAX_TEMPLATE_LEN = 4096  # type: ignore
+    hardware = types.ModuleType("presto.hardware")
+    hardware.AdcMode = enum.Enum("AdcMode", "Direct Mixed")  # type: ignore
+    hardware.DacMode = enum.Enum("DacMode", "Direct Mixed")  # type: ignore
+    utils = types.ModuleType("presto.utils")
+    utils.sin2 = lambda nr_samples, drag=0.0: np.sin(  # type: ignore
+        np.pi * np.arange(nr_samples) / nr_samples
+    ) ** 2 * (1.0 + 0j)
+    utils.ProgressBar = lambda *args, **kwargs: mock.MagicMock()  # type: ignore
+    utils.rotate_opt = lambda data, return_x=False: (  # type: ignore
+        (data, 0.0) if return_x else data
+    )
+    utils.si_prefix_scale = lambda values: ("", 1.0)  # type: ignore
+    utils.format_precision = lambda value, error: f"{value} +/- {error}"  # type: ignore
+    lockin = types.ModuleType("presto.lockin")
+    lockin.Lockin = FakeLockin  # type: ignore
+    package.pulsed = pulsed  # type: ignore
+    package.hardware = hardware  # type: ignore
+    package.utils = utils  # type: ignore
+    package.lockin = lockin  # type: ignore
+    for module in (package, pulsed, hardware, utils, lockin):
+        sys.modules[module.__name__] = module
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import h5py
+import numpy as np
+import pytest
+
+from _base import project
+
+
+def _project_loop(resp_arr, reference_templates):
+    # the per-trace projection that project replaces
+    ref_g, ref_e = reference_templates
+    conj_g = ref_g.conj()
+    conj_e = ref_e.conj()
+    norm_g = np.sum(ref_g * conj_g).real
+    norm_e = np.sum(ref_e * conj_e).real
+    overlap = np.sum(ref_g * conj_e).real
+    proj_g = np.zeros(resp_arr.shape[0])
+    proj_e = np.zeros(resp_arr.shape[0])
+    for i in range(resp_arr.shape[0]):
+        proj_g[i] = np.sum(conj_g * resp_arr[i, :]).real
+        proj_e[i] = np.sum(conj_e * resp_arr[i, :]).real
+    res = proj_e - proj_g
+    res_g = overlap - norm_g
+    res_e = norm_e - overlap
+    return (res - res_g) / (res_e - res_g)
+
+
+def _traces(nr_traces=50, nr_samples=64):
+    rng = np.random.default_rng(1234)
+    t = np.arange(nr_samples)
+    ref_g = np.exp(2j * np.pi * t / 40) * (1 - np.exp(-t / 10))
+    ref_e = 0.7 * np.exp(2j * np.pi * t / 40 + 1.0) * (1 - np.exp(-t / 10))
+    states = rng.integers(2, size=nr_traces)
+    resp_arr = np.where(states[:, None] == 1, ref_e, ref_g) + 0.3 * (
+        rng.standard_normal((nr_traces, nr_samples))
+        + 1j * rng.standard_normal((nr_traces, nr_samples))
+    )
+    return resp_arr, (ref_g, ref_e)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7, 50, 1000])
+def test_project_matches_loop(chunk_size):
+    resp_arr, templates = _traces()
+    expected = _project_loop(resp_arr, templates)
+    np.testing.assert_allclose(project(resp_arr, templates, chunk_size=chunk_size), expected)
+    np.testing.assert_allclose(
+        project(resp_arr, templates, True, chunk_size), expected, rtol=0, atol=1e-5
+    )
+
+
+def test_project_from_dataset(tmp_path):
+    resp_arr, templates = _traces()
+    with h5py.File(tmp_path / "traces.h5", "w") as h5f:
+        h5f.create_dataset("resp_arr", data=resp_arr)
+    with h5py.File(tmp_path / "traces.h5", "r") as h5f:
+        data = project(h5f["resp_arr"], templates, chunk_size=16)
+    np.testing.assert_allclose(data, _project_loop(resp_arr, templates))
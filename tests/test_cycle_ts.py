@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import signal
+import threading
+import time
+
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+
+from fake_presto import FakePulsed  # noqa: E402
+
+import cycle_Ts  # noqa: E402
+import t1  # noqa: E402
+from _appender import Appender  # noqa: E402
+from cycle_Ts import CycleTs  # noqa: E402
+
+RUN_TIME = 0.05  # s, of each fake run, and of processing its result
+NR_RUNS = 6  # Ctrl-C during the last one
+
+
+def _cycle_ts() -> CycleTs:
+    return CycleTs(
+        readout_freq=6e9,
+        control_freq=4e9,
+        readout_amp=0.1,
+        control_amp_90=0.25,
+        control_amp_180=0.5,
+        readout_duration=1e-6,
+        control_duration=20e-9,
+        sample_duration=50e-9,
+        delay_arr=np.linspace(0.0, 50e-6, 11),
+        readout_port=1,
+        control_port=2,
+        sample_port=1,
+        wait_delay=100e-6,
+        readout_sample_delay=200e-9,
+        num_averages=10,
+    )
+
+
+@pytest.fixture
+def instrument(monkeypatch, tmp_path):
+    """Start and stop time of each run of a `FakePulsed` that takes `RUN_TIME`"""
+    runs = []
+
+    class SlowPulsed(FakePulsed):
+        def run(self, period: float, repeat_count: int, num_averages: int) -> None:
+            t_start = time.time()
+            time.sleep(RUN_TIME)
+            super().run(period, repeat_count, num_averages)
+            runs.append((t_start, time.time()))
+            if len(runs) == NR_RUNS:
+                cycle_Ts._handler(signal.SIGINT, None)  # Ctrl-C
+
+    monkeypatch.setattr(t1.pulsed, "Pulsed", SlowPulsed)  # also ramsey_echo's
+    monkeypatch.setattr(cycle_Ts, "KEEP_GOING", True)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    save_path = str(tmp_path / "cycle_Ts.h5")
+    monkeypatch.setattr(CycleTs, "_save_path", lambda self, script_path, name=None: save_path)
+    sigint = signal.getsignal(signal.SIGINT)
+    yield runs
+    signal.signal(signal.SIGINT, sigint)
+
+
+def test_stop_saves_last_run_and_joins(instrument, monkeypatch):
+    threads_at_close = []
+    close = Appender.close
+
+    def recording_close(self):
+        threads_at_close.append([t for t in threading.enumerate() if t.is_alive()])
+        close(self)
+
+    monkeypatch.setattr(Appender, "close", recording_close)
+    nr_threads = threading.active_count()
+
+    m = _cycle_ts()
+    m.run("fake")
+
+    # no new run after Ctrl-C, but the one in progress is kept
+    assert len(instrument) == NR_RUNS
+    saved = CycleTs.load(m._save_filename)
+    assert len(saved._t1_arr) + len(saved._t2_arr) == NR_RUNS
+    # the worker is joined before the save file is closed
+    assert threads_at_close[-1] == [threading.main_thread()]
+    assert threading.active_count() == nr_threads
+
+
+def test_acquire_while_processing(instrument, monkeypatch):
+    process = CycleTs._process
+
+    def slow_process(self, item, line_t1, line_t2):
+        time.sleep(RUN_TIME)
+        return process(self, item, line_t1, line_t2)
+
+    monkeypatch.setattr(CycleTs, "_process", slow_process)
+
+    _cycle_ts().run("fake")
+
+    # one after the other, the instrument would be busy half of the time
+    busy = sum(t_stop - t_start for t_start, t_stop in instrument)
+    assert busy > 0.75 * (instrument[-1][1] - instrument[0][0])
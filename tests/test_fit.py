@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from _fit import (
+    _matrix_pencil,
+    damped_cosine,
+    damped_cosine_p0,
+    decay,
+    fit_damped_cosine_p0,
+    fit_decay,
+    optimal_decay_delays,
+)
+
+DELAY_ARR = np.linspace(0.0, 100e-6, 21)
+
+
+@pytest.mark.parametrize("T", [15e-6, 40e-6], ids=["T1", "T2"])
+def test_optimal_decay_delays_lower_spread(T):
+    # as in CycleTs: each design is on the fit of the previous trace, measured on the fixed grid
+    rng = np.random.default_rng(1234)
+    fixed = []
+    adaptive = []
+    for _ in range(300):
+        y = decay(DELAY_ARR, T, 1.0, 0.0) + 0.05 * rng.standard_normal(len(DELAY_ARR))
+        fixed.append(fit_decay(DELAY_ARR, y)[0][0])
+        delays = optimal_decay_delays(fixed[-1], DELAY_ARR[0], DELAY_ARR[-1], len(DELAY_ARR))
+        y = decay(delays, T, 1.0, 0.0) + 0.05 * rng.standard_normal(len(delays))
+        adaptive.append(fit_decay(delays, y)[0][0])
+
+    # same number of points and noise, so the same measurement time
+    assert np.std(adaptive) < 0.8 * np.std(fixed)
+    assert abs(np.mean(adaptive) - T) < 3 * np.std(adaptive) / np.sqrt(len(adaptive))
+
+
+def _damped_cosines(noise):
+    rng = np.random.default_rng(1234)
+    t = np.linspace(0.0, 10e-6, 101)
+    popt = np.stack(
+        (
+            rng.uniform(-0.5, 0.5, 50),
+            rng.uniform(0.2, 1.0, 50),
+            rng.uniform(1e-6, 10e-6, 50),
+            rng.uniform(0.2e6, 5e6, 50),
+            rng.uniform(-np.pi, np.pi, 50),
+        ),
+        axis=-1,
+    )
+    y = damped_cosine(t, *popt.T[:, :, None]) + noise * rng.standard_normal((50, len(t)))
+    return t, y, popt
+
+
+def test_matrix_pencil_batched():
+    _t, y, _popt = _damped_cosines(0.05)
+    z = _matrix_pencil(y, 3)
+    for row, row_z in zip(y, z):
+        np.testing.assert_allclose(np.sort_complex(row_z), np.sort_complex(_matrix_pencil(row, 3)))
+
+
+def test_fit_damped_cosine_p0():
+    t, y, popt = _damped_cosines(0.0)
+    y[3] = np.nan
+    p0 = fit_damped_cosine_p0(t, y)
+    np.testing.assert_array_equal(p0[3], damped_cosine_p0(t, y[3])[0])
+    ok = np.arange(len(y)) != 3
+    # exact without noise, the phase up to 2 pi
+    np.testing.assert_allclose(p0[ok, :4], popt[ok, :4], rtol=1e-6)
+    np.testing.assert_allclose(np.exp(1j * p0[ok, 4]), np.exp(1j * popt[ok, 4]), atol=1e-6)
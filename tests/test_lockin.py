@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import importlib
+import inspect
+import warnings
+
+import numpy as np
+import pytest
+
+from fake_presto import FakeLockin
+
+import sweep_freq_and_DC
+from _lockin import add_tone_groups, sweep_freq, sweep_freq_multi, tone_plan
+
+DF = 1e6
+FREQ_ARR = 6e9 + DF * np.arange(-50, 51)
+
+
+def _response(f):
+    # notch with an electrical delay: the phase winds one way only, so the sign shows
+    return (1.0 - 0.8 / (1.0 + 2j * (f - 6.01e9) / 5e6)) * np.exp(-2j * np.pi * f * 20e-9)
+
+
+def _sweep_single(amp):
+    lck = FakeLockin(_response)
+    og = lck.add_output_group(1, 1)
+    og.set_frequencies(0.0)
+    og.set_amplitudes(amp)
+    og.set_phases(0.0, 0.0)
+    ig = lck.add_input_group(1, 1)
+    ig.set_frequencies(0.0)
+    return sweep_freq(lck, 1, 1, FREQ_ARR, 1)
+
+
+def test_sweep_freq_response():
+    # at zero IF, phases (0, 0) output the tone on both I and Q
+    np.testing.assert_allclose(_sweep_single(0.1), 0.1 * (1 + 1j) * _response(FREQ_ARR))
+
+
+def test_sweep_freq_multi_matches_single():
+    if_idx, nco_idx = tone_plan(len(FREQ_ARR), 8)
+    assert len(if_idx) > 1
+    lck = FakeLockin(_response)
+    add_tone_groups(lck, 1, 1, 0.1, DF * if_idx)
+    resp = sweep_freq_multi(lck, 1, 1, FREQ_ARR, 1, if_idx, nco_idx)
+    np.testing.assert_allclose(resp, _sweep_single(0.1))
+
+
+@pytest.mark.parametrize(
+    "module, name",
+    [
+        ("jpa_sweep_bias", "JpaSweepBias"),
+        ("jpa_sweep_power_bias", "JpaSweepPowerBias"),
+        ("sweep_freq_and_DC", "SweepFreqAndDC"),
+        ("sweep_freq_and_DC_flux", "SweepFreqAndDC"),
+        ("sweep", "Sweep"),
+        ("sweep_power", "SweepPower"),
+        ("two_tone_power", "TwoTonePower"),
+    ],
+)
+def test_num_skip_deprecated(module, name):
+    cls = getattr(importlib.import_module(module), name)
+    params = list(inspect.signature(cls.__init__).parameters.values())[1:]
+    kwargs = {p.name: 1 for p in params if p.default is inspect.Parameter.empty}
+
+    with pytest.warns(FutureWarning, match="num_skip") as record:
+        cls(**kwargs, num_skip=10)
+    assert record[0].filename == __file__  # points at the caller
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        cls(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "reorder, expected",
+    [(True, [0.4, 0.2, 0.1, -0.3]), (False, [0.2, -0.3, 0.4, 0.1])],
+)
+def test_sweep_freq_and_dc_bias_order(monkeypatch, tmp_path, reorder, expected):
+    ramps = []
+
+    class BiasLockin(FakeLockin):
+        def __init__(self, **kwargs) -> None:
+            super().__init__(_response, **kwargs)
+            self.hardware.get_dc_bias.return_value = (0.5, 2)
+            self.hardware._dc_max_min.return_value = (3.33, -3.33)
+            self.hardware.ramp_dc_bias.side_effect = lambda bias, *args: ramps.append(bias)
+
+    monkeypatch.setattr(sweep_freq_and_DC.lockin, "Lockin", BiasLockin)
+    save_path = str(tmp_path / "sweep_freq_and_DC.h5")
+    monkeypatch.setattr(
+        sweep_freq_and_DC.SweepFreqAndDC, "_save_path", lambda self, *args, **kwargs: save_path
+    )
+    bias_arr = [0.2, -0.3, 0.4, 0.1]
+    cls = sweep_freq_and_DC.SweepFreqAndDC
+    m = cls(6e9, 10e6, 1e6, 1, 0.1, bias_arr, 1, 1, 3, reorder=reorder)
+    m.run("fake")
+
+    assert ramps[-len(bias_arr) :] == expected
+    # rows stay in the order of bias_arr, whichever way they were measured
+    expected_resp = 0.1 * (1 + 1j) * _response(m.freq_arr)
+    np.testing.assert_allclose(m.resp_arr, np.broadcast_to(expected_resp, m.resp_arr.shape))
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from fake_presto import FakePulsed
+
+import rb
+from rb import Rb
+
+
+def _rb(rb_len_arr=(1, 4, 9), rb_nr_realizations=3) -> Rb:
+    return Rb(
+        readout_freq=6e9,
+        control_freq=4e9,
+        readout_amp=0.1,
+        control_amp=0.5,
+        readout_duration=1e-6,
+        control_duration=20e-9,
+        sample_duration=50e-9,
+        readout_port=1,
+        control_port=2,
+        sample_port=1,
+        wait_delay=10e-6,
+        readout_sample_delay=200e-9,
+        num_averages=10,
+        rb_len_arr=rb_len_arr,
+        rb_nr_realizations=rb_nr_realizations,
+        rb_seed=1234,
+    )
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """The `FakePulsed` opened by each connection, in order"""
+    opened = []
+
+    def connect(**kwargs):
+        pls = FakePulsed(**kwargs)
+        opened.append(pls)
+        return pls
+
+    monkeypatch.setattr(rb.pulsed, "Pulsed", connect)
+    monkeypatch.setattr(Rb, "RB_CACHE_DIR", None)
+    monkeypatch.setattr(Rb, "save", lambda self, save_filename=None: "")
+    return opened
+
+
+def _expected(sequence):
+    # signature of FakePulsed: number of SX pulses, and sum of their virtual-Z phases
+    vphase = 0
+    count = 0
+    total = 0
+    for gate in sequence:
+        if gate[0] == "rz":
+            vphase = (vphase + gate[1]) % 4
+        else:
+            count += 1
+            total += vphase
+    return count + 1j * total
+
+
+def _pulses(events):
+    return [value for _T, kind, value in events if kind == "pulse" and value != "readout"]
+
+
+def test_session_runs_only_own_sequence(sessions):
+    m = _rb()
+    m.run("fake", reuse_session=True)
+
+    assert len(sessions) == 1
+    pls = sessions[0]
+    sequences = [seq for realization in m._rb_sequences for seq in realization]
+    assert len(pls.runs) == len(sequences)
+    for events, seq in zip(pls.runs, sequences):
+        assert [kind for _T, kind, _value in events].count("store") == 1
+        assert len(_pulses(events)) == int(_expected(seq).real)
+    for i, realization in enumerate(m._rb_sequences):
+        for j, seq in enumerate(realization):
+            assert np.all(m.store_arr[i, j] == _expected(seq))
+
+
+def test_session_matches_reconnecting(sessions):
+    m_new = _rb()
+    m_new.run("fake")
+    nr_connections = len(sessions)
+    m_session = _rb()
+    m_session.run("fake", reuse_session=True)
+
+    assert nr_connections == m_new.rb_nr_realizations * len(m_new.rb_len_arr)
+    assert len(sessions) == nr_connections + 1
+    assert np.array_equal(m_session.store_arr, m_new.store_arr)
+
+
+def test_session_needs_reset(sessions, monkeypatch):
+    monkeypatch.delattr(FakePulsed, "reset")
+    with pytest.raises(RuntimeError):
+        _rb().run("fake", reuse_session=True)
+
+
+@pytest.mark.parametrize("mode", ["reconnect", "reuse_session", "batch"])
+def test_templates_set_up_once_per_session(sessions, monkeypatch, mode):
+    monkeypatch.setattr(Rb, "BATCH_MAX_PULSES", 12)  # a few batches
+    counts = {}
+    setup_template = FakePulsed.setup_template
+
+    def counting_setup_template(self, *args, **kwargs):
+        counts[id(self)] = counts.get(id(self), 0) + 1
+        return setup_template(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakePulsed, "setup_template", counting_setup_template)
+    m = _rb()
+    if mode == "reconnect":
+        m.run("fake")
+    else:
+        m.run("fake", **{mode: True})
+
+    # the four phases of the control pulse, once per connection
+    assert [counts[id(pls)] for pls in sessions] == [4] * len(sessions)
+    if mode != "reconnect":
+        assert len(sessions) == 1
+        assert len(sessions[0].runs) > 1
+
+
+def test_schedule_batches_limits():
+    sequences = [[("sx",)] * n for n in (3, 4, 2, 5, 1, 1, 6)]
+    batches = rb._schedule_batches(sequences, max_pulses=7, max_stores=2)
+    assert batches == [[0, 1], [2, 3], [4, 5], [6]]
+    assert [kk for batch in batches for kk in batch] == list(range(len(sequences)))
+    with pytest.raises(ValueError):
+        rb._schedule_batches(sequences, max_pulses=5, max_stores=2)
+
+
+@pytest.mark.parametrize(
+    "max_pulses, max_store_samples, nr_batches",
+    [(10**6, 2**20, 1), (12, 2**20, None), (10**6, 100, 5)],
+)
+def test_batched_matches_session(
+    sessions, monkeypatch, max_pulses, max_store_samples, nr_batches
+):
+    monkeypatch.setattr(Rb, "BATCH_MAX_PULSES", max_pulses)
+    monkeypatch.setattr(Rb, "BATCH_MAX_STORE_SAMPLES", max_store_samples)
+    m_session = _rb()
+    m_session.run("fake", reuse_session=True)
+    m_batch = _rb()
+    m_batch.run("fake", batch=True)
+
+    pls = sessions[-1]
+    sequences = [seq for realization in m_batch._rb_sequences for seq in realization]
+    batches = rb._schedule_batches(
+        sequences, max_pulses, max(1, max_store_samples // m_batch.store_arr.shape[-1])
+    )
+    if nr_batches is None:
+        assert len(batches) > 1  # limited by the number of pulses
+    else:
+        assert len(batches) == nr_batches
+    assert len(pls.runs) == len(batches)
+    assert pls.nr_resets == len(batches)
+    for events, batch in zip(pls.runs, batches):
+        # each run has the stores of its own sequences only, in order
+        assert [kind for _T, kind, _value in events].count("store") == len(batch)
+        assert len(_pulses(events)) == sum(int(_expected(sequences[kk]).real) for kk in batch)
+    # results in the (realization, length) slot of their sequence, across batch boundaries
+    assert np.array_equal(m_batch.store_arr, m_session.store_arr)
+
+
+def _unitary(seq):
+    # product of the gates of `seq`, applied in order, built independently of rb's tables
+    sx = np.array([[1, -1j], [-1j, 1]]) / np.sqrt(2)
+    u = np.eye(2, dtype=np.complex128)
+    for gate in seq:
+        if gate[0] == "rz":
+            u = np.diag([np.exp(-0.25j * np.pi * gate[1]), np.exp(0.25j * np.pi * gate[1])]) @ u
+        else:
+            u = sx @ u
+    return u
+
+
+def _equal_up_to_phase(u, v):
+    return abs(abs(np.trace(u.conj().T @ v)) - 2.0) < 1e-9
+
+
+def test_clifford_gates_distinct():
+    unitaries = [_unitary(gates) for gates in rb._CLIFFORD_GATES]
+    assert len(unitaries) == 24
+    for ii, u in enumerate(unitaries):
+        assert not any(_equal_up_to_phase(u, v) for v in unitaries[:ii])
+
+
+def test_native_sequences_compose_to_identity():
+    lengths = [1, 2, 5, 17, 100]
+    for realization in rb._native_singlequbitrb(lengths, num_samples=20, seed=1234):
+        assert len(realization) == len(lengths)
+        for seq in realization:
+            assert _equal_up_to_phase(_unitary(seq), np.eye(2))
+
+
+def test_clifford_tables_match_qiskit():
+    pytest.importorskip("qiskit")
+    from qiskit import QuantumCircuit
+    from qiskit.quantum_info import Operator
+
+    def circuit(gates):
+        qc = QuantumCircuit(1)
+        for gate in gates:
+            if gate[0] == "rz":
+                qc.rz(gate[1] * np.pi / 2, 0)
+            else:
+                qc.sx(0)
+        return qc
+
+    operators = [Operator(circuit(gates)) for gates in rb._CLIFFORD_GATES]
+    for gates, op in zip(rb._CLIFFORD_GATES, operators):
+        assert op.equiv(Operator(_unitary(gates)))
+    for a, op_a in enumerate(operators):
+        for b, op_b in enumerate(operators):
+            # compose(b): first a, then b
+            assert op_a.compose(op_b).equiv(operators[rb._CLIFFORD_COMPOSE[a][b]])
+        assert op_a.compose(operators[rb._CLIFFORD_INVERSE[a]]).equiv(Operator(np.eye(2)))
+
+
+def test_qiskit_sequences_compose_to_identity():
+    pytest.importorskip("qiskit_experiments")
+    for seq in rb._singlequbitrb_realization([1, 5, 20], seed=1234):
+        assert _equal_up_to_phase(_unitary(seq), np.eye(2))
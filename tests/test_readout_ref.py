@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from readout_ref import _window_search
+
+
+def _window_search_loop(distance, match_len):
+    # the nested loop that _window_search replaces, for a single length
+    max_idx = 0
+    max_dist = 0.0
+    for idx in range(0, len(distance) - match_len, 2):
+        dist = np.sum(distance[idx : idx + match_len])
+        if dist > max_dist:
+            max_dist = dist
+            max_idx = idx
+    return max_idx, max_dist
+
+
+def _distance(nr_samples=500):
+    rng = np.random.default_rng(1234)
+    t = np.arange(nr_samples)
+    # a response that rises and decays, in noise
+    return np.abs(np.exp(-((t - 200) / 60) ** 2) + 0.2 * rng.standard_normal(nr_samples))
+
+
+@pytest.mark.parametrize("match_len", [1, 2, 37, 100, 499, 500, 600])
+def test_window_search_matches_loop(match_len):
+    distance = _distance()
+    max_idx, best, scores = _window_search(distance, np.array([match_len]))
+    expected_idx, expected_dist = _window_search_loop(distance, match_len)
+    assert best == 0
+    assert max_idx == expected_idx
+    for idx in range(len(distance) - match_len):
+        assert scores[0, idx] == pytest.approx(np.sum(distance[idx : idx + match_len]))
+    assert np.all(np.isnan(scores[0, max(len(distance) - match_len, 0) :]))
+    if expected_dist > 0.0:
+        assert scores[0, max_idx] == pytest.approx(expected_dist)
+
+
+def test_window_search_several_lengths():
+    distance = _distance()
+    match_len_arr = np.array([20, 50, 80, 150, 300])
+    max_idx, best, _scores = _window_search(distance, match_len_arr)
+    # the loop for each length, the best by summed distance over the noise of the window
+    results = [_window_search_loop(distance, match_len) for match_len in match_len_arr]
+    expected = int(np.argmax([dist / np.sqrt(n) for (_, dist), n in zip(results, match_len_arr)]))
+    assert best == expected
+    assert max_idx == results[expected][0]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from _rotate import optimal_angle, rotate_opt
+
+
+def _to_pm_pi(x):
+    return (x + np.pi) % (2 * np.pi) - np.pi
+
+
+def _angle_fft(data):
+    # the search that readout_ref._rotate_opt used before optimal_angle
+    N = 360
+    _mean = np.zeros(N)
+    for ii in range(N):
+        _data = data * np.exp(1j * 2 * np.pi / N * ii)
+        _mean[ii] = np.mean(_data.imag**2)
+    fft = np.fft.rfft(_mean) / N
+    x_fft1 = -np.angle(fft[2])
+    x_fft1 -= np.pi
+    x_fft1 /= 2
+    x_fft2 = x_fft1 + np.pi
+    x_fft1 = _to_pm_pi(x_fft1)
+    x_fft2 = _to_pm_pi(x_fft2)
+    if np.abs(x_fft1) < np.abs(x_fft2):
+        return x_fft1
+    else:
+        return x_fft2
+
+
+def _angle_brute_force(data, nr_angles=20_000):
+    # the angle in (-pi/2, pi/2] with the smallest variance of Q, on a fine grid
+    angles = np.linspace(np.pi / 2, -np.pi / 2, nr_angles, endpoint=False)[::-1]
+    q_arr = (data[None, :] * np.exp(1j * angles[:, None])).imag
+    return angles[np.argmin(np.var(q_arr, axis=-1))]
+
+
+def _clouds(angle, offset, seed):
+    # elongated along `angle`, away from the origin
+    rng = np.random.default_rng(seed)
+    data = 2.0 * rng.standard_normal(500) + 0.3j * rng.standard_normal(500)
+    return data * np.exp(1j * angle) + offset
+
+
+ANGLES = [-1.5, -0.7, 0.0, 0.2, 1.1, 1.56]
+
+
+@pytest.mark.parametrize("angle", ANGLES)
+def test_uncentered_matches_fft_search(angle):
+    data = _clouds(angle, 0.0, 1234)
+    assert optimal_angle(data, centered=False) == pytest.approx(_angle_fft(data), abs=1e-9)
+
+
+@pytest.mark.parametrize("angle", ANGLES)
+def test_matches_brute_force(angle):
+    data = _clouds(angle, 3.0 - 4.0j, 1234)
+    assert optimal_angle(data) == pytest.approx(_angle_brute_force(data), abs=2e-4)
+    assert np.var(rotate_opt(data).imag) <= np.var(data.imag)
+
+
+def test_axis_rotates_each_trace():
+    data = np.array([_clouds(angle, 1.0j, seed) for seed, angle in enumerate(ANGLES)])
+    rotated, x = rotate_opt(data, True, axis=-1)
+    assert x.shape == (len(ANGLES),)
+    for row, row_rotated, row_x in zip(data, rotated, x):
+        assert row_x == pytest.approx(optimal_angle(row))
+        np.testing.assert_allclose(row_rotated, row * np.exp(1j * row_x))
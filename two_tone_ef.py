@@ -3,17 +3,15 @@
 Find |e> -> |f> transition with two-tone spectroscopy with Pulsed mode.
 """
 
-import ast
 from typing import Optional
 
-import h5py
 import numpy as np
-import numpy.typing as npt
 
 from presto import pulsed
-from presto.utils import rotate_opt, sin2
+from presto.utils import sin2
 
 from _base import Base
+from _rotate import rotate_opt
 
 IDX_LOW = 0
 IDX_HIGH = -1
@@ -205,61 +203,6 @@ class TwoToneEF(Base):
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "TwoToneEF":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            ge_freq = float(h5f.attrs["ge_freq"])  # type: ignore
-            alpha_center = float(h5f.attrs["alpha_center"])  # type: ignore
-            alpha_span = float(h5f.attrs["alpha_span"])  # type: ignore
-            alpha_nr = int(h5f.attrs["alpha_nr"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            ge_amp = float(h5f.attrs["ge_amp"])  # type: ignore
-            ef_amp = float(h5f.attrs["ef_amp"])  # type: ignore
-            readout_duration = float(h5f.attrs["readout_duration"])  # type: ignore
-            ge_duration = float(h5f.attrs["ge_duration"])  # type: ignore
-            ef_duration = float(h5f.attrs["ef_duration"])  # type: ignore
-            sample_duration = float(h5f.attrs["sample_duration"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            sample_port = int(h5f.attrs["sample_port"])  # type: ignore
-            wait_delay = float(h5f.attrs["wait_delay"])  # type: ignore
-            readout_sample_delay = float(h5f.attrs["readout_sample_delay"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-
-            jpa_params: dict = ast.literal_eval(h5f.attrs["jpa_params"])  # type: ignore
-
-            t_arr: npt.NDArray[np.float64] = h5f["t_arr"][()]  # type: ignore
-            store_arr: npt.NDArray[np.complex128] = h5f["store_arr"][()]  # type: ignore
-            alpha_arr: npt.NDArray[np.float64] = h5f["alpha_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            ge_freq=ge_freq,
-            alpha_center=alpha_center,
-            alpha_span=alpha_span,
-            alpha_nr=alpha_nr,
-            readout_amp=readout_amp,
-            ge_amp=ge_amp,
-            ef_amp=ef_amp,
-            readout_duration=readout_duration,
-            ge_duration=ge_duration,
-            ef_duration=ef_duration,
-            sample_duration=sample_duration,
-            readout_port=readout_port,
-            control_port=control_port,
-            sample_port=sample_port,
-            wait_delay=wait_delay,
-            readout_sample_delay=readout_sample_delay,
-            num_averages=num_averages,
-            jpa_params=jpa_params,
-        )
-        self.t_arr = t_arr
-        self.store_arr = store_arr
-        self.alpha_arr = alpha_arr
-
-        return self
-
     def analyze(self, all_plots: bool = False):
         assert self.t_arr is not None
         assert self.store_arr is not None
@@ -5,14 +5,15 @@ Two-tone spectroscopy in Lockin mode: 2D sweep of pump power and frequency, with
 
 from typing import List, Optional, Union
 
-import h5py
 import numpy as np
 import numpy.typing as npt
 
 from presto import lockin
-from presto.utils import ProgressBar, rotate_opt
+from presto.utils import ProgressBar
 
 from _base import Base
+from _lockin import check_num_skip, sweep_freq
+from _rotate import rotate_opt
 
 
 class TwoTonePower(Base):
@@ -42,7 +43,7 @@ class TwoTonePower(Base):
         self.input_port = input_port
         self.num_averages = num_averages
         self.dither = dither
-        self.num_skip = num_skip
+        check_num_skip(num_skip)  # deprecated, not used
 
         self.control_freq_arr = None  # replaced by run
         self.resp_arr = None  # replaced by run
@@ -108,27 +109,25 @@ class TwoTonePower(Base):
             lck.apply_settings()
             lck.hardware.dac_autoconfig = False
 
+            self._stream_open(__file__, {"resp_arr": (self.resp_arr.shape, np.complex128)})
+
             pb = ProgressBar(nr_amps * nr_freq)
             pb.start()
             for jj, control_amp in enumerate(self.control_amp_arr):
                 ogc.set_amplitudes(control_amp)
                 lck.apply_settings()
 
-                for ii, control_freq in enumerate(self.control_freq_arr):
-                    lck.hardware.configure_mixer(
-                        freq=control_freq,
-                        out_ports=self.control_port,
-                    )
-                    lck.apply_settings()
-
-                    _d = lck.get_pixels(self.num_skip + self.num_averages, quiet=True)
-                    data_i = _d[self.input_port][1][:, 0]
-                    data_q = _d[self.input_port][2][:, 0]
-                    data = data_i.real + 1j * data_q.real  # using zero IF
-
-                    self.resp_arr[jj, ii] = np.mean(data[-self.num_averages :])
-
-                    pb.increment()
+                # sweep the control, keep the readout
+                self.resp_arr[jj] = sweep_freq(
+                    lck,
+                    self.input_port,
+                    self.control_port,
+                    self.control_freq_arr,
+                    self.num_averages,
+                    input_freq=self.readout_freq,
+                    status_callback=pb.increment,
+                )
+                self._stream_write("resp_arr", jj, self.resp_arr[jj])
 
             pb.done()
 
@@ -137,49 +136,11 @@ class TwoTonePower(Base):
             ogc.set_amplitudes(0.0)
             lck.apply_settings()
 
-        return self.save()
+        return self._stream_close()
 
     def save(self, save_filename: Optional[str] = None) -> str:
         return super()._save(__file__, save_filename=save_filename)
 
-    @classmethod
-    def load(cls, load_filename: str) -> "TwoTonePower":
-        with h5py.File(load_filename, "r") as h5f:
-            readout_freq = float(h5f.attrs["readout_freq"])  # type: ignore
-            control_freq_center = float(h5f.attrs["control_freq_center"])  # type: ignore
-            control_freq_span = float(h5f.attrs["control_freq_span"])  # type: ignore
-            df = float(h5f.attrs["df"])  # type: ignore
-            readout_amp = float(h5f.attrs["readout_amp"])  # type: ignore
-            readout_port = int(h5f.attrs["readout_port"])  # type: ignore
-            control_port = int(h5f.attrs["control_port"])  # type: ignore
-            input_port = int(h5f.attrs["input_port"])  # type: ignore
-            num_averages = int(h5f.attrs["num_averages"])  # type: ignore
-            dither = bool(h5f.attrs["dither"])  # type: ignore
-            num_skip = int(h5f.attrs["num_skip"])  # type: ignore
-
-            control_amp_arr: npt.NDArray[np.float64] = h5f["control_amp_arr"][()]  # type: ignore
-            control_freq_arr: npt.NDArray[np.float64] = h5f["control_freq_arr"][()]  # type: ignore
-            resp_arr: npt.NDArray[np.complex128] = h5f["resp_arr"][()]  # type: ignore
-
-        self = cls(
-            readout_freq=readout_freq,
-            control_freq_center=control_freq_center,
-            control_freq_span=control_freq_span,
-            df=df,
-            readout_amp=readout_amp,
-            control_amp_arr=control_amp_arr,
-            readout_port=readout_port,
-            control_port=control_port,
-            input_port=input_port,
-            num_averages=num_averages,
-            dither=dither,
-            num_skip=num_skip,
-        )
-        self.control_freq_arr = control_freq_arr
-        self.resp_arr = resp_arr
-
-        return self
-
     def analyze(self, quantity: str = "quadrature", linecut: bool = False, blit: bool = False):
         if self.control_freq_arr is None:
             raise RuntimeError